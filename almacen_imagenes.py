@@ -0,0 +1,136 @@
+import os
+import uuid
+import base64
+import threading
+import cv2
+import numpy as np
+import gridfs
+from bson import ObjectId
+
+# Dónde se guardan las imágenes en resolución completa: "gridfs" (en la misma base de datos)
+# o "local" (archivos en disco, útil cuando la captura y el dashboard corren en el mismo equipo)
+ALMACEN_IMAGENES = os.environ.get("ALMACEN_IMAGENES", "gridfs")
+RUTA_IMAGENES_LOCAL = os.environ.get("RUTA_IMAGENES_LOCAL", "imagenes")
+BUCKET_GRIDFS = "imagenes"
+
+ANCHO_MINIATURA = 320
+CALIDAD_JPEG = 90
+CALIDAD_MINIATURA = 70
+
+# --- BACKENDS DE ALMACENAMIENTO ---
+class AlmacenGridFS:
+    nombre = "gridfs"
+
+    def __init__(self, db, bucket=BUCKET_GRIDFS):
+        self.fs = gridfs.GridFSBucket(db, bucket_name=bucket)
+
+    def guardar(self, datos, nombre, metadatos=None):
+        return str(self.fs.upload_from_stream(nombre, datos, metadata=metadatos or {}))
+
+    def leer(self, referencia):
+        return self.fs.open_download_stream(ObjectId(referencia)).read()
+
+    def eliminar(self, referencia):
+        self.fs.delete(ObjectId(referencia))
+
+class AlmacenLocal:
+    nombre = "local"
+
+    def __init__(self, ruta=RUTA_IMAGENES_LOCAL):
+        self.ruta = os.path.abspath(ruta)
+
+    def _ruta_absoluta(self, referencia):
+        ruta = os.path.abspath(os.path.join(self.ruta, referencia))
+        if not ruta.startswith(self.ruta + os.sep):
+            raise ValueError(f"Referencia de imagen fuera del almacén: {referencia}")
+        return ruta
+
+    def guardar(self, datos, nombre, metadatos=None):
+        referencia = nombre
+        ruta = self._ruta_absoluta(referencia)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        return referencia
+
+    def leer(self, referencia):
+        with open(self._ruta_absoluta(referencia), "rb") as f:
+            return f.read()
+
+    def eliminar(self, referencia):
+        os.remove(self._ruta_absoluta(referencia))
+
+_almacenes = {}
+_lock = threading.Lock()
+
+def obtener_almacen(tipo=None, db=None):
+    tipo = tipo or ALMACEN_IMAGENES
+    with _lock:
+        if tipo not in _almacenes:
+            if tipo == "gridfs":
+                if db is None:
+                    from database import obtener_db
+                    db = obtener_db()
+                _almacenes[tipo] = AlmacenGridFS(db)
+            elif tipo == "local":
+                _almacenes[tipo] = AlmacenLocal()
+            else:
+                raise ValueError(f"❌ Almacén de imágenes desconocido: {tipo}")
+        return _almacenes[tipo]
+
+# --- CODIFICACIÓN ---
+def codificar_jpeg(frame, calidad=CALIDAD_JPEG):
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, calidad])
+    if not ok:
+        raise ValueError("No se pudo codificar la imagen como JPEG")
+    return buffer.tobytes()
+
+def generar_miniatura(frame, ancho=ANCHO_MINIATURA):
+    alto_original, ancho_original = frame.shape[:2]
+    if ancho_original > ancho:
+        alto = max(1, round(alto_original * ancho / ancho_original))
+        frame = cv2.resize(frame, (ancho, alto), interpolation=cv2.INTER_AREA)
+    return codificar_jpeg(frame, CALIDAD_MINIATURA)
+
+def decodificar_jpeg(datos):
+    try:
+        frame = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        frame = None
+    if frame is None:
+        raise ValueError("Los datos no son una imagen válida")
+    return frame
+
+def nombre_archivo(tiempo):
+    return f"{tiempo.strftime('%Y/%m/%d/%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
+
+# --- GUARDADO Y LECTURA ---
+def campos_imagen(datos_jpeg, frame, tiempo, almacen, metadatos=None):
+    # Guarda la imagen completa en el almacén y devuelve los campos del documento de Mongo:
+    # solo la miniatura (pocos KB) va dentro del documento
+    referencia = almacen.guardar(datos_jpeg, nombre_archivo(tiempo), metadatos)
+    alto, ancho = frame.shape[:2]
+    return {
+        "miniatura": generar_miniatura(frame),
+        "almacen": almacen.nombre,
+        "imagen_ref": referencia,
+        "ancho": ancho,
+        "alto": alto,
+        "bytes": len(datos_jpeg)
+    }
+
+def guardar_imagen(collection, frame, tiempo, metadatos=None, almacen=None):
+    almacen = almacen or obtener_almacen(db=collection.database)
+    doc = {"tiempo": tiempo, **(metadatos or {})}
+    doc.update(campos_imagen(codificar_jpeg(frame), frame, tiempo, almacen, metadatos))
+    return collection.insert_one(doc).inserted_id
+
+def leer_imagen(doc, db=None):
+    # Devuelve los bytes JPEG completos, tanto de documentos nuevos como de los antiguos en base64
+    if doc.get("imagen_ref"):
+        return obtener_almacen(doc.get("almacen"), db).leer(doc["imagen_ref"])
+    if doc.get("imagen"):
+        return base64.b64decode(doc["imagen"])
+    return None
@@ -1,8 +1,13 @@
 from flask import Flask
 from flask_pymongo import PyMongo
 import os
+from .conexiones import MonitorPool, opciones_pool
+from .ingesta import ColaIngesta
 
 mongo = PyMongo()
+monitor_pool = MonitorPool()
+# Ingesta opcional por lotes (INGESTA_MODO=cola)
+cola_ingesta = ColaIngesta()
 
 def create_app():
     app = Flask(__name__)
@@ -12,11 +17,26 @@ def create_app():
         raise RuntimeError("⚠️ No se encontró la variable de entorno MONGO_URI")
 
     app.config["MONGO_URI"] = mongo_uri
-    mongo.init_app(app)
+    # Un pool por proceso de gunicorn, con tamaño configurable y contadores de uso
+    mongo.init_app(app, event_listeners=[monitor_pool], **opciones_pool())
 
     from .routes import main
     app.register_blueprint(main)
 
     app.mongo = mongo
+    app.monitor_pool = monitor_pool
+    app.cola_ingesta = cola_ingesta
 
-    return app
\ No newline at end of file
+    # Índices de las colecciones de dominio (idempotente, se puede desactivar con ASEGURAR_INDICES=0)
+    if os.environ.get("ASEGURAR_INDICES", "1") != "0":
+        from .colecciones import asegurar_indices_dominios
+        from .ultimo_estado import asegurar_indice_ultimo_estado
+        from .comida import asegurar_indices_comida
+        try:
+            asegurar_indices_dominios(mongo.db)
+            asegurar_indice_ultimo_estado(mongo.db)
+            asegurar_indices_comida(mongo.db)
+        except Exception as e:
+            print(f"⚠️ No se pudieron asegurar los índices al iniciar: {e}")
+
+    return app
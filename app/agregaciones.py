@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from .esquema import ESQUEMA, expresion_campo, valor_variable
+
+VARIABLES = [variable.nombre for variable in ESQUEMA]
+
+# Intervalos admitidos -> (unidad, tamaño) de $dateTrunc
+INTERVALOS = {
+    "1m": ("minute", 1),
+    "15m": ("minute", 15),
+    "1h": ("hour", 1),
+    "1d": ("day", 1),
+}
+
+# Los buckets diarios se cortan a medianoche en hora de Chile
+ZONA_HORARIA = "America/Santiago"
+
+# Sin desde, el modo LTTB cubre estos últimos días
+DIAS_LTTB = 30
+
+def construir_filtro(dispositivos=None, desde=None, hasta=None):
+    filtro = {}
+    if dispositivos:
+        filtro["id_dispositivo"] = {"$in": list(dispositivos)}
+    if desde or hasta:
+        filtro["tiempo"] = {}
+        if desde:
+            filtro["tiempo"]["$gte"] = desde
+        if hasta:
+            filtro["tiempo"]["$lt"] = hasta
+    return filtro
+
+def _numero(var):
+    # Lecturas guardadas como texto ("21.5") también cuentan; lo no numérico se ignora
+    return {"$convert": {"input": expresion_campo(var), "to": "double", "onError": None, "onNull": None}}
+
+def acumuladores(variables=VARIABLES):
+    # Acumuladores de $group con min/media/max/n por variable
+    grupo = {"n": {"$sum": 1}}
+    for var in variables:
+        grupo[f"{var}_min"] = {"$min": _numero(var)}
+        grupo[f"{var}_media"] = {"$avg": _numero(var)}
+        grupo[f"{var}_max"] = {"$max": _numero(var)}
+        grupo[f"{var}_n"] = {"$sum": {"$cond": [{"$eq": [_numero(var), None]}, 0, 1]}}
+    return grupo
+
+def proyeccion_variables(variables=VARIABLES):
+    # Agrupa los acumuladores de cada variable en un subdocumento {min, media, max, n}
+    return {
+        var: {"min": f"${var}_min", "media": f"${var}_media", "max": f"${var}_max", "n": f"${var}_n"}
+        for var in variables
+    }
+
+def truncar_tiempo(intervalo):
+    unidad, tamano = INTERVALOS[intervalo]
+    return {"$dateTrunc": {"date": "$tiempo", "unit": unidad, "binSize": tamano, "timezone": ZONA_HORARIA}}
+
+def pipeline_agregados(filtro, intervalo, variables=VARIABLES):
+    grupo = {"_id": {"id_dispositivo": "$id_dispositivo", "tiempo": truncar_tiempo(intervalo)}, **acumuladores(variables)}
+    proyeccion = {"_id": 0, "id_dispositivo": "$_id.id_dispositivo", "tiempo": "$_id.tiempo", "n": 1, **proyeccion_variables(variables)}
+
+    return [
+        {"$match": filtro},
+        {"$group": grupo},
+        {"$sort": {"_id.id_dispositivo": 1, "_id.tiempo": 1}},
+        {"$project": proyeccion}
+    ]
+
+# --- REDUCCIÓN DE PUNTOS (LTTB) ---
+def _segundos(tiempo):
+    # pymongo entrega fechas UTC sin zona horaria
+    if tiempo.tzinfo is None:
+        return (tiempo - datetime(1970, 1, 1)).total_seconds()
+    return tiempo.timestamp()
+
+def reducir_lttb(x, y, max_puntos):
+    # Largest-Triangle-Three-Buckets: devuelve los índices de los puntos que conservan la
+    # forma visual de la serie. x debe ser numérico y creciente.
+    n = len(x)
+    if max_puntos >= n or max_puntos < 3:
+        return list(range(n))
+
+    seleccion = [0]
+    tamano_bucket = (n - 2) / (max_puntos - 2)
+    a = 0
+
+    for i in range(max_puntos - 2):
+        # Punto promedio del bucket siguiente
+        inicio_sig = int((i + 1) * tamano_bucket) + 1
+        fin_sig = min(int((i + 2) * tamano_bucket) + 1, n)
+        cantidad = fin_sig - inicio_sig
+        prom_x = sum(x[inicio_sig:fin_sig]) / cantidad
+        prom_y = sum(y[inicio_sig:fin_sig]) / cantidad
+
+        # Punto del bucket actual que forma el triángulo de mayor área
+        inicio = int(i * tamano_bucket) + 1
+        fin = int((i + 1) * tamano_bucket) + 1
+        area_max = -1
+        elegido = inicio
+        for j in range(inicio, fin):
+            area = abs((x[a] - prom_x) * (y[j] - y[a]) - (x[a] - x[j]) * (prom_y - y[a]))
+            if area > area_max:
+                area_max = area
+                elegido = j
+
+        seleccion.append(elegido)
+        a = elegido
+
+    seleccion.append(n - 1)
+    return seleccion
+
+def rango_lttb(desde=None, hasta=None):
+    # Rango del modo LTTB: sin desde, los últimos DIAS_LTTB días antes de hasta (o de ahora)
+    if desde is None:
+        desde = (hasta or datetime.utcnow()) - timedelta(days=DIAS_LTTB)
+    return desde, hasta
+
+def series_lttb(cursor, max_puntos, variables=VARIABLES):
+    # Recibe documentos ordenados por tiempo ascendente y devuelve, por dispositivo y
+    # variable, como mucho max_puntos pares (tiempo, valor)
+    crudo = {}
+    for doc in cursor:
+        disp = doc.get("id_dispositivo")
+        tiempo = doc.get("tiempo")
+        if tiempo is None:
+            continue
+        series_disp = crudo.setdefault(disp, {var: ([], []) for var in variables})
+        for var in variables:
+            try:
+                numero = float(valor_variable(doc, var))
+            except (TypeError, ValueError):
+                continue
+            tiempos, valores = series_disp[var]
+            tiempos.append(tiempo)
+            valores.append(numero)
+
+    resultado = {}
+    for disp, series_disp in crudo.items():
+        resultado[disp] = {}
+        for var, (tiempos, valores) in series_disp.items():
+            x = [_segundos(t) for t in tiempos]
+            indices = reducir_lttb(x, valores, max_puntos)
+            resultado[disp][var] = [(tiempos[i], valores[i]) for i in indices]
+    return resultado
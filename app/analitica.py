@@ -0,0 +1,143 @@
+from datetime import timezone
+import os
+import pyarrow as pa
+from . import archivo
+from .agregaciones import INTERVALOS, VARIABLES, ZONA_HORARIA
+
+# Motor analítico local opcional (DuckDB, en el mismo proceso y con varios hilos). Lo que
+# MongoDB ya resume (rollups por hora/día, pipeline_agregados sobre lo que sigue en MongoDB)
+# se calcula allá y llega aquí como tablas pequeñas de buckets; DuckDB solo recorre el archivo
+# Parquet, por debajo de la frontera (app.archivo), así ninguna lectura se cuenta dos veces.
+# Sin duckdb instalado (pip install duckdb) disponible() es False y los agregados del archivo
+# se calculan con pyarrow
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+HILOS = int(os.environ.get("ANALITICA_HILOS", os.cpu_count() or 1))
+
+MEDIDAS = ["min", "media", "max", "n", "primero"]
+
+def disponible():
+    return duckdb is not None
+
+def conectar():
+    if duckdb is None:
+        raise RuntimeError("❌ El motor analítico requiere duckdb (pip install duckdb)")
+    con = duckdb.connect()
+    con.execute(f"SET threads = {HILOS}")
+    con.execute("SET TimeZone = 'UTC'")
+    return con
+
+def _literal_tiempo(fecha):
+    # desde/hasta son datetime (UTC sin zona) generados por el código, no texto del usuario
+    return f"TIMESTAMPTZ '{fecha.isoformat(sep=' ')}+00'"
+
+# --- ARCHIVO PARQUET ---
+def agregados_archivo(dominio, intervalo, dispositivos=None, desde=None, hasta=None, variables=VARIABLES, base=archivo.ARCHIVO_DIR):
+    # Misma firma y documentos que app.archivo.agregados_archivo, con time_bucket de DuckDB
+    # leyendo directamente los archivos de las particiones del rango
+    if duckdb is None:
+        return archivo.agregados_archivo(dominio, intervalo, dispositivos, desde, hasta, variables, base)
+    rutas = archivo.particiones(dominio, dispositivos, desde, hasta, base)
+    if not rutas:
+        return []
+
+    unidad, tamano = INTERVALOS[intervalo]
+    condiciones = ["true"]
+    if desde is not None:
+        condiciones.append(f"tiempo >= {_literal_tiempo(desde)}")
+    if hasta is not None:
+        condiciones.append(f"tiempo < {_literal_tiempo(hasta)}")
+    if dispositivos:
+        condiciones.append("id_dispositivo IN (SELECT unnest($dispositivos))")
+    medidas = ",\n".join(
+        f"min({v}) AS {v}_min, avg({v}) AS {v}_media, max({v}) AS {v}_max, count({v}) AS {v}_n" for v in variables
+    )
+
+    con = conectar()
+    try:
+        resultado = con.execute(f"""
+            SELECT id_dispositivo,
+                   time_bucket(INTERVAL '{tamano} {unidad}', tiempo, '{ZONA_HORARIA}') AS tiempo,
+                   count(*) AS n,
+                   {medidas}
+            FROM read_parquet($rutas, hive_partitioning = false, union_by_name = true)
+            WHERE {' AND '.join(condiciones)}
+            GROUP BY ALL
+        """, {"rutas": rutas, **({"dispositivos": list(dispositivos)} if dispositivos else {})})
+        columnas = [columna[0] for columna in resultado.description]
+        filas = [dict(zip(columnas, fila)) for fila in resultado.fetchall()]
+    finally:
+        con.close()
+
+    docs = []
+    for fila in filas:
+        doc = {"id_dispositivo": fila["id_dispositivo"], "tiempo": fila["tiempo"].astimezone(timezone.utc).replace(tzinfo=None), "n": fila["n"]}
+        for var in variables:
+            doc[var] = {medida: fila[f"{var}_{medida}"] for medida in ("min", "media", "max", "n")}
+        docs.append(doc)
+    return docs
+
+# --- BUCKETS ---
+def tabla_buckets(docs, variables=VARIABLES):
+    # Documentos de rollups o de pipeline_agregados ({<variable>: {min, media, max, n, primero}})
+    # como tabla plana con columnas <variable>_<medida>
+    columnas = {
+        "id_dispositivo": [doc.get("id_dispositivo") for doc in docs],
+        "tiempo": [doc["tiempo"] for doc in docs],
+        "manual": [bool(doc.get("manual")) for doc in docs],
+        "n": [doc.get("n") for doc in docs],
+    }
+    campos = [("id_dispositivo", pa.string()), ("tiempo", pa.timestamp("ms", tz="UTC")), ("manual", pa.bool_()), ("n", pa.int64())]
+    for var in variables:
+        for medida in MEDIDAS:
+            columnas[f"{var}_{medida}"] = [(doc.get(var) or {}).get(medida) for doc in docs]
+            campos.append((f"{var}_{medida}", pa.int64() if medida == "n" else pa.float64()))
+    return pa.Table.from_pydict(columnas, schema=pa.schema(campos))
+
+def _consulta_buckets(docs, sql, variables):
+    con = conectar()
+    try:
+        con.register("buckets", tabla_buckets(docs, variables))
+        df = con.execute(sql).df()
+    finally:
+        con.close()
+    df["dia"] = df["dia"].dt.tz_convert(ZONA_HORARIA)
+    return df
+
+def deriva(docs, ventana_dias=7, variables=VARIABLES):
+    # Sobre buckets diarios de sensores: media, su media móvil de ventana_dias y la deriva
+    # respecto al primer día con datos de cada dispositivo
+    columnas = ",\n".join(
+        f"{v}_media AS {v}, avg({v}_media) OVER ventana AS {v}_movil, "
+        f"{v}_media - first_value({v}_media IGNORE NULLS) OVER (PARTITION BY id_dispositivo ORDER BY tiempo) AS {v}_deriva"
+        for v in variables
+    )
+    return _consulta_buckets(docs, f"""
+        SELECT id_dispositivo, tiempo AS dia,
+               {columnas}
+        FROM buckets
+        WHERE NOT manual
+        WINDOW ventana AS (
+            PARTITION BY id_dispositivo ORDER BY tiempo
+            RANGE BETWEEN INTERVAL '{int(ventana_dias) - 1} days' PRECEDING AND CURRENT ROW
+        )
+        ORDER BY id_dispositivo, dia
+    """, variables)
+
+def manual_vs_sensor(docs, variables=VARIABLES):
+    # Por dispositivo y día: primer registro manual contra el promedio de los sensores
+    columnas = ",\n".join(
+        f"m.{v}_primero AS {v}_manual, s.{v}_media AS {v}_sensor, m.{v}_primero - s.{v}_media AS {v}_diferencia"
+        for v in variables
+    )
+    return _consulta_buckets(docs, f"""
+        SELECT m.id_dispositivo, m.tiempo AS dia,
+               {columnas}
+        FROM buckets m
+        JOIN buckets s ON s.id_dispositivo = m.id_dispositivo AND s.tiempo = m.tiempo AND NOT s.manual
+        WHERE m.manual
+        ORDER BY m.id_dispositivo, dia
+    """, variables)
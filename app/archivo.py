@@ -0,0 +1,275 @@
+from datetime import datetime, timezone
+from itertools import chain
+from urllib.parse import quote, unquote
+import heapq
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytz
+from bson import ObjectId
+from .agregaciones import INTERVALOS, VARIABLES, ZONA_HORARIA, construir_filtro
+from .exportar import ESQUEMA_PARQUET, tabla_parquet
+from .paginacion import clave_keyset
+
+# Archivo frío de lecturas en Parquet, particionado como
+#     ARCHIVO_DIR/dominio=<dominio>/id_dispositivo=<id>/mes=<AAAA-MM>/parte-<primer _id>.parquet
+# (estilo Hive, así también lo leen pyarrow.dataset o DuckDB). archivador.py mueve aquí las
+# lecturas de sensor antiguas de cada dominio_*; la API (/api/datos, /api/exportar,
+# /api/agregados), el dashboard y la reconstrucción de ultimo_estado las intercalan con las
+# de MongoDB. Por eso ARCHIVO_DIR debe ser el mismo almacenamiento compartido (disco de red,
+# volumen montado) en la misma ruta para archivador.py, la API y el dashboard: un proceso que
+# no lo ve solo entrega lo que sigue en MongoDB
+ARCHIVO_DIR = os.environ.get("ARCHIVO_DIR", "archivo")
+
+# El esquema de /api/exportar más manual y el _id de MongoDB
+ESQUEMA_ARCHIVO = ESQUEMA_PARQUET.insert(2, pa.field("manual", pa.bool_())).append(pa.field("_id", pa.string()))
+
+def mes_de(tiempo):
+    return tiempo.strftime("%Y-%m")
+
+def ruta_particion(dominio, id_dispositivo, mes, base=ARCHIVO_DIR):
+    # quote: un id_dispositivo con "/" u otros caracteres no rompe la ruta
+    return os.path.join(
+        base, f"dominio={quote(dominio, safe='')}", f"id_dispositivo={quote(str(id_dispositivo), safe='')}", f"mes={mes}"
+    )
+
+def _valor_particion(nombre):
+    return unquote(nombre.split("=", 1)[1]) if "=" in nombre else None
+
+def _limites_mes(mes):
+    inicio = datetime.strptime(mes, "%Y-%m")
+    fin = inicio.replace(year=inicio.year + 1, month=1) if inicio.month == 12 else inicio.replace(month=inicio.month + 1)
+    return inicio, fin
+
+def particiones(dominio, dispositivos=None, desde=None, hasta=None, base=ARCHIVO_DIR):
+    # Archivos de las particiones que pueden tener lecturas del rango [desde, hasta) (UTC sin
+    # zona): los dispositivos y meses fuera del filtro se descartan sin abrir sus archivos
+    raiz = os.path.join(base, f"dominio={quote(dominio, safe='')}")
+    if not os.path.isdir(raiz):
+        return []
+
+    rutas = []
+    for dir_dispositivo in sorted(os.listdir(raiz)):
+        if dispositivos and _valor_particion(dir_dispositivo) not in dispositivos:
+            continue
+        for dir_mes in sorted(os.listdir(os.path.join(raiz, dir_dispositivo))):
+            try:
+                inicio, fin = _limites_mes(_valor_particion(dir_mes))
+            except (TypeError, ValueError):
+                continue
+            if (hasta is not None and inicio >= hasta) or (desde is not None and fin <= desde):
+                continue
+            carpeta = os.path.join(raiz, dir_dispositivo, dir_mes)
+            rutas += [os.path.join(carpeta, f) for f in sorted(os.listdir(carpeta)) if f.endswith(".parquet")]
+    return rutas
+
+# --- FRONTERA CON MONGODB ---
+# Del archivo solo se lee lo anterior a la lectura de sensor más antigua que sigue en MongoDB:
+# lo que se archivó pero aún no se borró (pasada interrumpida) no aparece dos veces. Los
+# registros manuales no se archivan, por eso no cuentan para la frontera
+def filtro_frontera(filtro):
+    return {**filtro, "tiempo": {**filtro.get("tiempo", {}), "$type": "date"}, "manual": {"$ne": True}}
+
+def frontera(collection, filtro):
+    doc = collection.find_one(filtro_frontera(filtro), {"tiempo": 1}, sort=[("tiempo", 1)])
+    return doc["tiempo"] if doc else None
+
+def hasta_archivo(hasta, limite):
+    if limite is None:
+        return hasta
+    return limite if hasta is None else min(hasta, limite)
+
+def _utc(fecha):
+    return fecha.replace(tzinfo=timezone.utc)
+
+def _filtros(desde=None, hasta=None, manual=None):
+    filtros = []
+    if desde is not None:
+        filtros.append(("tiempo", ">=", _utc(desde)))
+    if hasta is not None:
+        filtros.append(("tiempo", "<", _utc(hasta)))
+    if manual is not None:
+        filtros.append(("manual", "==", bool(manual)))
+    return filtros or None
+
+def _leer(rutas, filtros, columnas=None):
+    tablas = [
+        pq.read_table(ruta, columns=columnas, filters=filtros, memory_map=True, schema=ESQUEMA_ARCHIVO)
+        for ruta in rutas
+    ]
+    return pa.concat_tables(tablas)
+
+def leer_archivo(dominio, dispositivos=None, desde=None, hasta=None, manual=None, columnas=None, base=ARCHIVO_DIR):
+    # Tabla Arrow con las lecturas archivadas del rango. Cada archivo se abre con memory_map y
+    # solo se leen las columnas pedidas; los filtros usan las estadísticas de cada row group
+    rutas = particiones(dominio, dispositivos, desde, hasta, base)
+    if not rutas:
+        return None
+    return _leer(rutas, _filtros(desde, hasta, manual), columnas)
+
+# --- LECTURAS ARCHIVADAS COMO DOCUMENTOS ---
+def _documento(fila):
+    # Misma forma que un documento de MongoDB con PROYECCION_LECTURAS
+    doc = {"_id": ObjectId(fila["_id"]), "tiempo": fila["tiempo"].replace(tzinfo=None), "id_dispositivo": fila["id_dispositivo"]}
+    if fila["manual"]:
+        doc["manual"] = True
+    for var in VARIABLES:
+        if fila[var] is not None:
+            doc[var] = fila[var]
+    return doc
+
+def bloques_archivo(dominio, dispositivos=None, desde=None, hasta=None, cursor=None, direccion=1, manual=None, base=ARCHIVO_DIR):
+    # Lecturas archivadas en orden keyset (tiempo, _id), un bloque (lista de documentos) por
+    # mes: solo se abre el mes siguiente cuando se consumió el anterior
+    meses = {}
+    for ruta in particiones(dominio, dispositivos, desde, hasta, base):
+        meses.setdefault(_valor_particion(os.path.basename(os.path.dirname(ruta))), []).append(ruta)
+
+    for mes in sorted(meses, reverse=direccion < 0):
+        tabla = _leer(meses[mes], _filtros(desde, hasta, manual))
+        if cursor:
+            tiempo, _id = pa.scalar(_utc(cursor[0]), tabla.schema.field("tiempo").type), str(cursor[1])
+            comparar = pc.less if direccion < 0 else pc.greater
+            tabla = tabla.filter(pc.or_(
+                comparar(tabla["tiempo"], tiempo),
+                pc.and_(pc.equal(tabla["tiempo"], tiempo), comparar(tabla["_id"], _id))
+            ))
+        if tabla.num_rows:
+            orden = "descending" if direccion < 0 else "ascending"
+            tabla = tabla.sort_by([("tiempo", orden), ("_id", orden)])
+            yield [_documento(fila) for fila in tabla.to_pylist()]
+
+def con_archivo(collection, dominio, lecturas, dispositivos=None, desde=None, hasta=None, cursor=None, direccion=1, manual=None, base=ARCHIVO_DIR):
+    # Intercala las lecturas de MongoDB (ya ordenadas por keyset en esa dirección) con las
+    # archivadas anteriores a la frontera. Rangos sin archivo no consultan la frontera
+    if manual or not particiones(dominio, dispositivos, desde, hasta, base):
+        return lecturas
+    limite = frontera(collection, construir_filtro(dispositivos, desde, hasta))
+    bloques = bloques_archivo(dominio, dispositivos, desde, hasta_archivo(hasta, limite), cursor, direccion, manual, base)
+    return heapq.merge(lecturas, chain.from_iterable(bloques), key=clave_keyset, reverse=direccion < 0)
+
+def contar_archivo(dominio, dispositivos=None, desde=None, hasta=None, base=ARCHIVO_DIR):
+    rutas = particiones(dominio, dispositivos, desde, hasta, base)
+    if not rutas:
+        return 0
+    return _leer(rutas, _filtros(desde, hasta), ["tiempo"]).num_rows
+
+def ultimas_archivadas(dominio, base=ARCHIVO_DIR):
+    # Última lectura de sensor archivada de cada dispositivo (solo se abre su mes más reciente)
+    ultimas = []
+    raiz = os.path.join(base, f"dominio={quote(dominio, safe='')}")
+    if not os.path.isdir(raiz):
+        return ultimas
+    for dir_dispositivo in sorted(os.listdir(raiz)):
+        for dir_mes in sorted(os.listdir(os.path.join(raiz, dir_dispositivo)), reverse=True):
+            carpeta = os.path.join(raiz, dir_dispositivo, dir_mes)
+            rutas = [os.path.join(carpeta, f) for f in os.listdir(carpeta) if f.endswith(".parquet")]
+            tabla = _leer(rutas, _filtros(manual=False)) if rutas else None
+            if tabla is not None and tabla.num_rows:
+                tabla = tabla.sort_by([("tiempo", "descending"), ("_id", "descending")]).slice(0, 1)
+                ultimas.append(_documento(tabla.to_pylist()[0]))
+                break
+    return ultimas
+
+# --- AGREGADOS DEL ARCHIVO ---
+def _truncar(tiempos, intervalo):
+    # Igual que agregaciones.truncar_tiempo. Chile cambia de hora en horas completas, así que
+    # los buckets de minutos y horas coinciden con los de UTC; los diarios se cortan en la
+    # medianoche local (sobre la hora local sin zona, que no tiene horas ambiguas)
+    unidad, tamano = INTERVALOS[intervalo]
+    if unidad != "day":
+        return pc.floor_temporal(tiempos, tamano, unidad)
+    local = pc.local_timestamp(tiempos.cast(pa.timestamp("ms", tz=ZONA_HORARIA)))
+    return pc.floor_temporal(local, tamano, unidad)
+
+def _a_utc(dia_local):
+    return pytz.timezone(ZONA_HORARIA).localize(dia_local, is_dst=False).astimezone(pytz.utc).replace(tzinfo=None)
+
+def agregados_archivo(dominio, intervalo, dispositivos=None, desde=None, hasta=None, variables=VARIABLES, base=ARCHIVO_DIR):
+    # Mismos documentos que pipeline_agregados ({id_dispositivo, tiempo, n, <variable>: {min,
+    # media, max, n}}) calculados sobre las lecturas archivadas
+    tabla = leer_archivo(dominio, dispositivos, desde, hasta, columnas=["tiempo", "id_dispositivo"] + list(variables), base=base)
+    if tabla is None or tabla.num_rows == 0:
+        return []
+    tabla = tabla.append_column("bucket", _truncar(tabla["tiempo"], intervalo))
+    medidas = [("tiempo", "count")]
+    for var in variables:
+        medidas += [(var, "min"), (var, "mean"), (var, "max"), (var, "count")]
+    resumen = tabla.group_by(["id_dispositivo", "bucket"]).aggregate(medidas)
+
+    diario = INTERVALOS[intervalo][0] == "day"
+    docs = []
+    for fila in resumen.to_pylist():
+        doc = {
+            "id_dispositivo": fila["id_dispositivo"],
+            "tiempo": _a_utc(fila["bucket"]) if diario else fila["bucket"].replace(tzinfo=None),
+            "n": fila["tiempo_count"],
+        }
+        for var in variables:
+            doc[var] = {"min": fila[f"{var}_min"], "media": fila[f"{var}_mean"], "max": fila[f"{var}_max"], "n": fila[f"{var}_count"]}
+        docs.append(doc)
+    return docs
+
+def _combinar_bucket(a, b, variables):
+    doc = {"id_dispositivo": a["id_dispositivo"], "tiempo": a["tiempo"], "n": a["n"] + b["n"]}
+    for var in variables:
+        x, y = a.get(var, {}), b.get(var, {})
+        nx, ny = x.get("n") or 0, y.get("n") or 0
+        minimos = [v["min"] for v in (x, y) if v.get("min") is not None]
+        maximos = [v["max"] for v in (x, y) if v.get("max") is not None]
+        doc[var] = {
+            "min": min(minimos) if minimos else None,
+            "media": ((x.get("media") or 0) * nx + (y.get("media") or 0) * ny) / (nx + ny) if nx + ny else None,
+            "max": max(maximos) if maximos else None,
+            "n": nx + ny,
+        }
+    return doc
+
+def combinar_agregados(docs, archivados, variables=VARIABLES):
+    # Une los buckets de MongoDB con los del archivo; un bucket que cruza la frontera queda en
+    # los dos lados y se combina. Orden de pipeline_agregados: dispositivo y tiempo
+    buckets = {(doc["id_dispositivo"], doc["tiempo"]): doc for doc in archivados}
+    for doc in docs:
+        clave = (doc["id_dispositivo"], doc["tiempo"])
+        buckets[clave] = _combinar_bucket(buckets[clave], doc, variables) if clave in buckets else doc
+    return [buckets[clave] for clave in sorted(buckets, key=lambda c: (str(c[0]), c[1]))]
+
+def tabla_archivo(docs):
+    return tabla_parquet(docs, ESQUEMA_ARCHIVO)
+
+def ids_archivados(carpeta):
+    # _id ya guardados en una partición: si una pasada anterior escribió el archivo pero no
+    # alcanzó a borrar de MongoDB, esas lecturas no se vuelven a archivar
+    if not os.path.isdir(carpeta):
+        return set()
+    ids = set()
+    for nombre in os.listdir(carpeta):
+        if nombre.endswith(".parquet"):
+            ids.update(pq.read_table(os.path.join(carpeta, nombre), columns=["_id"], memory_map=True).column("_id").to_pylist())
+    return ids
+
+def escribir_particion(dominio, id_dispositivo, mes, docs, base=ARCHIVO_DIR):
+    # Escribe las lecturas (de un mismo dispositivo y mes) en un archivo nuevo de la partición;
+    # primero a un temporal y luego se renombra, para no dejar archivos a medias
+    carpeta = ruta_particion(dominio, id_dispositivo, mes, base)
+    existentes = ids_archivados(carpeta)
+    nuevos = [doc for doc in docs if str(doc["_id"]) not in existentes]
+    if not nuevos:
+        return None
+
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f"parte-{nuevos[0]['_id']}.parquet")
+    temporal = ruta + ".tmp"
+    pq.write_table(tabla_archivo(nuevos), temporal, compression="zstd")
+    os.replace(temporal, ruta)
+    return ruta
+
+def agregados_con_archivo(collection, dominio, docs, intervalo, dispositivos=None, desde=None, hasta=None, variables=VARIABLES, base=ARCHIVO_DIR, agregar=agregados_archivo):
+    # docs: resultado de pipeline_agregados sobre MongoDB para el mismo rango; agregar calcula
+    # los buckets del archivo (pyarrow por defecto, app.analitica.agregados_archivo con DuckDB)
+    if not particiones(dominio, dispositivos, desde, hasta, base):
+        return docs
+    limite = frontera(collection, construir_filtro(dispositivos, desde, hasta))
+    archivados = agregar(dominio, intervalo, dispositivos, desde, hasta_archivo(hasta, limite), variables, base)
+    return combinar_agregados(list(docs), archivados, variables)
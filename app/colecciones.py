@@ -0,0 +1,163 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid, PyMongoError
+import os
+import threading
+import time
+
+PREFIJO_DOMINIO = "dominio_"
+
+# Modo de almacenamiento de las lecturas: "normal" (un documento por lectura) o
+# "timeseries" (colección time-series nativa de MongoDB, agrupada en buckets por dispositivo)
+MODO_ALMACENAMIENTO = os.environ.get("MODO_ALMACENAMIENTO", "normal")
+OPCIONES_TIMESERIES = {
+    "timeField": "tiempo",
+    "metaField": "id_dispositivo",
+    "granularity": os.environ.get("GRANULARIDAD_TIMESERIES", "minutes")
+}
+
+# Índices de las colecciones de dominio: todas las lecturas ordenan por tiempo descendente,
+# filtrando por dispositivo o por registros manuales. El _id final permite paginar por
+# keyset (tiempo, _id) usando el mismo índice.
+INDICES_DOMINIO = [
+    ([("id_dispositivo", ASCENDING), ("tiempo", DESCENDING), ("_id", DESCENDING)], {"name": "id_dispositivo_tiempo_id"}),
+    ([("tiempo", DESCENDING), ("_id", DESCENDING)], {"name": "tiempo_id"}),
+    ([("manual", ASCENDING), ("tiempo", DESCENDING)], {
+        "name": "manual_tiempo",
+        "partialFilterExpression": {"manual": True}
+    }),
+]
+
+# Índices anteriores cubiertos por los actuales (se eliminan cuando su reemplazo existe)
+INDICES_REEMPLAZADOS = {
+    "id_dispositivo_tiempo": "id_dispositivo_tiempo_id",
+    "tiempo": "tiempo_id",
+}
+
+# Segundos que se confía en la lista de dominios antes de volver a pedirla a MongoDB, y
+# espera mínima entre consultas provocadas por dominios desconocidos
+TTL_DOMINIOS = float(os.environ.get("DOMINIOS_TTL_S", 300))
+ESPERA_REFRESCO_DOMINIOS = float(os.environ.get("DOMINIOS_REFRESCO_MIN_S", 5))
+
+# Colecciones ya preparadas por este proceso (evita repetir create_index en cada inserción)
+_dominios_preparados = set()
+_lock = threading.Lock()
+
+def asegurar_indices(collection):
+    # create_index es idempotente: si el índice ya existe con la misma definición no hace nada
+    for claves, opciones in INDICES_DOMINIO:
+        try:
+            collection.create_index(claves, **opciones)
+        except PyMongoError as e:
+            print(f"⚠️ No se pudo crear el índice {opciones['name']} en {collection.name}: {e}")
+
+    try:
+        existentes = collection.index_information()
+        for anterior, reemplazo in INDICES_REEMPLAZADOS.items():
+            if anterior in existentes and reemplazo in existentes:
+                collection.drop_index(anterior)
+    except PyMongoError as e:
+        print(f"⚠️ No se pudieron revisar los índices anteriores de {collection.name}: {e}")
+
+def asegurar_indices_dominios(db):
+    for nombre in registro_dominios.refrescar(db):
+        if nombre.startswith(PREFIJO_DOMINIO):
+            asegurar_indices(db[nombre])
+            with _lock:
+                _dominios_preparados.add(nombre)
+
+def es_timeseries(db, nombre):
+    info = list(db.list_collections(filter={"name": nombre}))
+    return bool(info) and info[0].get("type") == "timeseries"
+
+def crear_coleccion_timeseries(db, nombre):
+    # Devuelve True si la creó; False si ya existía (time-series o no)
+    try:
+        db.create_collection(nombre, timeseries=OPCIONES_TIMESERIES)
+        return True
+    except CollectionInvalid:
+        return False
+
+def dominio_preparado(nombre):
+    return nombre in _dominios_preparados
+
+def marcar_preparado(nombre):
+    _dominios_preparados.add(nombre)
+    registro_dominios.agregar(nombre)
+
+def preparar_dominio(db, nombre):
+    # Se llama antes de insertar: la primera vez que el proceso ve un dominio crea
+    # la colección (en modo timeseries) y sus índices
+    if dominio_preparado(nombre):
+        return db[nombre]
+    with _lock:
+        if not dominio_preparado(nombre):
+            if MODO_ALMACENAMIENTO == "timeseries":
+                crear_coleccion_timeseries(db, nombre)
+            asegurar_indices(db[nombre])
+            marcar_preparado(nombre)
+    return db[nombre]
+
+# --- REGISTRO DE DOMINIOS ---
+# Colecciones conocidas por el proceso (el dashboard solo ofrece las dominio_*). Listar colecciones es de las
+# llamadas más lentas en Atlas, así que se cachea: caduca tras TTL_DOMINIOS, se actualiza al
+# preparar un dominio nuevo y un dominio desconocido fuerza una consulta (como mucho una cada
+# ESPERA_REFRESCO_DOMINIOS, para que pedir dominios inexistentes no llegue siempre a MongoDB)
+class RegistroDominios:
+    def __init__(self, ttl=TTL_DOMINIOS, espera_refresco=ESPERA_REFRESCO_DOMINIOS):
+        self.ttl = ttl
+        self.espera_refresco = espera_refresco
+        self.lock = threading.Lock()
+        self.dominios = set()
+        self.refrescado = None  # time.monotonic() de la última consulta a MongoDB
+        self.consultas = 0
+
+    def _vigente(self):
+        return self.refrescado is not None and time.monotonic() - self.refrescado < self.ttl
+
+    def actualizar(self, nombres):
+        with self.lock:
+            self.dominios = set(nombres)
+            self.refrescado = time.monotonic()
+            self.consultas += 1
+        return set(nombres)
+
+    def refrescar(self, db):
+        return self.actualizar(db.list_collection_names())
+
+    def listar(self, db):
+        if not self._vigente():
+            self.refrescar(db)
+        with self.lock:
+            return sorted(nombre for nombre in self.dominios if nombre.startswith(PREFIJO_DOMINIO))
+
+    def consultar(self, nombre):
+        # True/False si la respuesta cacheada sirve; None si hay que volver a listar las colecciones
+        with self.lock:
+            conocido = nombre in self.dominios
+            reciente = self.refrescado is not None and time.monotonic() - self.refrescado < self.espera_refresco
+        if conocido and self._vigente():
+            return True
+        if conocido or not reciente:
+            # Caducado, o un dominio que otro proceso pudo haber creado
+            return None
+        return False
+
+    def existe(self, db, nombre):
+        respuesta = self.consultar(nombre)
+        if respuesta is None:
+            return nombre in self.refrescar(db)
+        return respuesta
+
+    def agregar(self, nombre):
+        with self.lock:
+            self.dominios.add(nombre)
+
+    def invalidar(self):
+        with self.lock:
+            self.refrescado = None
+
+    def resumen(self):
+        with self.lock:
+            return {"dominios": len(self.dominios), "consultas": self.consultas, "vigente": self._vigente()}
+
+registro_dominios = RegistroDominios()
@@ -0,0 +1,68 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from .agregaciones import construir_filtro
+from .lecturas import ParametroInvalido, lista_param, parsear_tiempo
+from .paginacion import ORDENES, decodificar_cursor, filtro_keyset, orden_keyset
+
+# Eventos de alimentación: la última por dispositivo se calcula en MongoDB y el historial se
+# entrega por páginas (keyset sobre tiempo, _id), sin cargar el registro completo
+COLECCION_COMIDA = "registro_comida"
+
+INDICES_COMIDA = [
+    ([("id_dispositivo", ASCENDING), ("tiempo", DESCENDING), ("_id", DESCENDING)], {"name": "id_dispositivo_tiempo_id"}),
+    ([("tiempo", DESCENDING), ("_id", DESCENDING)], {"name": "tiempo_id"}),
+]
+
+# Tamaño de página por defecto y máximo de /api/registro_comida
+LIMITE_COMIDA = 200
+MAX_LIMITE_COMIDA = 1000
+
+def asegurar_indices_comida(db):
+    for claves, opciones in INDICES_COMIDA:
+        try:
+            db[COLECCION_COMIDA].create_index(claves, **opciones)
+        except PyMongoError as e:
+            print(f"⚠️ No se pudo crear el índice {opciones['name']} en {COLECCION_COMIDA}: {e}")
+
+def pipeline_ultima_comida(dispositivos=None):
+    # $sort + $group/$first sobre id_dispositivo_tiempo_id: MongoDB lee una entrada de índice
+    # por dispositivo en vez de recorrer todos los eventos
+    pipeline = []
+    if dispositivos:
+        pipeline.append({"$match": {"id_dispositivo": {"$in": list(dispositivos)}}})
+    pipeline += [
+        {"$sort": {"id_dispositivo": 1, "tiempo": -1}},
+        {"$group": {"_id": "$id_dispositivo", "tiempo": {"$first": "$tiempo"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    return pipeline
+
+def parametros_comida(args):
+    # Valida los parámetros del historial; lanza ParametroInvalido con el mensaje para el cliente
+    limit = args.get('limit', default=LIMITE_COMIDA, type=int)
+    if limit is None or limit <= 0 or limit > MAX_LIMITE_COMIDA:
+        raise ParametroInvalido(f'El parámetro limit debe estar entre 1 y {MAX_LIMITE_COMIDA}')
+
+    orden = args.get('orden', default='desc')
+    if orden not in ORDENES:
+        raise ParametroInvalido('El parámetro orden debe ser asc o desc')
+
+    try:
+        desde = parsear_tiempo(args.get('desde'), None)
+        hasta = parsear_tiempo(args.get('hasta'), None)
+        cursor = decodificar_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        raise ParametroInvalido('Los parámetros desde/hasta deben estar en formato ISO 8601 y cursor debe ser válido')
+
+    return {
+        'dispositivos': lista_param(args, 'id_dispositivo'),
+        'limit': limit,
+        'direccion': ORDENES[orden],
+        'desde': desde,
+        'hasta': hasta,
+        'cursor': cursor,
+    }
+
+def consulta_comida(dispositivos=None, desde=None, hasta=None, cursor=None, direccion=-1):
+    filtro = construir_filtro(dispositivos, desde, hasta)
+    return filtro_keyset(filtro, cursor, direccion), orden_keyset(direccion)
@@ -0,0 +1,78 @@
+from pymongo import monitoring
+import os
+import threading
+
+# Tamaño del pool de conexiones a MongoDB (configurable por variables de entorno)
+def opciones_pool():
+    return {
+        "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 50)),
+        "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_MS", 300000)),
+        "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+    }
+
+# Contadores del pool: conexiones abiertas/en uso y tiempos de espera al pedir una conexión
+class MonitorPool(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contadores = {
+            "conexiones_creadas": 0,
+            "conexiones_cerradas": 0,
+            "conexiones_en_uso": 0,
+            "checkouts": 0,
+            "checkouts_fallidos": 0,
+            "pools_limpiados": 0,
+        }
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def _sumar(self, clave, cantidad=1):
+        with self.lock:
+            self.contadores[clave] += cantidad
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._sumar("pools_limpiados")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._sumar("conexiones_creadas")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._sumar("conexiones_cerradas")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._sumar("checkouts_fallidos")
+
+    def connection_checked_out(self, event):
+        espera = event.duration or 0.0  # Segundos esperando una conexión del pool
+        with self.lock:
+            self.contadores["checkouts"] += 1
+            self.contadores["conexiones_en_uso"] += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+
+    def connection_checked_in(self, event):
+        self._sumar("conexiones_en_uso", -1)
+
+    def resumen(self):
+        with self.lock:
+            resumen = dict(self.contadores)
+            checkouts = resumen["checkouts"]
+            resumen["conexiones_abiertas"] = resumen["conexiones_creadas"] - resumen["conexiones_cerradas"]
+            resumen["espera_promedio_ms"] = round(1000 * self.espera_total / checkouts, 3) if checkouts else 0.0
+            resumen["espera_max_ms"] = round(1000 * self.espera_max, 3)
+        return resumen
@@ -0,0 +1,118 @@
+import math
+import os
+
+# Esquema de las lecturas de sensores: cada variable se guarda como número (double), con
+# rango válido y un nombre corto opcional para reducir el tamaño de cada documento
+class Variable:
+    def __init__(self, nombre, corto, unidad, minimo, maximo):
+        self.nombre = nombre
+        self.corto = corto
+        self.unidad = unidad
+        self.minimo = minimo
+        self.maximo = maximo
+
+    def en_rango(self, valor):
+        return self.minimo <= valor <= self.maximo
+
+# Rangos iguales a los del formulario de registro manual del dashboard
+ESQUEMA = [
+    Variable("temperatura", "te", "°C", 0.0, 30.0),
+    Variable("ph", "ph", "pH", 0.0, 14.0),
+    Variable("oxigeno", "ox", "%", 0.0, 100.0),
+    Variable("turbidez", "tu", "%", 0.0, 100.0),
+    Variable("conductividad", "co", "ppm", 0.0, 3000.0),
+]
+VARIABLES_ESQUEMA = {v.nombre: v for v in ESQUEMA}
+
+# Campos de cada lectura que no son variables medidas
+CAMPOS_BASE = ("tiempo", "id_dispositivo", "manual")
+
+# Qué hacer con un valor fuera de rango: "marcar" (se guarda y se anota en fuera_rango)
+# o "rechazar" (la lectura no se guarda)
+ESQUEMA_FUERA_RANGO = os.environ.get("ESQUEMA_FUERA_RANGO", "marcar")
+# Campos que no están en el esquema: "descartar" o "conservar"
+ESQUEMA_CAMPOS_EXTRA = os.environ.get("ESQUEMA_CAMPOS_EXTRA", "descartar")
+# Guardar las variables con su nombre corto (temperatura -> te); la lectura acepta ambos
+ESQUEMA_COMPACTO = os.environ.get("ESQUEMA_COMPACTO", "0") == "1"
+
+class LecturaInvalida(ValueError):
+    pass
+
+# --- ESCRITURA ---
+def coercer(valor, variable):
+    # Acepta números y textos como "21.5" o "21,5"; vacío/None significa "sin dato"
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, bool):
+        raise LecturaInvalida(f"Valor no numérico en {variable.nombre}")
+    try:
+        numero = float(valor.replace(",", ".") if isinstance(valor, str) else valor)
+    except (TypeError, ValueError):
+        raise LecturaInvalida(f"Valor no numérico en {variable.nombre}")
+    if not math.isfinite(numero):
+        raise LecturaInvalida(f"Valor no numérico en {variable.nombre}")
+    return numero
+
+def campo_guardado(nombre):
+    return VARIABLES_ESQUEMA[nombre].corto if ESQUEMA_COMPACTO else nombre
+
+def validar_lectura(doc):
+    # Devuelve el documento a guardar (mismo orden de campos); lanza LecturaInvalida
+    salida = {}
+    fuera_rango = []
+    for campo, valor in doc.items():
+        if campo in CAMPOS_BASE:
+            salida[campo] = valor
+            continue
+
+        variable = VARIABLES_ESQUEMA.get(campo)
+        if variable is None:
+            if ESQUEMA_CAMPOS_EXTRA == "conservar":
+                salida[campo] = valor
+            continue
+
+        numero = coercer(valor, variable)
+        if numero is None:
+            continue
+        if not variable.en_rango(numero):
+            if ESQUEMA_FUERA_RANGO == "rechazar":
+                raise LecturaInvalida(
+                    f"{campo} fuera de rango: {numero} (válido {variable.minimo} - {variable.maximo} {variable.unidad})"
+                )
+            fuera_rango.append(campo)
+        salida[campo_guardado(campo)] = numero
+
+    if fuera_rango:
+        salida["fuera_rango"] = fuera_rango
+    return salida
+
+# --- LECTURA ---
+# Las colecciones pueden mezclar documentos con nombres largos (anteriores o con
+# ESQUEMA_COMPACTO=0) y cortos, así que la lectura siempre acepta los dos
+def valor_variable(doc, nombre):
+    if nombre in doc:
+        return doc[nombre]
+    variable = VARIABLES_ESQUEMA.get(nombre)
+    return doc.get(variable.corto) if variable else None
+
+def expandir(doc):
+    # Adaptador de lectura: renombra en el mismo documento los campos cortos a su nombre público
+    for variable in ESQUEMA:
+        if variable.corto != variable.nombre and variable.corto in doc:
+            corto = doc.pop(variable.corto)
+            doc.setdefault(variable.nombre, corto)
+    return doc
+
+def proyeccion_variables(nombres):
+    proyeccion = {}
+    for nombre in nombres:
+        proyeccion[nombre] = 1
+        proyeccion[VARIABLES_ESQUEMA[nombre].corto] = 1
+    return proyeccion
+
+def expresion_campo(nombre):
+    # Expresión de agregación equivalente a valor_variable(doc, nombre)
+    corto = VARIABLES_ESQUEMA[nombre].corto
+    if corto == nombre:
+        return f"${nombre}"
+    return {"$ifNull": [f"${nombre}", f"${corto}"]}
@@ -0,0 +1,134 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .agregaciones import VARIABLES, construir_filtro
+from .esquema import valor_variable
+from .lecturas import ParametroInvalido, lista_param, parsear_tiempo
+
+# Exportación del historial completo de un dominio (/api/exportar) en CSV o Parquet, escrita
+# a medida que se lee el cursor: la memoria usada no depende del tamaño del historial
+
+# Lecturas por row group de Parquet (cada grupo se envía apenas se escribe)
+FILAS_POR_GRUPO = 50000
+
+ESQUEMA_PARQUET = pa.schema(
+    [("tiempo", pa.timestamp("ms", tz="UTC")), ("id_dispositivo", pa.string())]
+    + [(var, pa.float64()) for var in VARIABLES]
+)
+
+FORMATOS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def parametros_exportar(args):
+    # Valida los parámetros de /api/exportar; lanza ParametroInvalido con el mensaje para el cliente
+    dominio = args.get('dominio')
+    if not dominio:
+        raise ParametroInvalido('Falta parámetro dominio')
+
+    formato = args.get('formato', default='csv')
+    if formato not in FORMATOS:
+        raise ParametroInvalido('El parámetro formato debe ser csv o parquet')
+
+    # manual=1: solo registros manuales; manual=0: solo sensores; sin indicar: todos
+    manual = args.get('manual')
+    if manual not in (None, '0', '1'):
+        raise ParametroInvalido('El parámetro manual debe ser 0 o 1')
+
+    try:
+        desde = parsear_tiempo(args.get('desde'), None)
+        hasta = parsear_tiempo(args.get('hasta'), None)
+    except ValueError:
+        raise ParametroInvalido('Los parámetros desde/hasta deben estar en formato ISO 8601')
+
+    return {
+        'dominio': dominio,
+        'dispositivos': lista_param(args, 'id_dispositivo'),
+        'formato': formato,
+        'manual': manual,
+        'desde': desde,
+        'hasta': hasta,
+    }
+
+def filtro_exportar(params):
+    filtro = construir_filtro(params['dispositivos'], params['desde'], params['hasta'])
+    if params['manual'] == '1':
+        filtro['manual'] = True
+    elif params['manual'] == '0':
+        filtro['manual'] = {'$ne': True}
+    return filtro
+
+def manual_exportar(params):
+    # El mismo filtro manual para el archivo Parquet: True, False o None (todos)
+    return {'1': True, '0': False}.get(params['manual'])
+
+def nombre_archivo(params):
+    partes = [params['dominio']] + sorted(params['dispositivos'])
+    if params['manual'] == '1':
+        partes.append('manual')
+    return f"{'_'.join(partes)}.{params['formato']}"
+
+# --- PARQUET ---
+def _numero(valor):
+    # Lecturas antiguas pueden tener textos; lo no numérico queda como nulo
+    if valor is None or isinstance(valor, bool):
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+def tabla_parquet(docs, esquema=ESQUEMA_PARQUET):
+    # El archivo (app.archivo) usa este mismo esquema más las columnas manual y _id
+    columnas = {
+        "tiempo": [doc.get("tiempo") for doc in docs],
+        "id_dispositivo": [doc.get("id_dispositivo") for doc in docs],
+    }
+    if "manual" in esquema.names:
+        columnas["manual"] = [bool(doc.get("manual")) for doc in docs]
+    for var in VARIABLES:
+        columnas[var] = [_numero(valor_variable(doc, var)) for doc in docs]
+    if "_id" in esquema.names:
+        columnas["_id"] = [str(doc["_id"]) for doc in docs]
+    return pa.Table.from_pydict(columnas, schema=esquema)
+
+class _Sumidero:
+    # Destino del ParquetWriter: acumula lo escrito hasta que se envía al cliente
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        datos = b"".join(self.partes)
+        self.partes = []
+        return datos
+
+class EscritorParquet:
+    # Se usa igual desde un generador síncrono (Flask) o asíncrono (ASGI): cada lote de
+    # documentos es un row group y devuelve los bytes listos para enviar
+    def __init__(self):
+        self.sumidero = _Sumidero()
+        self.escritor = pq.ParquetWriter(self.sumidero, ESQUEMA_PARQUET, compression="zstd")
+
+    def agregar(self, docs):
+        self.escritor.write_table(tabla_parquet(docs), row_group_size=FILAS_POR_GRUPO)
+        return self.sumidero.vaciar()
+
+    def cerrar(self):
+        self.escritor.close()
+        return self.sumidero.vaciar()
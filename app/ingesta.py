@@ -0,0 +1,189 @@
+from collections import defaultdict
+from pymongo.errors import BulkWriteError, PyMongoError
+import atexit
+import os
+import queue
+import threading
+import time
+from .comida import COLECCION_COMIDA
+from .rollups import marcar_atrasadas
+from .ultimo_estado import actualizar_ultimo_estado
+
+# Modo de ingesta de /api/sensores y /api/registro_comida: "directo" (insert_one en la
+# petición) o "cola" (se encola y un hilo inserta por lotes con insert_many)
+INGESTA_MODO = os.environ.get("INGESTA_MODO", "directo")
+# Con cola: "encolado" responde 202 al encolar; "confirmado" espera a que el lote se escriba
+INGESTA_DURABILIDAD = os.environ.get("INGESTA_DURABILIDAD", "encolado")
+TAMANO_COLA = int(os.environ.get("INGESTA_TAMANO_COLA", 10000))
+TAMANO_LOTE = int(os.environ.get("INGESTA_TAMANO_LOTE", 500))
+INTERVALO_MS = int(os.environ.get("INGESTA_INTERVALO_MS", 200))
+ESPERA_CONFIRMACION_S = float(os.environ.get("INGESTA_ESPERA_CONFIRMACION_S", 10))
+REINTENTOS = 3
+
+class ColaLlena(Exception):
+    pass
+
+class _Pendiente:
+    __slots__ = ("coleccion", "doc", "encolado", "listo", "error")
+
+    def __init__(self, coleccion, doc, confirmar):
+        self.coleccion = coleccion
+        self.doc = doc
+        self.encolado = time.monotonic()
+        self.listo = threading.Event() if confirmar else None
+        self.error = None
+
+class ColaIngesta:
+    def __init__(self, modo=INGESTA_MODO, durabilidad=INGESTA_DURABILIDAD, tamano_cola=TAMANO_COLA,
+                 tamano_lote=TAMANO_LOTE, intervalo_ms=INTERVALO_MS):
+        self.activa = modo == "cola"
+        self.confirmar = durabilidad == "confirmado"
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo_ms / 1000
+        self.cola = queue.Queue(maxsize=tamano_cola)
+        self.db = None
+        self.hilo = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.contadores = {
+            "encolados": 0,
+            "insertados": 0,
+            "fallidos": 0,
+            "rechazados_cola_llena": 0,
+            "lotes": 0,
+        }
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+        self.espera_max = 0.0
+
+    def _sumar(self, clave, cantidad=1):
+        with self.lock:
+            self.contadores[clave] += cantidad
+
+    def _asegurar_hilo(self, db):
+        # El hilo se inicia con la primera inserción de cada proceso (gunicorn hace fork
+        # después de importar la app, y los hilos no sobreviven al fork)
+        if self.hilo is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.hilo is None or self.pid != os.getpid():
+                self.db = db
+                self.pid = os.getpid()
+                self.hilo = threading.Thread(target=self._ciclo, name="cola-ingesta", daemon=True)
+                self.hilo.start()
+                atexit.register(self.vaciar)
+
+    def encolar(self, db, coleccion, doc):
+        # Lanza ColaLlena si no hay espacio; en modo confirmado espera la escritura y relanza
+        # el error de MongoDB si la inserción falló
+        self._asegurar_hilo(db)
+        pendiente = _Pendiente(coleccion, doc, self.confirmar)
+        try:
+            self.cola.put_nowait(pendiente)
+        except queue.Full:
+            self._sumar("rechazados_cola_llena")
+            raise ColaLlena(f"Cola de ingesta llena ({self.cola.maxsize} documentos)")
+        self._sumar("encolados")
+
+        if pendiente.listo is not None:
+            if not pendiente.listo.wait(ESPERA_CONFIRMACION_S):
+                raise TimeoutError("La escritura no se confirmó a tiempo")
+            if pendiente.error:
+                raise pendiente.error
+
+    # --- ESCRITURA POR LOTES ---
+    def _tomar_lote(self):
+        # Espera el primer documento y junta los siguientes hasta completar el lote o el intervalo
+        lote = [self.cola.get()]
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamano_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _ciclo(self):
+        while True:
+            lote = self._tomar_lote()
+            try:
+                self._escribir(lote)
+            except Exception as e:
+                print(f"❌ Error inesperado en la cola de ingesta: {e}")
+                for pendiente in lote:
+                    if pendiente.listo is not None and not pendiente.listo.is_set():
+                        pendiente.error = PyMongoError(str(e))
+                        pendiente.listo.set()
+            finally:
+                for _ in lote:
+                    self.cola.task_done()
+
+    def _escribir(self, lote):
+        inicio = time.monotonic()
+        espera = inicio - min(p.encolado for p in lote)
+        por_coleccion = defaultdict(list)
+        for pendiente in lote:
+            por_coleccion[pendiente.coleccion].append(pendiente)
+
+        for coleccion, pendientes in por_coleccion.items():
+            errores = self._insertar(coleccion, [p.doc for p in pendientes])
+            for indice, pendiente in enumerate(pendientes):
+                pendiente.error = errores.get(indice)
+                if pendiente.listo is not None:
+                    pendiente.listo.set()
+            self._sumar("insertados", len(pendientes) - len(errores))
+            self._sumar("fallidos", len(errores))
+            # Como en el modo directo: toda colección de lecturas, cualquiera sea su nombre
+            if coleccion != COLECCION_COMIDA:
+                insertados = [p.doc for indice, p in enumerate(pendientes) if indice not in errores]
+                actualizar_ultimo_estado(self.db, [(coleccion, doc) for doc in insertados])
+                marcar_atrasadas(self.db, coleccion, insertados)
+
+        latencia = time.monotonic() - inicio
+        with self.lock:
+            self.contadores["lotes"] += 1
+            self.latencia_total += latencia
+            self.latencia_max = max(self.latencia_max, latencia)
+            self.espera_max = max(self.espera_max, espera)
+
+    def _insertar(self, coleccion, docs):
+        # Devuelve {índice: error} de los documentos que no se pudieron insertar. insert_many
+        # asigna los _id antes de enviar: al reintentar, lo que ya se había escrito falla por
+        # clave duplicada y se cuenta como insertado
+        for intento in range(REINTENTOS):
+            try:
+                self.db[coleccion].insert_many(docs, ordered=False)
+                return {}
+            except BulkWriteError as e:
+                return {
+                    err["index"]: PyMongoError(err.get("errmsg", "Error de escritura"))
+                    for err in e.details.get("writeErrors", [])
+                    if not (intento and err.get("code") == 11000)
+                }
+            except PyMongoError as e:
+                if intento == REINTENTOS - 1:
+                    print(f"❌ No se pudo insertar un lote de {len(docs)} documentos en {coleccion}: {e}")
+                    return {indice: e for indice in range(len(docs))}
+                time.sleep(0.5 * (intento + 1))
+
+    def vaciar(self, espera=5.0):
+        # Al cerrar el proceso: da tiempo al hilo para escribir lo que quede en la cola
+        limite = time.monotonic() + espera
+        while self.cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.05)
+
+    def resumen(self):
+        with self.lock:
+            resumen = dict(self.contadores)
+            lotes = resumen["lotes"]
+            resumen["modo"] = "cola" if self.activa else "directo"
+            resumen["durabilidad"] = "confirmado" if self.confirmar else "encolado"
+            resumen["profundidad"] = self.cola.qsize()
+            resumen["capacidad"] = self.cola.maxsize
+            resumen["latencia_flush_promedio_ms"] = round(1000 * self.latencia_total / lotes, 3) if lotes else 0.0
+            resumen["latencia_flush_max_ms"] = round(1000 * self.latencia_max, 3)
+            resumen["espera_en_cola_max_ms"] = round(1000 * self.espera_max, 3)
+        return resumen
@@ -0,0 +1,300 @@
+from datetime import datetime, timezone
+import csv
+import io
+import json
+from .agregaciones import INTERVALOS, VARIABLES, construir_filtro
+from pymongo.errors import BulkWriteError
+from .esquema import LecturaInvalida, proyeccion_variables, validar_lectura, valor_variable
+from .paginacion import ORDENES, decodificar_cursor, filtro_keyset, orden_keyset
+
+# Validación y formato de las lecturas, compartidos por la API Flask (app.routes) y la
+# variante ASGI (app_asgi.routes) para que ambas respondan exactamente igual
+
+# Campos públicos de una lectura, en el orden de la respuesta
+CAMPOS_DATOS = ['tiempo', 'id_dispositivo'] + VARIABLES
+PROYECCION_LECTURAS = {'_id': 1, 'tiempo': 1, 'id_dispositivo': 1, **proyeccion_variables(VARIABLES)}
+
+# Documentos que se piden a MongoDB por viaje al exportar en streaming
+TAMANO_LOTE_CURSOR = 1000
+
+# Máximo de lecturas aceptadas por petición en /api/sensores/batch
+MAX_LECTURAS_LOTE = 5000
+MIMETYPES_NDJSON = ('application/x-ndjson', 'application/jsonl')
+
+class ParametroInvalido(ValueError):
+    pass
+
+def parsear_tiempo(valor, por_defecto):
+    # Las lecturas en lote pueden traer su propio tiempo (ISO 8601), ya que
+    # un gateway puede enviarlas varios segundos después de medirlas
+    if valor is None:
+        return por_defecto
+    tiempo = datetime.fromisoformat(str(valor))
+    if tiempo.tzinfo is not None:
+        tiempo = tiempo.astimezone(timezone.utc).replace(tzinfo=None)
+    return tiempo
+
+def tiempo_iso(tiempo):
+    if isinstance(tiempo, datetime):
+        return tiempo.isoformat() + "Z"
+    return str(tiempo)
+
+def lista_param(args, nombre):
+    # Acepta ?id_dispositivo=a&id_dispositivo=b o ?id_dispositivo=a,b
+    valores = []
+    for valor in args.getlist(nombre):
+        valores.extend(v.strip() for v in valor.split(',') if v.strip())
+    return valores
+
+# --- DOCUMENTOS A INSERTAR ---
+def documento_sensor(data, ahora):
+    # Devuelve (dominio, documento), o None si falta el dominio. Las variables se validan
+    # contra el esquema (lanza esquema.LecturaInvalida)
+    if not data or 'dominio' not in data:
+        return None
+    data['tiempo'] = ahora
+    data['id_dispositivo'] = data.get('id_dispositivo', 'desconocido')
+    dominio = data.pop('dominio')  # Usamos este nombre como colección
+    return dominio, validar_lectura(data)
+
+def documento_comida(data, ahora):
+    if not data or data.get("evento") != "comida":
+        return None
+    data['tiempo'] = ahora
+    data['id_dispositivo'] = data.get("id_dispositivo", "desconocido")
+    return data
+
+def documento_manual(data, ahora):
+    # Devuelve (dominio, documento), o None si faltan campos obligatorios
+    if not data or 'dominio' not in data or 'id_dispositivo' not in data:
+        return None
+
+    dominio = data.pop('dominio')
+    doc = {"id_dispositivo": data.pop('id_dispositivo')}
+
+    # Agregar los campos en el orden deseado si están presentes
+    for campo in ["turbidez", "ph", "temperatura", "oxigeno", "conductividad"]:
+        if campo in data and data[campo] not in ("", None):
+            doc[campo] = data[campo]
+
+    doc["tiempo"] = ahora
+    doc["manual"] = True  # Campo adicional al final
+    return dominio, validar_lectura(doc)
+
+# --- LOTES DE LECTURAS ---
+def lecturas_ndjson(texto):
+    # Una lectura por línea; las que no son JSON quedan como None y se rechazan una a una
+    lecturas = []
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            lecturas.append(json.loads(linea))
+        except json.JSONDecodeError:
+            lecturas.append(None)
+    return lecturas
+
+def lecturas_json(data):
+    # Arreglo JSON o {"lecturas": [...]}; None si no es ninguno
+    if isinstance(data, dict):
+        data = data.get('lecturas')
+    return data if isinstance(data, list) else None
+
+def error_lote(lecturas):
+    # (mensaje, estado HTTP) si el lote completo se rechaza, o None
+    if lecturas is None:
+        return 'Se esperaba un arreglo JSON o NDJSON de lecturas', 400
+    if not lecturas:
+        return 'El lote no contiene lecturas', 400
+    if len(lecturas) > MAX_LECTURAS_LOTE:
+        return f'El lote supera el máximo de {MAX_LECTURAS_LOTE} lecturas', 413
+    return None
+
+def _rechazo(i, error):
+    return {'indice': i, 'estado': 'rechazado', 'error': error}
+
+def preparar_lote(lecturas, ahora):
+    # Devuelve (resultados por índice, {dominio: [(indice, documento)]}) con las lecturas válidas
+    resultados = [{'indice': i, 'estado': 'aceptado'} for i in range(len(lecturas))]
+    por_dominio = {}
+
+    for i, data in enumerate(lecturas):
+        if data is None:
+            resultados[i] = _rechazo(i, 'Línea no es JSON válido')
+            continue
+        if not isinstance(data, dict) or not data.get('dominio') or not isinstance(data['dominio'], str):
+            resultados[i] = _rechazo(i, 'Falta campo dominio')
+            continue
+
+        doc = dict(data)
+        try:
+            doc['tiempo'] = parsear_tiempo(doc.get('tiempo'), ahora)
+        except ValueError:
+            resultados[i] = _rechazo(i, 'Campo tiempo inválido')
+            continue
+        doc['id_dispositivo'] = doc.get('id_dispositivo', 'desconocido')
+
+        dominio = doc.pop('dominio')
+        try:
+            doc = validar_lectura(doc)
+        except LecturaInvalida as e:
+            resultados[i] = _rechazo(i, str(e))
+            continue
+        por_dominio.setdefault(dominio, []).append((i, doc))
+
+    return resultados, por_dominio
+
+def rechazar_escritura(resultados, items, error):
+    # Marca como rechazadas las lecturas de items que insert_many no pudo escribir y devuelve
+    # los documentos que sí quedaron guardados
+    if isinstance(error, BulkWriteError):
+        for detalle in error.details.get('writeErrors', []):
+            i = items[detalle['index']][0]
+            resultados[i] = _rechazo(i, detalle.get('errmsg', 'Error de escritura'))
+    elif error is not None:
+        for i, _ in items:
+            resultados[i] = _rechazo(i, str(error))
+    return [doc for i, doc in items if resultados[i]['estado'] == 'aceptado']
+
+def respuesta_lote(resultados):
+    # (cuerpo, estado HTTP): 201 todo aceptado, 400 todo rechazado, 207 mixto
+    rechazados = sum(1 for r in resultados if r['estado'] == 'rechazado')
+    respuesta = {
+        'aceptados': len(resultados) - rechazados,
+        'rechazados': rechazados,
+        'resultados': resultados
+    }
+    if rechazados == 0:
+        return respuesta, 201
+    if rechazados == len(resultados):
+        return respuesta, 400
+    return respuesta, 207
+
+# --- CONSULTA DE LECTURAS ---
+def parametros_datos(args):
+    # Valida los parámetros de /api/datos; lanza ParametroInvalido con el mensaje para el cliente
+    dominio = args.get('dominio')
+    if not dominio:
+        raise ParametroInvalido('Falta parámetro dominio')
+
+    formato = args.get('formato', default='json')
+    if formato not in ('json', 'ndjson', 'csv'):
+        raise ParametroInvalido('El parámetro formato debe ser json, ndjson o csv')
+
+    # En json el límite por defecto es 200; en ndjson/csv se transmite todo si no se indica
+    limit = args.get('limit', default=200 if formato == 'json' else None, type=int)
+    if limit is not None and limit <= 0:
+        raise ParametroInvalido('El parámetro limit debe ser mayor que 0')
+
+    orden = args.get('orden', default='desc' if formato == 'json' else 'asc')
+    if orden not in ORDENES:
+        raise ParametroInvalido('El parámetro orden debe ser asc o desc')
+
+    try:
+        desde = parsear_tiempo(args.get('desde'), None)
+        hasta = parsear_tiempo(args.get('hasta'), None)
+        cursor = decodificar_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        raise ParametroInvalido('Los parámetros desde/hasta deben estar en formato ISO 8601 y cursor debe ser válido')
+
+    return {
+        'dominio': dominio,
+        'dispositivos': lista_param(args, 'id_dispositivo'),
+        'formato': formato,
+        'limit': limit,
+        'direccion': ORDENES[orden],
+        'desde': desde,
+        'hasta': hasta,
+        'cursor': cursor,
+    }
+
+def consulta_datos(params):
+    # Filtro y orden de la consulta (dispositivos y rango de tiempo se resuelven en MongoDB),
+    # continuando después del cursor de la página anterior si se indicó
+    filtro = construir_filtro(params['dispositivos'], params['desde'], params['hasta'])
+    filtro = filtro_keyset(filtro, params['cursor'], params['direccion'])
+    return filtro, orden_keyset(params['direccion'])
+
+# --- AGREGADOS ---
+def parametros_agregados(args):
+    # Parámetros de /api/agregados (lanza ParametroInvalido)
+    dominio = args.get('dominio')
+    if not dominio:
+        raise ParametroInvalido('Falta parámetro dominio')
+
+    intervalo = args.get('intervalo', default='1h')
+    if intervalo not in INTERVALOS:
+        raise ParametroInvalido(f'Intervalo inválido, use uno de: {", ".join(INTERVALOS)}')
+
+    max_puntos = args.get('max_puntos', type=int)
+    if max_puntos is not None and max_puntos < 3:
+        raise ParametroInvalido('El parámetro max_puntos debe ser al menos 3')
+
+    variables = lista_param(args, 'variables') or VARIABLES
+    if any(var not in VARIABLES for var in variables):
+        raise ParametroInvalido(f'Variables válidas: {", ".join(VARIABLES)}')
+
+    try:
+        hasta = parsear_tiempo(args.get('hasta'), None)
+        desde = parsear_tiempo(args.get('desde'), None)
+    except ValueError:
+        raise ParametroInvalido('Los parámetros desde/hasta deben estar en formato ISO 8601')
+
+    return {
+        'dominio': dominio,
+        'dispositivos': lista_param(args, 'id_dispositivo'),
+        'intervalo': intervalo,
+        'max_puntos': max_puntos,
+        'variables': variables,
+        'desde': desde,
+        'hasta': hasta,
+        # fuente=crudo fuerza la agregación sobre las lecturas aunque existan rollups
+        'crudo': args.get('fuente') == 'crudo',
+    }
+
+def series_publicas(series):
+    # Resultado de agregaciones.series_lttb como lista por dispositivo
+    return [
+        {
+            'id_dispositivo': disp,
+            'series': {
+                var: [{'tiempo': tiempo_iso(t), 'valor': v} for t, v in puntos]
+                for var, puntos in series_disp.items()
+            }
+        }
+        for disp, series_disp in sorted(series.items(), key=lambda item: str(item[0]))
+    ]
+
+def bucket_publico(doc):
+    doc.pop('manual', None)
+    doc['tiempo'] = tiempo_iso(doc['tiempo'])
+    return doc
+
+# --- FORMATO DE SALIDA ---
+def dato_publico(doc):
+    dato = {'tiempo': tiempo_iso(doc.get("tiempo"))}
+    dato['id_dispositivo'] = doc.get('id_dispositivo')
+    for var in VARIABLES:
+        dato[var] = valor_variable(doc, var)
+    return dato
+
+def linea_ndjson(doc):
+    return json.dumps(dato_publico(doc), default=str) + '\n'
+
+def bloque_csv(docs, encabezado=False):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if encabezado:
+        escritor.writerow(CAMPOS_DATOS)
+    for doc in docs:
+        dato = dato_publico(doc)
+        escritor.writerow(['' if dato[c] is None else dato[c] for c in CAMPOS_DATOS])
+    return buffer.getvalue()
+
+def comida_publica(doc):
+    return {
+        'tiempo': tiempo_iso(doc.get("tiempo")),
+        'evento': doc.get('evento'),
+        'id_dispositivo': doc.get('id_dispositivo', 'desconocido')
+    }
@@ -0,0 +1,46 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+import base64
+import binascii
+import json
+
+# Paginación por keyset sobre (tiempo, _id): estable aunque varias lecturas compartan el mismo
+# tiempo, y sin el costo de skip() al avanzar por la colección
+ORDENES = {"asc": 1, "desc": -1}
+
+def codificar_cursor(doc):
+    # None si el tiempo no es una fecha (lecturas antiguas con tiempo como texto o sin tiempo):
+    # el filtro de la página siguiente compara fechas, así que la paginación termina ahí
+    tiempo = doc.get("tiempo")
+    if not isinstance(tiempo, datetime):
+        return None
+    datos = {"t": tiempo.isoformat(), "id": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip("=")
+
+def decodificar_cursor(token):
+    # Lanza ValueError si el cursor no es válido
+    try:
+        relleno = "=" * (-len(token) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(token + relleno))
+        return datetime.fromisoformat(datos["t"]), ObjectId(datos["id"])
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError(f"Cursor inválido: {e}")
+
+def filtro_keyset(filtro, cursor, direccion):
+    if not cursor:
+        return filtro
+    tiempo, _id = cursor
+    op = "$lt" if direccion < 0 else "$gt"
+    condicion = {"$or": [{"tiempo": {op: tiempo}}, {"tiempo": tiempo, "_id": {op: _id}}]}
+    return {"$and": [filtro, condicion]} if filtro else condicion
+
+def clave_keyset(doc):
+    # Orden de (tiempo, _id) en MongoDB para intercalar otras fuentes; un tiempo antiguo guardado
+    # como texto queda antes de las fechas, como en el orden de tipos de BSON
+    tiempo = doc.get("tiempo")
+    es_fecha = isinstance(tiempo, datetime)
+    return es_fecha, tiempo if es_fecha else str(tiempo), str(doc.get("_id"))
+
+def orden_keyset(direccion):
+    return [("tiempo", direccion), ("_id", direccion)]
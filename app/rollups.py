@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta
+import os
+import pytz
+from pymongo.errors import PyMongoError
+from .agregaciones import (
+    VARIABLES, ZONA_HORARIA, _numero, acumuladores, construir_filtro, pipeline_agregados, proyeccion_variables,
+    truncar_tiempo
+)
+
+# Agregados por hora y por día de cada dispositivo, guardados en colecciones propias y
+# actualizados de forma incremental con $merge a partir de la última lectura procesada
+GRANULARIDADES = {"hora": "1h", "dia": "1d"}
+COLECCIONES_ROLLUP = {"hora": "rollup_hora", "dia": "rollup_dia"}
+COLECCION_ESTADO = "rollup_estado"
+
+# Las lecturas pueden llegar con atraso (reenvío del spool del lector serial), así que cada
+# pasada recalcula también los buckets de las últimas horas antes de la marca
+MARGEN_HORAS = float(os.environ.get("ROLLUP_MARGEN_HORAS", 6))
+# Lo que llega con más atraso que el margen (un spool reenviado tras horas sin red) deja en el
+# estado la marca "pendiente" con su tiempo más antiguo, y la pasada siguiente recalcula desde ahí
+DURACION_BUCKET = {"hora": timedelta(hours=1), "dia": timedelta(hours=25)}
+
+def inicio_bucket(tiempo, granularidad):
+    # Inicio (UTC sin zona horaria) del bucket que contiene a tiempo, en hora de Chile
+    chile_tz = pytz.timezone(ZONA_HORARIA)
+    local = pytz.utc.localize(tiempo).astimezone(chile_tz)
+    if granularidad == "dia":
+        local = chile_tz.localize(local.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None))
+    else:
+        local = local.replace(minute=0, second=0, microsecond=0)
+    return local.astimezone(pytz.utc).replace(tzinfo=None)
+
+def siguiente_bucket(tiempo, granularidad):
+    # Inicio del bucket siguiente al que contiene a tiempo (25 h cubre los días con cambio de hora)
+    return inicio_bucket(inicio_bucket(tiempo, granularidad) + DURACION_BUCKET[granularidad], granularidad)
+
+def pipeline_rollup(dominio, granularidad, desde, corte, manual, variables=VARIABLES):
+    filtro = {"tiempo": {"$lte": corte}, "manual": True if manual else {"$ne": True}}
+    if desde is not None:
+        filtro["tiempo"]["$gte"] = desde
+
+    grupo = {"_id": {"id_dispositivo": "$id_dispositivo", "tiempo": truncar_tiempo(GRANULARIDADES[granularidad])}, **acumuladores(variables)}
+    # $literal: en $project un true/false suelto incluye o excluye el campo
+    proyeccion = {
+        "_id": {"dominio": {"$literal": dominio}, "id_dispositivo": "$_id.id_dispositivo", "manual": {"$literal": manual}, "tiempo": "$_id.tiempo"},
+        "dominio": {"$literal": dominio},
+        "id_dispositivo": "$_id.id_dispositivo",
+        "manual": {"$literal": manual},
+        "tiempo": "$_id.tiempo",
+        "n": 1,
+        **proyeccion_variables(variables),
+        "actualizado": "$$NOW"
+    }
+
+    pipeline = [{"$match": filtro}]
+    if manual:
+        # Los registros manuales son pocos: además del resumen se guarda el primer valor del
+        # bucket, que es el que se compara contra el promedio de los sensores
+        pipeline.append({"$sort": {"tiempo": 1}})
+        for var in variables:
+            grupo[f"{var}_valores"] = {"$push": _numero(var)}
+            proyeccion[var]["primero"] = {
+                "$first": {"$filter": {"input": f"${var}_valores", "cond": {"$ne": ["$$this", None]}}}
+            }
+
+    return pipeline + [
+        {"$group": grupo},
+        {"$project": proyeccion},
+        {"$merge": {"into": COLECCIONES_ROLLUP[granularidad], "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+def asegurar_indices_rollup(db):
+    for nombre in COLECCIONES_ROLLUP.values():
+        db[nombre].create_index(
+            [("dominio", 1), ("manual", 1), ("id_dispositivo", 1), ("tiempo", 1)],
+            name="dominio_manual_dispositivo_tiempo"
+        )
+
+def estado_rollup(db, dominio, granularidad):
+    return db[COLECCION_ESTADO].find_one({"_id": f"{dominio}:{granularidad}"})
+
+def actualizar_rollups(db, dominio, granularidades=GRANULARIDADES, reconstruir=False):
+    # Recalcula los buckets desde la marca de agua (menos el margen, o desde la lectura atrasada
+    # pendiente) hasta la última lectura actual; lo que llegue durante la pasada queda para la siguiente
+    ultimo = db[dominio].find_one({}, {"_id": 0, "tiempo": 1}, sort=[("tiempo", -1)])
+    if not ultimo or not isinstance(ultimo.get("tiempo"), datetime):
+        return {}
+
+    corte = ultimo["tiempo"]
+    procesados = {}
+    for granularidad in granularidades:
+        clave = f"{dominio}:{granularidad}"
+        # La marca pendiente se toma y se borra al empezar: un lote atrasado que llegue durante
+        # la pasada la vuelve a dejar
+        estado = db[COLECCION_ESTADO].find_one_and_update({"_id": clave}, {"$unset": {"pendiente": ""}}) or {}
+        desde = None
+        if estado.get("hasta") and not reconstruir:
+            desde = min(estado["hasta"] - timedelta(hours=MARGEN_HORAS), estado.get("pendiente", estado["hasta"]))
+            desde = inicio_bucket(desde, granularidad)
+        if estado.get("archivado"):
+            # Los buckets con lecturas ya archivadas no se recalculan: en MongoDB solo queda una parte
+            desde = max(desde or datetime.min, siguiente_bucket(estado["archivado"], granularidad))
+
+        try:
+            for manual in (False, True):
+                db[dominio].aggregate(pipeline_rollup(dominio, granularidad, desde, corte, manual), allowDiskUse=True)
+        except Exception:
+            if estado.get("pendiente"):
+                db[COLECCION_ESTADO].update_one({"_id": clave}, {"$min": {"pendiente": estado["pendiente"]}})
+            raise
+
+        db[COLECCION_ESTADO].update_one(
+            {"_id": clave},
+            {"$set": {"dominio": dominio, "granularidad": granularidad, "hasta": corte, "actualizado": datetime.utcnow()}},
+            upsert=True
+        )
+        procesados[granularidad] = desde
+
+    return procesados
+
+def marca_atrasadas(dominio, docs):
+    # (filtro, actualización) de rollup_estado para un lote recién insertado, o None si ninguna
+    # lectura es más antigua que el margen (el caso normal, sin consultar la base de datos)
+    tiempos = [doc["tiempo"] for doc in docs if isinstance(doc.get("tiempo"), datetime)]
+    if not tiempos or min(tiempos) >= datetime.utcnow() - timedelta(hours=MARGEN_HORAS):
+        return None
+    minimo = min(tiempos)
+    return (
+        {"dominio": dominio, "hasta": {"$gt": minimo + timedelta(hours=MARGEN_HORAS)}},
+        {"$min": {"pendiente": minimo}}
+    )
+
+def marcar_atrasadas(db, dominio, docs):
+    marca = marca_atrasadas(dominio, docs)
+    if not marca:
+        return
+    try:
+        db[COLECCION_ESTADO].update_many(*marca)
+    except PyMongoError as e:
+        # Las lecturas ya se guardaron; sin la marca quedan fuera de los rollups hasta un --reconstruir
+        print(f"⚠️ No se pudo marcar lecturas atrasadas de {dominio} en {COLECCION_ESTADO}: {e}")
+
+def filtro_rollup(dominio, dispositivos=None, desde=None, hasta=None, manual=None):
+    filtro = {"dominio": dominio}
+    if manual is not None:
+        filtro["manual"] = manual
+    if dispositivos:
+        filtro["id_dispositivo"] = {"$in": list(dispositivos)}
+    if desde or hasta:
+        filtro["tiempo"] = {}
+        if desde:
+            filtro["tiempo"]["$gte"] = desde
+        if hasta:
+            filtro["tiempo"]["$lt"] = hasta
+    return filtro
+
+def leer_rollup(db, dominio, granularidad, dispositivos=None, desde=None, hasta=None, manual=None, variables=VARIABLES):
+    proyeccion = {"_id": 0, "id_dispositivo": 1, "manual": 1, "tiempo": 1, "n": 1, **{var: 1 for var in variables}}
+    filtro = filtro_rollup(dominio, dispositivos, desde, hasta, manual)
+    return db[COLECCIONES_ROLLUP[granularidad]].find(filtro, proyeccion).sort([("id_dispositivo", 1), ("tiempo", 1)])
+
+def frontera_rollup(estado, granularidad):
+    # Inicio del primer bucket que puede estar incompleto: el de la última lectura procesada por
+    # el worker o el de una lectura atrasada que aún espera su pasada
+    return inicio_bucket(min(estado["hasta"], estado.get("pendiente", estado["hasta"])), granularidad)
+
+def filtro_recientes(frontera, dispositivos=None, desde=None, hasta=None):
+    # Lecturas de sensores desde la frontera, o None si el rango termina antes
+    if hasta is not None and hasta <= frontera:
+        return None
+    filtro = construir_filtro(dispositivos, max(desde, frontera) if desde else frontera, hasta)
+    filtro["manual"] = {"$ne": True}
+    return filtro
+
+def ordenar_buckets(docs):
+    # Orden de pipeline_agregados y leer_rollup: dispositivo y tiempo
+    return sorted(docs, key=lambda doc: (str(doc["id_dispositivo"]), doc["tiempo"]))
+
+def agregados_rollup(db, dominio, granularidad, estado, dispositivos=None, desde=None, hasta=None, variables=VARIABLES):
+    # Buckets de sensores desde los rollups, hasta la frontera; los siguientes (lo que llegó
+    # desde la última pasada del worker) se calculan sobre las lecturas, así la respuesta no
+    # queda atrasada un intervalo del worker
+    frontera = frontera_rollup(estado, granularidad)
+    hasta_rollup = min(hasta, frontera) if hasta else frontera
+    docs = list(leer_rollup(db, dominio, granularidad, dispositivos, desde, hasta_rollup, manual=False, variables=variables))
+    for doc in docs:
+        doc.pop("manual", None)  # Mismos campos que pipeline_agregados
+    filtro = filtro_recientes(frontera, dispositivos, desde, hasta)
+    if filtro is not None:
+        docs += db[dominio].aggregate(pipeline_agregados(filtro, GRANULARIDADES[granularidad], variables), allowDiskUse=True)
+    return ordenar_buckets(docs)
@@ -1,5 +1,26 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from pymongo.errors import PyMongoError
 from datetime import datetime
+from itertools import islice
+from .colecciones import preparar_dominio, registro_dominios
+from .comida import consulta_comida, parametros_comida, pipeline_ultima_comida
+from . import analitica
+from .archivo import agregados_con_archivo, con_archivo
+from .exportar import (
+    FILAS_POR_GRUPO, FORMATOS, EscritorParquet, filtro_exportar, manual_exportar, nombre_archivo, parametros_exportar
+)
+from .ingesta import ColaLlena
+from .esquema import LecturaInvalida, proyeccion_variables
+from .agregaciones import construir_filtro, pipeline_agregados, rango_lttb, series_lttb
+from .rollups import GRANULARIDADES, agregados_rollup, estado_rollup, marcar_atrasadas
+from .paginacion import codificar_cursor, orden_keyset
+from .ultimo_estado import actualizar_ultimo_estado, leer_ultimo_estado, reconstruir_ultimo_estado, sin_estado
+from .lecturas import (
+    MIMETYPES_NDJSON, PROYECCION_LECTURAS, TAMANO_LOTE_CURSOR, ParametroInvalido, bloque_csv, bucket_publico,
+    comida_publica, consulta_datos, dato_publico, documento_comida, documento_manual, documento_sensor, error_lote,
+    lecturas_json, lecturas_ndjson, linea_ndjson, lista_param, parametros_agregados, parametros_datos, preparar_lote,
+    rechazar_escritura, respuesta_lote, series_publicas, tiempo_iso
+)
 
 main = Blueprint('main', __name__)
 
@@ -7,76 +28,250 @@ main = Blueprint('main', __name__)
 def index():
     return jsonify({"message": "API del biorreactor funcionando"})
 
+@main.route('/api/diagnostico', methods=['GET'])
+def diagnostico():
+    return jsonify({
+        'conexiones': current_app.monitor_pool.resumen(),
+        'dominios': registro_dominios.resumen(),
+        'ingesta': current_app.cola_ingesta.resumen()
+    })
+
 @main.route('/api/sensores', methods=['POST'])
 def recibir_datos():
-    data = request.get_json()
-    if not data or 'dominio' not in data:
+    try:
+        documento = documento_sensor(request.get_json(), datetime.utcnow())
+    except LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    if documento is None:
         return jsonify({'error': 'Falta campo dominio'}), 400
 
-    # Añadir timestamp automaticamente
-    data['tiempo'] = datetime.utcnow()
-    data['id_dispositivo'] = data.get('id_dispositivo', 'desconocido')
-
     # Insertar en MongoDB
-    dominio = data.pop('dominio')  # Usamos este nombre como colección    
-    collection = current_app.mongo.db[dominio]
+    dominio, data = documento
+    collection = preparar_dominio(current_app.mongo.db, dominio)
+    if current_app.cola_ingesta.activa:
+        return _encolar(dominio, data, f'Datos guardados en dominio {dominio}')
     collection.insert_one(data)
+    actualizar_ultimo_estado(current_app.mongo.db, [(dominio, data)])
+    marcar_atrasadas(current_app.mongo.db, dominio, [data])
 
     return jsonify({'message': f'Datos guardados en dominio {dominio}'}), 201
 
+def _encolar(coleccion, doc, mensaje):
+    # Modo cola: 202 apenas el documento queda encolado, o 201 cuando la durabilidad es
+    # "confirmado" y el lote ya se escribió. Cola llena -> 503 para que el cliente reintente
+    cola = current_app.cola_ingesta
+    try:
+        cola.encolar(current_app.mongo.db, coleccion, doc)
+    except ColaLlena as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except PyMongoError as e:
+        return jsonify({'error': f'No se pudo guardar: {e}'}), 500
+
+    if cola.confirmar:
+        return jsonify({'message': mensaje}), 201
+    return jsonify({'message': f'{mensaje} (en cola)'}), 202
+
+def _leer_lote():
+    # Acepta un arreglo JSON (o {"lecturas": [...]}) o un flujo NDJSON
+    if request.mimetype in MIMETYPES_NDJSON:
+        return lecturas_ndjson(request.get_data(as_text=True))
+    return lecturas_json(request.get_json(silent=True))
+
+@main.route('/api/sensores/batch', methods=['POST'])
+def recibir_datos_lote():
+    lecturas = _leer_lote()
+    error = error_lote(lecturas)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    resultados, por_dominio = preparar_lote(lecturas, datetime.utcnow())
+
+    # Una escritura desordenada por colección: un documento fallido no detiene al resto
+    for dominio, items in por_dominio.items():
+        collection = preparar_dominio(current_app.mongo.db, dominio)
+        try:
+            collection.insert_many([doc for _, doc in items], ordered=False)
+            error = None
+        except PyMongoError as e:
+            error = e
+        aceptados = rechazar_escritura(resultados, items, error)
+        actualizar_ultimo_estado(current_app.mongo.db, [(dominio, doc) for doc in aceptados])
+        # Un spool reenviado trae lecturas de horas atrás: los rollups las recalculan en la próxima pasada
+        marcar_atrasadas(current_app.mongo.db, dominio, aceptados)
+
+    respuesta, estado = respuesta_lote(resultados)
+    return jsonify(respuesta), estado
+
+def _generar_ndjson(cursor):
+    for doc in cursor:
+        yield linea_ndjson(doc)
+
+def _generar_csv(cursor):
+    yield bloque_csv([], encabezado=True)
+    while True:
+        docs = list(islice(cursor, TAMANO_LOTE_CURSOR))
+        if not docs:
+            break
+        yield bloque_csv(docs)
+
 @main.route('/api/datos', methods=['GET'])
 def obtener_datos():
-    dominio = request.args.get('dominio')
-    id_dispositivo = request.args.get('id_dispositivo')
-    if not dominio:
-        return jsonify({'error': 'Falta parámetro dominio'}), 400
-
-    limit = request.args.get('limit', default=200, type=int)
-    if limit <= 0:
-        return jsonify({'error': 'El parámetro limit debe ser mayor que 0'}), 400
+    try:
+        params = parametros_datos(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
 
-    colecciones = current_app.mongo.db.list_collection_names()
-    if dominio not in colecciones:
+    dominio = params['dominio']
+    if not registro_dominios.existe(current_app.mongo.db, dominio):
         return jsonify({'error': f'No existe la colección {dominio}'}), 404
 
     collection = current_app.mongo.db[dominio]
-
-    # Se crea el filtro
-    filtro = {}
-    if id_dispositivo:
-        filtro['id_dispositivo'] = id_dispositivo
+    filtro, orden = consulta_datos(params)
 
     # Consulta filtrada
-    cursor = collection.find(filtro).sort("tiempo", -1).limit(limit)
+    cursor = collection.find(filtro, PROYECCION_LECTURAS).sort(orden).batch_size(TAMANO_LOTE_CURSOR)
+    limit = params['limit']
+    if limit:
+        cursor = cursor.limit(limit)
+
+    # Intercalada con las lecturas archivadas (app.archivo) del mismo rango
+    cursor = con_archivo(
+        collection, dominio, cursor, params['dispositivos'], params['desde'], params['hasta'],
+        params['cursor'], params['direccion']
+    )
+    if limit:
+        cursor = islice(cursor, limit)
+
+    # Streaming: los documentos salen del cursor de pymongo a medida que llegan, con memoria constante
+    formato = params['formato']
+    if formato == 'ndjson':
+        return Response(stream_with_context(_generar_ndjson(cursor)), mimetype='application/x-ndjson')
+    if formato == 'csv':
+        return Response(
+            stream_with_context(_generar_csv(cursor)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={dominio}.csv'}
+        )
 
     datos = []
+    ultimo = None
     for doc in cursor:
-        tiempo = doc.get("tiempo")
-        if isinstance(tiempo, datetime):
-            tiempo_str = tiempo.isoformat() + "Z"
-        else:
-            tiempo_str = str(tiempo)
-
-        datos.append({
-            'tiempo': tiempo_str,
-            'id_dispositivo': doc.get('id_dispositivo'),
-            'temperatura': doc.get('temperatura'),
-            'ph': doc.get('ph'),
-            'oxigeno': doc.get('oxigeno'),
-            'turbidez': doc.get('turbidez'),
-            'conductividad': doc.get('conductividad')
-        })
-
-    return jsonify(list(reversed(datos)))
+        datos.append(dato_publico(doc))
+        ultimo = doc
+
+    # Página completa: el cursor de la siguiente página va en un encabezado para no cambiar el cuerpo
+    if params['direccion'] < 0:
+        datos.reverse()
+    respuesta = jsonify(datos)
+    siguiente = codificar_cursor(ultimo) if ultimo is not None and len(datos) == limit else None
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente
+    return respuesta
+
+def _generar_parquet(cursor):
+    escritor = EscritorParquet()
+    while True:
+        docs = list(islice(cursor, FILAS_POR_GRUPO))
+        if not docs:
+            break
+        yield escritor.agregar(docs)
+    yield escritor.cerrar()
+
+@main.route('/api/exportar', methods=['GET'])
+def exportar():
+    # Historial completo filtrado por dominio, dispositivos, rango de tiempo y manual,
+    # en CSV o Parquet, transmitido mientras se lee el cursor
+    try:
+        params = parametros_exportar(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    dominio = params['dominio']
+    if not registro_dominios.existe(current_app.mongo.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    collection = current_app.mongo.db[dominio]
+    cursor = collection.find(filtro_exportar(params), PROYECCION_LECTURAS).sort(orden_keyset(1)).batch_size(TAMANO_LOTE_CURSOR)
+    # Las lecturas archivadas (más antiguas) salen primero, en el mismo orden
+    cursor = con_archivo(
+        collection, dominio, cursor, params['dispositivos'], params['desde'], params['hasta'], manual=manual_exportar(params)
+    )
+    generador = _generar_parquet(cursor) if params['formato'] == 'parquet' else _generar_csv(cursor)
+    return Response(
+        stream_with_context(generador),
+        mimetype=FORMATOS[params['formato']],
+        headers={'Content-Disposition': f'attachment; filename={nombre_archivo(params)}'}
+    )
+
+@main.route('/api/agregados', methods=['GET'])
+def obtener_agregados():
+    try:
+        params = parametros_agregados(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    dominio = params['dominio']
+    if not registro_dominios.existe(current_app.mongo.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    collection = current_app.mongo.db[dominio]
+    dispositivos, intervalo, variables = params['dispositivos'], params['intervalo'], params['variables']
+    desde, hasta = params['desde'], params['hasta']
+
+    # Modo LTTB: como mucho max_puntos por dispositivo y variable (por defecto, últimos 30 días)
+    if params['max_puntos']:
+        desde, hasta = rango_lttb(desde, hasta)
+        filtro = construir_filtro(dispositivos, desde, hasta)
+        proyeccion = {'tiempo': 1, 'id_dispositivo': 1, **proyeccion_variables(variables)}
+        cursor = collection.find(filtro, proyeccion).sort(orden_keyset(1)).batch_size(5000)
+        cursor = con_archivo(collection, dominio, cursor, dispositivos, desde, hasta)
+        return jsonify(series_publicas(series_lttb(cursor, params['max_puntos'], variables)))
+
+    # Buckets por hora o día: se leen de los rollups (solo lecturas de sensor) si el worker
+    # ya procesó el dominio, y los posteriores a su última pasada se calculan sobre las lecturas;
+    # fuente=crudo fuerza la agregación sobre las lecturas
+    granularidad = {v: k for k, v in GRANULARIDADES.items()}.get(intervalo)
+    estado = estado_rollup(current_app.mongo.db, dominio, granularidad) if granularidad and not params['crudo'] else None
+    if estado:
+        cursor = agregados_rollup(current_app.mongo.db, dominio, granularidad, estado, dispositivos, desde, hasta, variables)
+    else:
+        filtro = construir_filtro(dispositivos, desde, hasta)
+        cursor = collection.aggregate(pipeline_agregados(filtro, intervalo, variables), allowDiskUse=True)
+        cursor = agregados_con_archivo(collection, dominio, cursor, intervalo, dispositivos, desde, hasta, variables, agregar=analitica.agregados_archivo)
+
+    return jsonify([bucket_publico(doc) for doc in cursor])
+
+@main.route('/api/ultimo_estado', methods=['GET'])
+def obtener_ultimo_estado():
+    # Última lectura de sensor de cada dispositivo del dominio, sin recorrer el historial
+    dominio = request.args.get('dominio')
+    if not dominio:
+        return jsonify({'error': 'Falta parámetro dominio'}), 400
+    if not registro_dominios.existe(current_app.mongo.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    db = current_app.mongo.db
+    dispositivos = lista_param(request.args, 'id_dispositivo')
+    estados = leer_ultimo_estado(db, dominio, dispositivos)
+    if request.args.get('reconstruir') == '1' or (not estados and sin_estado(db, dominio)):
+        # Dominio con lecturas anteriores a ultimo_estado (o reconstrucción pedida)
+        reconstruir_ultimo_estado(db, dominio)
+        estados = leer_ultimo_estado(db, dominio, dispositivos)
+
+    for estado in estados:
+        estado['tiempo'] = tiempo_iso(estado.get('tiempo'))
+    return jsonify(estados)
 
 @main.route('/api/registro_comida', methods=['POST'])
 def registrar_comida():
-    data = request.get_json()
-    if not data or data.get("evento") != "comida":
+    data = documento_comida(request.get_json(), datetime.utcnow())
+    if data is None:
         return jsonify({'error': 'JSON inválido o evento incorrecto'}), 400
 
-    data['tiempo'] = datetime.utcnow()
-    data['id_dispositivo'] = data.get("id_dispositivo", "desconocido")
+    if current_app.cola_ingesta.activa:
+        return _encolar('registro_comida', data, 'Registro de comida guardado correctamente')
 
     collection = current_app.mongo.db.registro_comida
     collection.insert_one(data)
@@ -85,46 +280,49 @@ def registrar_comida():
 
 @main.route('/api/registro_comida', methods=['GET'])
 def obtener_registros_comida():
+    # Historial filtrado por dispositivo y fechas, por páginas: sin parámetros entrega los
+    # últimos 200 eventos y X-Siguiente-Cursor apunta a la página anterior
+    try:
+        params = parametros_comida(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    filtro, orden = consulta_comida(params['dispositivos'], params['desde'], params['hasta'], params['cursor'], params['direccion'])
     collection = current_app.mongo.db.registro_comida
-    cursor = collection.find().sort("tiempo", -1).limit(200)
-    registros = []
-    for doc in cursor:
-        tiempo = doc.get("tiempo")
-        if isinstance(tiempo, datetime):
-            tiempo_str = tiempo.isoformat() + "Z"
-        else:
-            tiempo_str = str(tiempo)
-
-        registros.append({
-            'tiempo': tiempo_str,
-            'evento': doc.get('evento'),
-            'id_dispositivo': doc.get('id_dispositivo', 'desconocido')
-        })
-    return jsonify(list(reversed(registros)))
+    docs = list(collection.find(filtro).sort(orden).limit(params['limit']))
+    registros = [comida_publica(doc) for doc in docs]
+
+    if params['direccion'] < 0:
+        registros.reverse()
+    respuesta = jsonify(registros)
+    siguiente = codificar_cursor(docs[-1]) if len(docs) == params['limit'] else None
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente
+    return respuesta
+
+@main.route('/api/registro_comida/ultima', methods=['GET'])
+def obtener_ultima_comida():
+    # Última alimentación de cada dispositivo, calculada en MongoDB
+    dispositivos = lista_param(request.args, 'id_dispositivo')
+    collection = current_app.mongo.db.registro_comida
+    return jsonify([
+        {'id_dispositivo': doc['_id'], 'tiempo': tiempo_iso(doc.get('tiempo'))}
+        for doc in collection.aggregate(pipeline_ultima_comida(dispositivos))
+    ])
 
 @main.route('/api/registro_manual', methods=['POST'])
 def registrar_manual():
-    data = request.get_json()
-    if not data or 'dominio' not in data or 'id_dispositivo' not in data:
+    try:
+        documento = documento_manual(request.get_json(), datetime.utcnow())
+    except LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    if documento is None:
         return jsonify({'error': 'Faltan campos obligatorios'}), 400
 
-    dominio = data.pop('dominio')
-    id_disp = data.pop('id_dispositivo')
-
-    doc = {
-        "id_dispositivo": id_disp,
-    }
-
-    # Agregar los campos en el orden deseado si están presentes
-    for campo in ["turbidez", "ph", "temperatura", "oxigeno", "conductividad"]:
-        if campo in data and data[campo] not in ("", None):
-            doc[campo] = data[campo]
-
-    doc["tiempo"] = datetime.utcnow()
-    doc["manual"] = True  # Campo adicional al final
-
-    collection = current_app.mongo.db[dominio]
+    dominio, doc = documento
+    collection = preparar_dominio(current_app.mongo.db, dominio)
     collection.insert_one(doc)
+    marcar_atrasadas(current_app.mongo.db, dominio, [doc])
 
     return jsonify({'message': f'Registro manual guardado en dominio {dominio}'}), 201
 
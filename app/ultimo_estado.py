@@ -0,0 +1,101 @@
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from .agregaciones import VARIABLES
+from .archivo import ultimas_archivadas
+from .esquema import expresion_campo, valor_variable
+
+# Última lectura de sensor de cada dispositivo, un documento por (dominio, id_dispositivo),
+# actualizada en cada ingesta: la vista de métricas la lee con una consulta pequeña sin
+# importar el tamaño del historial. Los registros manuales no cuentan
+COLECCION_ULTIMO_ESTADO = "ultimo_estado"
+
+def asegurar_indice_ultimo_estado(db):
+    try:
+        db[COLECCION_ULTIMO_ESTADO].create_index(
+            [("dominio", ASCENDING), ("id_dispositivo", ASCENDING)], unique=True, name="dominio_id_dispositivo"
+        )
+    except PyMongoError as e:
+        print(f"⚠️ No se pudo crear el índice de {COLECCION_ULTIMO_ESTADO}: {e}")
+
+def operaciones_ultimo_estado(lecturas):
+    # lecturas: [(dominio, documento guardado)]. Solo se reemplaza el estado si la lectura es
+    # más reciente; si ya hay una más nueva el filtro no coincide, el upsert choca con el
+    # índice único (11000) y el estado queda como estaba
+    ultimas = {}
+    for dominio, doc in lecturas:
+        if doc.get("manual") or doc.get("tiempo") is None:
+            continue
+        clave = (dominio, doc.get("id_dispositivo"))
+        if clave not in ultimas or doc["tiempo"] > ultimas[clave]["tiempo"]:
+            ultimas[clave] = doc
+
+    operaciones = []
+    for (dominio, id_dispositivo), doc in ultimas.items():
+        estado = {"tiempo": doc["tiempo"]}
+        for var in VARIABLES:
+            estado[var] = valor_variable(doc, var)
+        operaciones.append(UpdateOne(
+            {"dominio": dominio, "id_dispositivo": id_dispositivo, "tiempo": {"$lt": doc["tiempo"]}},
+            {"$set": estado},
+            upsert=True
+        ))
+    return operaciones
+
+def errores_relevantes(error):
+    # Errores de un bulk_write de operaciones_ultimo_estado, sin contar las lecturas antiguas
+    if isinstance(error, DuplicateKeyError):
+        return []
+    if isinstance(error, BulkWriteError):
+        return [e for e in error.details.get("writeErrors", []) if e.get("code") != 11000]
+    return [error]
+
+def actualizar_ultimo_estado(db, lecturas):
+    # Nunca interrumpe la ingesta: la lectura ya quedó guardada y el estado se puede reconstruir
+    operaciones = operaciones_ultimo_estado(lecturas)
+    if not operaciones:
+        return
+    try:
+        db[COLECCION_ULTIMO_ESTADO].bulk_write(operaciones, ordered=False)
+    except PyMongoError as e:
+        if errores_relevantes(e):
+            print(f"⚠️ No se pudo actualizar {COLECCION_ULTIMO_ESTADO}: {e}")
+
+def pipeline_ultimo_estado(dominio):
+    # Recalcula el estado desde las lecturas, usando el índice id_dispositivo_tiempo_id
+    proyeccion = {var: expresion_campo(var) for var in VARIABLES}
+    return [
+        {"$match": {"manual": {"$ne": True}}},
+        {"$sort": {"id_dispositivo": 1, "tiempo": -1, "_id": -1}},
+        {"$group": {"_id": "$id_dispositivo", "doc": {"$first": {"tiempo": "$tiempo", **proyeccion}}}},
+        {"$project": {
+            "_id": 0,
+            "dominio": {"$literal": dominio},
+            "id_dispositivo": "$_id",
+            "tiempo": "$doc.tiempo",
+            **{var: f"$doc.{var}" for var in VARIABLES}
+        }},
+        {"$merge": {
+            "into": COLECCION_ULTIMO_ESTADO,
+            "on": ["dominio", "id_dispositivo"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }},
+    ]
+
+def reconstruir_ultimo_estado(db, dominio):
+    asegurar_indice_ultimo_estado(db)
+    db[dominio].aggregate(pipeline_ultimo_estado(dominio), allowDiskUse=True)
+    # Dispositivos cuyas lecturas ya están todas en el archivo; si MongoDB tiene una más
+    # reciente, el filtro $lt deja el estado como está
+    actualizar_ultimo_estado(db, [(dominio, doc) for doc in ultimas_archivadas(dominio)])
+
+def sin_estado(db, dominio):
+    # Solo un dominio sin ningún estado (lecturas anteriores a ultimo_estado) justifica la
+    # reconstrucción: un filtro sin resultados (dispositivo solo manual o inexistente) no
+    return db[COLECCION_ULTIMO_ESTADO].count_documents({"dominio": dominio}, limit=1) == 0
+
+def leer_ultimo_estado(db, dominio, dispositivos=None):
+    filtro = {"dominio": dominio}
+    if dispositivos:
+        filtro["id_dispositivo"] = {"$in": list(dispositivos)}
+    return list(db[COLECCION_ULTIMO_ESTADO].find(filtro, {"_id": 0, "dominio": 0}).sort("id_dispositivo", 1))
@@ -0,0 +1,33 @@
+from quart import Quart
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from app.conexiones import MonitorPool, opciones_pool
+
+# Variante ASGI de la API (Quart + Motor): mismas rutas y respuestas que app/, pero cada
+# petición en curso espera a MongoDB sin ocupar un hilo. Se sirve con hypercorn:
+#     hypercorn asgi:app --bind 0.0.0.0:$PORT --workers 2
+monitor_pool = MonitorPool()
+
+def create_app():
+    app = Quart(__name__)
+    # Obtener URI de Mongo desde variable de entorno
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        raise RuntimeError("⚠️ No se encontró la variable de entorno MONGO_URI")
+
+    from .routes import main
+    app.register_blueprint(main)
+
+    app.monitor_pool = monitor_pool
+
+    # El cliente de Motor se crea dentro del event loop del servidor (uno por proceso)
+    @app.before_serving
+    async def conectar():
+        app.cliente = AsyncIOMotorClient(mongo_uri, event_listeners=[monitor_pool], **opciones_pool())
+        app.db = app.cliente["biorreactor_app"]
+
+    @app.after_serving
+    async def desconectar():
+        app.cliente.close()
+
+    return app
@@ -0,0 +1,449 @@
+from quart import Blueprint, Response, abort, request, jsonify, current_app
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, PyMongoError
+from collections import deque
+from datetime import datetime
+import asyncio
+from app.colecciones import (
+    INDICES_DOMINIO, MODO_ALMACENAMIENTO, OPCIONES_TIMESERIES, dominio_preparado, marcar_preparado,
+    registro_dominios
+)
+from app import analitica
+from app.agregaciones import VARIABLES, construir_filtro, pipeline_agregados, rango_lttb, series_lttb
+from app.archivo import bloques_archivo, combinar_agregados, filtro_frontera, hasta_archivo, particiones, ultimas_archivadas
+from app.comida import consulta_comida, parametros_comida, pipeline_ultima_comida
+from app.esquema import LecturaInvalida, proyeccion_variables
+from app.exportar import (
+    FILAS_POR_GRUPO, FORMATOS, EscritorParquet, filtro_exportar, manual_exportar, nombre_archivo, parametros_exportar
+)
+from app.lecturas import (
+    MIMETYPES_NDJSON, PROYECCION_LECTURAS, TAMANO_LOTE_CURSOR, ParametroInvalido, bloque_csv, bucket_publico,
+    comida_publica, consulta_datos, dato_publico, documento_comida, documento_manual, documento_sensor, error_lote,
+    lecturas_json, lecturas_ndjson, linea_ndjson, lista_param, parametros_agregados, parametros_datos, preparar_lote,
+    rechazar_escritura, respuesta_lote, series_publicas, tiempo_iso
+)
+from app.paginacion import clave_keyset, codificar_cursor, orden_keyset
+from app.rollups import (
+    COLECCION_ESTADO, GRANULARIDADES, estado_rollup, filtro_recientes, frontera_rollup, leer_rollup, marca_atrasadas,
+    ordenar_buckets
+)
+from app.ultimo_estado import (
+    COLECCION_ULTIMO_ESTADO, errores_relevantes, operaciones_ultimo_estado, pipeline_ultimo_estado
+)
+
+main = Blueprint('main', __name__)
+
+# --- COLECCIONES ---
+async def preparar_dominio(db, nombre):
+    # Igual que app.colecciones.preparar_dominio, con Motor (create_index es idempotente,
+    # así que dos peticiones simultáneas sobre un dominio nuevo no causan problemas)
+    if not dominio_preparado(nombre):
+        if MODO_ALMACENAMIENTO == "timeseries":
+            try:
+                await db.create_collection(nombre, timeseries=OPCIONES_TIMESERIES)
+            except CollectionInvalid:
+                pass
+        for claves, opciones in INDICES_DOMINIO:
+            try:
+                await db[nombre].create_index(claves, **opciones)
+            except PyMongoError as e:
+                print(f"⚠️ No se pudo crear el índice {opciones['name']} en {nombre}: {e}")
+        marcar_preparado(nombre)
+    return db[nombre]
+
+async def dominio_existe(db, nombre):
+    respuesta = registro_dominios.consultar(nombre)
+    if respuesta is None:
+        return nombre in registro_dominios.actualizar(await db.list_collection_names())
+    return respuesta
+
+async def actualizar_ultimo_estado(db, lecturas):
+    # Igual que app.ultimo_estado.actualizar_ultimo_estado, con Motor
+    operaciones = operaciones_ultimo_estado(lecturas)
+    if not operaciones:
+        return
+    try:
+        await db[COLECCION_ULTIMO_ESTADO].bulk_write(operaciones, ordered=False)
+    except PyMongoError as e:
+        if errores_relevantes(e):
+            print(f"⚠️ No se pudo actualizar {COLECCION_ULTIMO_ESTADO}: {e}")
+
+async def reconstruir_ultimo_estado(db, dominio):
+    # Igual que app.ultimo_estado.reconstruir_ultimo_estado, con Motor; el $merge solo se
+    # ejecuta al recorrer el cursor
+    try:
+        await db[COLECCION_ULTIMO_ESTADO].create_index(
+            [("dominio", ASCENDING), ("id_dispositivo", ASCENDING)], unique=True, name="dominio_id_dispositivo"
+        )
+    except PyMongoError as e:
+        print(f"⚠️ No se pudo crear el índice de {COLECCION_ULTIMO_ESTADO}: {e}")
+    await db[dominio].aggregate(pipeline_ultimo_estado(dominio), allowDiskUse=True).to_list(None)
+    archivadas = await asyncio.to_thread(ultimas_archivadas, dominio)
+    await actualizar_ultimo_estado(db, [(dominio, doc) for doc in archivadas])
+
+async def sin_estado(db, dominio):
+    # Igual que app.ultimo_estado.sin_estado, con Motor
+    return await db[COLECCION_ULTIMO_ESTADO].count_documents({"dominio": dominio}, limit=1) == 0
+
+async def leer_ultimo_estado(db, dominio, dispositivos=None):
+    # Igual que app.ultimo_estado.leer_ultimo_estado, con Motor
+    filtro = {"dominio": dominio}
+    if dispositivos:
+        filtro["id_dispositivo"] = {"$in": list(dispositivos)}
+    return await db[COLECCION_ULTIMO_ESTADO].find(filtro, {"_id": 0, "dominio": 0}).sort("id_dispositivo", 1).to_list(None)
+
+async def marcar_atrasadas(db, dominio, docs):
+    # Igual que app.rollups.marcar_atrasadas, con Motor
+    marca = marca_atrasadas(dominio, docs)
+    if not marca:
+        return
+    try:
+        await db[COLECCION_ESTADO].update_many(*marca)
+    except PyMongoError as e:
+        print(f"⚠️ No se pudo marcar lecturas atrasadas de {dominio} en {COLECCION_ESTADO}: {e}")
+
+# --- ROLLUPS ---
+async def agregados_rollup(db, dominio, granularidad, estado, dispositivos=None, desde=None, hasta=None, variables=VARIABLES):
+    # Igual que app.rollups.agregados_rollup, con Motor
+    frontera = frontera_rollup(estado, granularidad)
+    hasta_rollup = min(hasta, frontera) if hasta else frontera
+    cursor = leer_rollup(db, dominio, granularidad, dispositivos, desde, hasta_rollup, manual=False, variables=variables)
+    docs = [doc async for doc in cursor]
+    for doc in docs:
+        doc.pop("manual", None)
+    filtro = filtro_recientes(frontera, dispositivos, desde, hasta)
+    if filtro is not None:
+        cursor = db[dominio].aggregate(pipeline_agregados(filtro, GRANULARIDADES[granularidad], variables), allowDiskUse=True)
+        docs += [doc async for doc in cursor]
+    return ordenar_buckets(docs)
+
+# --- ARCHIVO ---
+async def con_archivo(collection, dominio, cursor, dispositivos=None, desde=None, hasta=None, cursor_keyset=None, direccion=1, manual=None, limit=None):
+    # Igual que app.archivo.con_archivo, con el cursor de Motor; los bloques del archivo se leen
+    # en un hilo para no detener el event loop
+    if manual or not particiones(dominio, dispositivos, desde, hasta):
+        lecturas = cursor
+    else:
+        limite = await frontera(collection, construir_filtro(dispositivos, desde, hasta))
+        bloques = bloques_archivo(dominio, dispositivos, desde, hasta_archivo(hasta, limite), cursor_keyset, direccion, manual)
+        lecturas = _intercalar(cursor, bloques, direccion)
+
+    entregados = 0
+    async for doc in lecturas:
+        yield doc
+        entregados += 1
+        if limit and entregados == limit:
+            break
+
+async def frontera(collection, filtro):
+    # Igual que app.archivo.frontera, con Motor
+    doc = await collection.find_one(filtro_frontera(filtro), {"tiempo": 1}, sort=[("tiempo", 1)])
+    return doc["tiempo"] if doc else None
+
+async def agregados_con_archivo(collection, dominio, docs, intervalo, dispositivos=None, desde=None, hasta=None, variables=VARIABLES):
+    # Igual que app.archivo.agregados_con_archivo, con el archivo leído en un hilo
+    if not particiones(dominio, dispositivos, desde, hasta):
+        return docs
+    limite = await frontera(collection, construir_filtro(dispositivos, desde, hasta))
+    archivados = await asyncio.to_thread(
+        analitica.agregados_archivo, dominio, intervalo, dispositivos, desde, hasta_archivo(hasta, limite), variables
+    )
+    return combinar_agregados(docs, archivados, variables)
+
+async def _intercalar(cursor, bloques, direccion):
+    archivadas = deque()
+
+    async def reponer():
+        while not archivadas:
+            bloque = await asyncio.to_thread(next, bloques, None)
+            if bloque is None:
+                return False
+            archivadas.extend(bloque)
+        return True
+
+    def antes(a, b):
+        return clave_keyset(a) > clave_keyset(b) if direccion < 0 else clave_keyset(a) < clave_keyset(b)
+
+    hay = await reponer()
+    async for doc in cursor:
+        while hay and antes(archivadas[0], doc):
+            yield archivadas.popleft()
+            hay = await reponer()
+        yield doc
+    while hay:
+        yield archivadas.popleft()
+        hay = await reponer()
+
+async def _leer_json():
+    # Igual que request.get_json() de Flask: 415 si el cuerpo no es JSON
+    if not request.is_json:
+        abort(415)
+    return await request.get_json()
+
+# --- RUTAS ---
+@main.route('/')
+async def index():
+    return jsonify({"message": "API del biorreactor funcionando"})
+
+@main.route('/api/diagnostico', methods=['GET'])
+async def diagnostico():
+    return jsonify({
+        'conexiones': current_app.monitor_pool.resumen(),
+        'dominios': registro_dominios.resumen()
+    })
+
+@main.route('/api/sensores', methods=['POST'])
+async def recibir_datos():
+    try:
+        documento = documento_sensor(await _leer_json(), datetime.utcnow())
+    except LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    if documento is None:
+        return jsonify({'error': 'Falta campo dominio'}), 400
+
+    dominio, data = documento
+    collection = await preparar_dominio(current_app.db, dominio)
+    await collection.insert_one(data)
+    await actualizar_ultimo_estado(current_app.db, [(dominio, data)])
+    await marcar_atrasadas(current_app.db, dominio, [data])
+
+    return jsonify({'message': f'Datos guardados en dominio {dominio}'}), 201
+
+async def _leer_lote():
+    # Igual que en app.routes: arreglo JSON, {"lecturas": [...]} o NDJSON
+    if request.mimetype in MIMETYPES_NDJSON:
+        return lecturas_ndjson(await request.get_data(as_text=True))
+    return lecturas_json(await request.get_json(silent=True))
+
+@main.route('/api/sensores/batch', methods=['POST'])
+async def recibir_datos_lote():
+    lecturas = await _leer_lote()
+    error = error_lote(lecturas)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    resultados, por_dominio = preparar_lote(lecturas, datetime.utcnow())
+
+    # Una escritura desordenada por colección: un documento fallido no detiene al resto
+    for dominio, items in por_dominio.items():
+        collection = await preparar_dominio(current_app.db, dominio)
+        try:
+            await collection.insert_many([doc for _, doc in items], ordered=False)
+            error = None
+        except PyMongoError as e:
+            error = e
+        aceptados = rechazar_escritura(resultados, items, error)
+        await actualizar_ultimo_estado(current_app.db, [(dominio, doc) for doc in aceptados])
+        await marcar_atrasadas(current_app.db, dominio, aceptados)
+
+    respuesta, estado = respuesta_lote(resultados)
+    return jsonify(respuesta), estado
+
+async def _generar_ndjson(cursor):
+    async for doc in cursor:
+        yield linea_ndjson(doc)
+
+async def _generar_csv(cursor):
+    yield bloque_csv([], encabezado=True)
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) == TAMANO_LOTE_CURSOR:
+            yield bloque_csv(docs)
+            docs = []
+    if docs:
+        yield bloque_csv(docs)
+
+@main.route('/api/datos', methods=['GET'])
+async def obtener_datos():
+    try:
+        params = parametros_datos(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    dominio = params['dominio']
+    if not await dominio_existe(current_app.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    filtro, orden = consulta_datos(params)
+    collection = current_app.db[dominio]
+    cursor = collection.find(filtro, PROYECCION_LECTURAS).sort(orden).batch_size(TAMANO_LOTE_CURSOR)
+    limit = params['limit']
+    if limit:
+        cursor = cursor.limit(limit)
+    cursor = con_archivo(
+        collection, dominio, cursor, params['dispositivos'], params['desde'], params['hasta'],
+        params['cursor'], params['direccion'], limit=limit
+    )
+
+    formato = params['formato']
+    if formato == 'ndjson':
+        return Response(_generar_ndjson(cursor), mimetype='application/x-ndjson')
+    if formato == 'csv':
+        return Response(
+            _generar_csv(cursor),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={dominio}.csv'}
+        )
+
+    datos = []
+    ultimo = None
+    async for doc in cursor:
+        datos.append(dato_publico(doc))
+        ultimo = doc
+
+    if params['direccion'] < 0:
+        datos.reverse()
+    respuesta = jsonify(datos)
+    siguiente = codificar_cursor(ultimo) if ultimo is not None and len(datos) == limit else None
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente
+    return respuesta
+
+async def _generar_parquet(cursor):
+    escritor = EscritorParquet()
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) == FILAS_POR_GRUPO:
+            yield escritor.agregar(docs)
+            docs = []
+    if docs:
+        yield escritor.agregar(docs)
+    yield escritor.cerrar()
+
+@main.route('/api/exportar', methods=['GET'])
+async def exportar():
+    try:
+        params = parametros_exportar(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    dominio = params['dominio']
+    if not await dominio_existe(current_app.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    collection = current_app.db[dominio]
+    cursor = collection.find(filtro_exportar(params), PROYECCION_LECTURAS).sort(orden_keyset(1)).batch_size(TAMANO_LOTE_CURSOR)
+    cursor = con_archivo(
+        collection, dominio, cursor, params['dispositivos'], params['desde'], params['hasta'], manual=manual_exportar(params)
+    )
+    generador = _generar_parquet(cursor) if params['formato'] == 'parquet' else _generar_csv(cursor)
+    return Response(
+        generador,
+        mimetype=FORMATOS[params['formato']],
+        headers={'Content-Disposition': f'attachment; filename={nombre_archivo(params)}'}
+    )
+
+@main.route('/api/agregados', methods=['GET'])
+async def obtener_agregados():
+    try:
+        params = parametros_agregados(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    dominio = params['dominio']
+    if not await dominio_existe(current_app.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    collection = current_app.db[dominio]
+    dispositivos, intervalo, variables = params['dispositivos'], params['intervalo'], params['variables']
+    desde, hasta = params['desde'], params['hasta']
+
+    # Modo LTTB: LTTB necesita la serie completa, así que se junta y se reduce en un hilo
+    if params['max_puntos']:
+        desde, hasta = rango_lttb(desde, hasta)
+        filtro = construir_filtro(dispositivos, desde, hasta)
+        proyeccion = {'tiempo': 1, 'id_dispositivo': 1, **proyeccion_variables(variables)}
+        cursor = collection.find(filtro, proyeccion).sort(orden_keyset(1)).batch_size(5000)
+        docs = [doc async for doc in con_archivo(collection, dominio, cursor, dispositivos, desde, hasta)]
+        series = await asyncio.to_thread(series_lttb, docs, params['max_puntos'], variables)
+        return jsonify(series_publicas(series))
+
+    # Buckets por hora o día desde los rollups, como en app.routes
+    granularidad = {v: k for k, v in GRANULARIDADES.items()}.get(intervalo)
+    estado = await estado_rollup(current_app.db, dominio, granularidad) if granularidad and not params['crudo'] else None
+    if estado:
+        docs = await agregados_rollup(current_app.db, dominio, granularidad, estado, dispositivos, desde, hasta, variables)
+    else:
+        filtro = construir_filtro(dispositivos, desde, hasta)
+        docs = [doc async for doc in collection.aggregate(pipeline_agregados(filtro, intervalo, variables), allowDiskUse=True)]
+        docs = await agregados_con_archivo(collection, dominio, docs, intervalo, dispositivos, desde, hasta, variables)
+
+    return jsonify([bucket_publico(doc) for doc in docs])
+
+@main.route('/api/ultimo_estado', methods=['GET'])
+async def obtener_ultimo_estado():
+    # Última lectura de sensor de cada dispositivo del dominio, sin recorrer el historial
+    dominio = request.args.get('dominio')
+    if not dominio:
+        return jsonify({'error': 'Falta parámetro dominio'}), 400
+    if not await dominio_existe(current_app.db, dominio):
+        return jsonify({'error': f'No existe la colección {dominio}'}), 404
+
+    db = current_app.db
+    dispositivos = lista_param(request.args, 'id_dispositivo')
+    estados = await leer_ultimo_estado(db, dominio, dispositivos)
+    if request.args.get('reconstruir') == '1' or (not estados and await sin_estado(db, dominio)):
+        # Dominio con lecturas anteriores a ultimo_estado (o reconstrucción pedida)
+        await reconstruir_ultimo_estado(db, dominio)
+        estados = await leer_ultimo_estado(db, dominio, dispositivos)
+
+    for estado in estados:
+        estado['tiempo'] = tiempo_iso(estado.get('tiempo'))
+    return jsonify(estados)
+
+@main.route('/api/registro_comida', methods=['POST'])
+async def registrar_comida():
+    data = documento_comida(await _leer_json(), datetime.utcnow())
+    if data is None:
+        return jsonify({'error': 'JSON inválido o evento incorrecto'}), 400
+
+    await current_app.db.registro_comida.insert_one(data)
+
+    return jsonify({'message': 'Registro de comida guardado correctamente'}), 201
+
+@main.route('/api/registro_comida', methods=['GET'])
+async def obtener_registros_comida():
+    try:
+        params = parametros_comida(request.args)
+    except ParametroInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    filtro, orden = consulta_comida(params['dispositivos'], params['desde'], params['hasta'], params['cursor'], params['direccion'])
+    cursor = current_app.db.registro_comida.find(filtro).sort(orden).limit(params['limit'])
+    docs = [doc async for doc in cursor]
+    registros = [comida_publica(doc) for doc in docs]
+
+    if params['direccion'] < 0:
+        registros.reverse()
+    respuesta = jsonify(registros)
+    siguiente = codificar_cursor(docs[-1]) if len(docs) == params['limit'] else None
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente
+    return respuesta
+
+@main.route('/api/registro_comida/ultima', methods=['GET'])
+async def obtener_ultima_comida():
+    dispositivos = lista_param(request.args, 'id_dispositivo')
+    cursor = current_app.db.registro_comida.aggregate(pipeline_ultima_comida(dispositivos))
+    return jsonify([
+        {'id_dispositivo': doc['_id'], 'tiempo': tiempo_iso(doc.get('tiempo'))}
+        async for doc in cursor
+    ])
+
+@main.route('/api/registro_manual', methods=['POST'])
+async def registrar_manual():
+    try:
+        documento = documento_manual(await _leer_json(), datetime.utcnow())
+    except LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    if documento is None:
+        return jsonify({'error': 'Faltan campos obligatorios'}), 400
+
+    dominio, doc = documento
+    collection = await preparar_dominio(current_app.db, dominio)
+    await collection.insert_one(doc)
+    await marcar_atrasadas(current_app.db, dominio, [doc])
+
+    return jsonify({'message': f'Registro manual guardado en dominio {dominio}'}), 201
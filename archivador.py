@@ -0,0 +1,105 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
+from pymongo.errors import PyMongoError
+from database import obtener_db
+from app.archivo import ARCHIVO_DIR, escribir_particion, mes_de
+from app.colecciones import PREFIJO_DOMINIO
+from app.rollups import COLECCION_ESTADO, GRANULARIDADES, MARGEN_HORAS, estado_rollup
+
+# Edad (días) a partir de la cual las lecturas pasan de MongoDB al archivo Parquet, lecturas
+# por lote y horas entre pasadas
+EDAD_DIAS = float(os.environ.get("ARCHIVO_EDAD_DIAS", 90))
+TAMANO_LOTE = int(os.environ.get("ARCHIVO_TAMANO_LOTE", 50000))
+INTERVALO_HORAS = float(os.environ.get("ARCHIVO_INTERVALO_HORAS", 24))
+
+def corte_archivo(db, dominio, edad_dias):
+    # Los rollups se recalculan desde su marca menos un margen: solo se archiva lo que ya
+    # quedó resumido y no se vuelve a recalcular, ni lecturas atrasadas que esperan su pasada
+    # (marca pendiente). Sin rollups todavía, el dominio se omite
+    corte = datetime.utcnow() - timedelta(days=edad_dias)
+    for granularidad in GRANULARIDADES:
+        estado = estado_rollup(db, dominio, granularidad)
+        if not estado:
+            return None
+        corte = min(corte, estado["hasta"] - timedelta(hours=MARGEN_HORAS, days=1))
+        if estado.get("pendiente"):
+            corte = min(corte, estado["pendiente"] - timedelta(days=1))
+    return corte
+
+def archivar_dominio(db, dominio, corte, simular=False, tamano_lote=TAMANO_LOTE):
+    # Por lotes en orden (tiempo, _id): cada lote se escribe por (dispositivo, mes) y recién
+    # entonces se borra de MongoDB por _id. Los registros manuales no se archivan: son pocos y
+    # el historial manual del dashboard los lee de MongoDB
+    collection = db[dominio]
+    total = 0
+    while True:
+        filtro = {"tiempo": {"$lt": corte}, "manual": {"$ne": True}}
+        docs = list(collection.find(filtro).sort([("tiempo", 1), ("_id", 1)]).limit(tamano_lote))
+        if not docs:
+            break
+
+        escritos = []
+        docs.sort(key=lambda d: (str(d.get("id_dispositivo")), mes_de(d["tiempo"]), d["tiempo"]))
+        for (id_dispositivo, mes), grupo in groupby(docs, key=lambda d: (str(d.get("id_dispositivo")), mes_de(d["tiempo"]))):
+            grupo = list(grupo)
+            if simular:
+                print(f"   {dominio} / {id_dispositivo} / {mes}: {len(grupo)} lecturas")
+                continue
+            ruta = escribir_particion(dominio, grupo[0].get("id_dispositivo"), mes, grupo)
+            if ruta:
+                escritos.append(ruta)
+
+        total += len(docs)
+        if simular:
+            break
+        try:
+            collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        except PyMongoError:
+            # Sin borrar (p. ej. colecciones time series que no admiten borrar por _id) el lote
+            # quedaría en los dos lados: se descartan sus archivos y el dominio queda sin archivar
+            for ruta in escritos:
+                os.remove(ruta)
+            raise
+    return total
+
+def archivar_todos(db, edad_dias=EDAD_DIAS, dominios=None, simular=False):
+    for dominio in sorted(dominios or db.list_collection_names()):
+        if not dominio.startswith(PREFIJO_DOMINIO):
+            continue
+        corte = corte_archivo(db, dominio, edad_dias)
+        if corte is None:
+            print(f"⚠️ {dominio}: sin rollups todavía (ejecuta worker_rollups.py), no se archiva")
+            continue
+        try:
+            inicio = time.monotonic()
+            if not simular:
+                # Antes de borrar: desde aquí el worker de rollups ya no recalcula estos buckets
+                db[COLECCION_ESTADO].update_many({"dominio": dominio}, {"$max": {"archivado": corte}})
+            total = archivar_dominio(db, dominio, corte, simular)
+            if total:
+                accion = "por archivar (simulación, primer lote)" if simular else "archivadas"
+                print(f"✅ {dominio}: {total} lecturas anteriores a {corte:%Y-%m-%d} {accion} en {time.monotonic() - inicio:.1f} s")
+        except Exception as e:
+            print(f"❌ Error al archivar {dominio}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Mueve las lecturas antiguas de cada dominio a Parquet en {ARCHIVO_DIR}/.")
+    parser.add_argument("--una-vez", action="store_true", help="Hacer una sola pasada y terminar")
+    parser.add_argument("--edad-dias", type=float, default=EDAD_DIAS, help="Archivar lecturas con más de estos días")
+    parser.add_argument("--dominio", action="append", help="Solo estos dominios (se puede repetir)")
+    parser.add_argument("--simular", action="store_true", help="Mostrar qué se archivaría, sin escribir ni borrar")
+    args = parser.parse_args()
+
+    db = obtener_db()
+    archivar_todos(db, args.edad_dias, args.dominio, args.simular)
+
+    while not (args.una_vez or args.simular):
+        time.sleep(INTERVALO_HORAS * 3600)
+        print(f"🔁 Pasada de archivo {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        archivar_todos(db, args.edad_dias, args.dominio)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+from app_asgi import create_app
+
+# Punto de entrada ASGI (Quart + Motor), alternativo a run.py / gunicorn:
+#     hypercorn asgi:app --bind 0.0.0.0:5000
+app = create_app()
@@ -0,0 +1,141 @@
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import requests
+from pymongo import MongoClient
+
+# Benchmark: API Flask (gunicorn, workers síncronos) vs variante ASGI (hypercorn + Motor).
+#
+# Levanta cada servidor contra el mismo mongod, lo carga con clientes concurrentes durante un
+# tiempo fijo y compara peticiones por segundo y latencias p50/p99 en dos escenarios:
+# inserción (POST /api/sensores) y lectura (GET /api/datos con limit=50).
+#
+# La base de datos "biorreactor_app" está fija en la app, así que use un mongod local de
+# pruebas; la colección dominio_bench se elimina al final:
+#     python benchmarks/bench_asgi.py --uri mongodb://localhost:27017 --duracion 20 --concurrencia 128
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOMINIO = "dominio_bench"
+
+def comando_servidor(tipo, puerto, workers, hilos):
+    if tipo == "flask":
+        return [sys.executable, "-m", "gunicorn", "app:create_app()", "-b", f"127.0.0.1:{puerto}",
+                "-w", str(workers), "--threads", str(hilos)]
+    return [sys.executable, "-m", "hypercorn", "asgi:app", "-b", f"127.0.0.1:{puerto}", "-w", str(workers)]
+
+def iniciar_servidor(tipo, puerto, uri, workers, hilos):
+    entorno = dict(os.environ, MONGO_URI=uri, MONGO_MAX_POOL_SIZE=str(max(50, hilos * 2)))
+    proceso = subprocess.Popen(comando_servidor(tipo, puerto, workers, hilos), cwd=RAIZ, env=entorno,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            if requests.get(base + "/", timeout=1).ok:
+                return proceso, base
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"El servidor {tipo} no respondió en 30 s")
+
+def peticion(sesion, base, escenario):
+    if escenario == "sensores":
+        return sesion.post(base + "/api/sensores", json={
+            "dominio": DOMINIO,
+            "id_dispositivo": f"reactor_{random.randrange(20):02d}",
+            "temperatura": round(20 + random.random() * 5, 2),
+            "ph": round(6.5 + random.random(), 2),
+            "oxigeno": round(80 + random.random() * 15, 2),
+        }, timeout=30)
+    return sesion.get(base + "/api/datos", params={"dominio": DOMINIO, "limit": 50}, timeout=30)
+
+def cliente(args):
+    # Un proceso cliente con varios hilos, cada uno con su propia sesión keep-alive
+    base, escenario, hilos, duracion = args
+    latencias, errores = [], [0]
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def trabajar():
+        sesion = requests.Session()
+        propias, fallidas = [], 0
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                ok = peticion(sesion, base, escenario).status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                propias.append(time.perf_counter() - inicio)
+            else:
+                fallidas += 1
+        with lock:
+            latencias.extend(propias)
+            errores[0] += fallidas
+
+    trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return latencias, errores[0]
+
+def cargar(base, escenario, concurrencia, procesos, duracion):
+    hilos = max(1, concurrencia // procesos)
+    with multiprocessing.Pool(procesos) as pool:
+        resultados = pool.map(cliente, [(base, escenario, hilos, duracion)] * procesos)
+    latencias = sorted(l for lat, _ in resultados for l in lat)
+    errores = sum(e for _, e in resultados)
+    if not latencias:
+        return {"rps": 0.0, "p50_ms": None, "p99_ms": None, "errores": errores}
+    return {
+        "rps": len(latencias) / duracion,
+        "p50_ms": 1000 * statistics.median(latencias),
+        "p99_ms": 1000 * latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))],
+        "errores": errores,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos de carga por escenario")
+    parser.add_argument("--concurrencia", type=int, default=128, help="Peticiones simultáneas en total")
+    parser.add_argument("--procesos-cliente", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2, help="Procesos de cada servidor")
+    parser.add_argument("--hilos", type=int, default=8, help="Hilos por worker de gunicorn")
+    parser.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)["biorreactor_app"]
+    db.drop_collection(DOMINIO)
+
+    resultados = []
+    try:
+        for tipo in ("flask", "asgi"):
+            proceso, base = iniciar_servidor(tipo, args.puerto, args.uri, args.workers, args.hilos)
+            try:
+                for escenario in ("sensores", "datos"):
+                    r = cargar(base, escenario, args.concurrencia, args.procesos_cliente, args.duracion)
+                    resultados.append((tipo, escenario, r))
+                    print(f"{tipo:6s} {escenario:9s} {r['rps']:9.1f} req/s  p50 {r['p50_ms'] or 0:8.2f} ms"
+                          f"  p99 {r['p99_ms'] or 0:8.2f} ms  errores {r['errores']}")
+            finally:
+                proceso.terminate()
+                proceso.wait(10)
+    finally:
+        db.drop_collection(DOMINIO)
+
+    print("\nescenario  servidor  req/s      p99 ms")
+    for escenario in ("sensores", "datos"):
+        for tipo, esc, r in resultados:
+            if esc == escenario:
+                print(f"{escenario:9s}  {tipo:8s}  {r['rps']:9.1f}  {r['p99_ms'] or 0:8.2f}")
+
+if __name__ == "__main__":
+    main()
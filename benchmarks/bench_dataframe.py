@@ -0,0 +1,102 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+import bson
+import pandas as pd
+from pymongo import MongoClient
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import PROYECCION_DATOS, convertir_a_chile, dataframe_lecturas
+
+# Benchmark: armado del DataFrame del dashboard, por documento vs por columnas.
+#
+# Compara el camino anterior (una fila dict por documento con convertir_a_chile + strftime,
+# y luego pd.to_datetime sobre los textos) con database.dataframe_lecturas (columnas,
+# tz_convert vectorizado, float64) a 5k, 50k y 500k filas.
+#
+# Sin --uri los documentos se decodifican desde BSON en lotes de 1000, como hace el driver,
+# sin necesitar MongoDB. Con --uri se leen de un mongod local (la base "bench_dataframe" se
+# elimina al final):
+#     python benchmarks/bench_dataframe.py
+#     python benchmarks/bench_dataframe.py --uri mongodb://localhost:27017
+
+INICIO = datetime(2025, 1, 1)
+TAMANOS = [5_000, 50_000, 500_000]
+
+def lecturas_sinteticas(total, dispositivos=10):
+    for n in range(total):
+        paso, disp = divmod(n, dispositivos)
+        yield {
+            'tiempo': INICIO + timedelta(seconds=paso * 30),
+            'id_dispositivo': f'reactor_{disp:02d}',
+            'temperatura': round(20 + random.random() * 5, 2),
+            'ph': round(6.5 + random.random(), 2),
+            'oxigeno': round(80 + random.random() * 15, 2),
+            'turbidez': round(random.random() * 40, 2),
+            'conductividad': round(1200 + random.random() * 600, 2),
+        }
+
+def cursor_bson(lotes):
+    # Simula el cursor: cada lote se decodifica al pedirlo
+    for lote in lotes:
+        yield from bson.decode_all(lote)
+
+def lotes_bson(total, tamano_lote=1000):
+    docs = list(lecturas_sinteticas(total))
+    return [b''.join(bson.encode(d) for d in docs[i:i + tamano_lote]) for i in range(0, total, tamano_lote)]
+
+def dataframe_anterior(cursor):
+    datos = []
+    for doc in cursor:
+        tiempo_chile = convertir_a_chile(doc.get("tiempo"))
+        datos.append({
+            'tiempo': tiempo_chile.strftime('%Y-%m-%d %H:%M:%S'),
+            'id_dispositivo': doc.get('id_dispositivo'),
+            'temperatura': doc.get('temperatura'),
+            'ph': doc.get('ph'),
+            'oxigeno': doc.get('oxigeno'),
+            'turbidez': doc.get('turbidez'),
+            'conductividad': doc.get('conductividad')
+        })
+    df = pd.DataFrame(datos)
+    df['tiempo'] = pd.to_datetime(df['tiempo'])
+    return df
+
+def medir(funcion, fuente, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(fuente())
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", help="mongod local; sin él se decodifica BSON en memoria")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    cliente = MongoClient(args.uri) if args.uri else None
+    print(f"{'filas':>8}  {'anterior (s)':>12}  {'columnas (s)':>12}  {'mejora':>7}")
+    try:
+        for total in TAMANOS:
+            if cliente:
+                collection = cliente["bench_dataframe"]["lecturas"]
+                collection.drop()
+                collection.insert_many(lecturas_sinteticas(total), ordered=False)
+                fuente = lambda: collection.find({}, PROYECCION_DATOS).sort("tiempo", -1).batch_size(10000)
+            else:
+                lotes = lotes_bson(total)
+                fuente = lambda: cursor_bson(lotes)
+
+            anterior = medir(dataframe_anterior, fuente, args.repeticiones)
+            columnas = medir(dataframe_lecturas, fuente, args.repeticiones)
+            print(f"{total:>8}  {anterior:>12.3f}  {columnas:>12.3f}  {anterior / columnas:>6.1f}x")
+    finally:
+        if cliente:
+            cliente.drop_database("bench_dataframe")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lector_serial import Reenviador
+
+# Benchmark del reenviador serial -> API (lector_serial.Reenviador).
+#
+# Simula el puerto serial con una pty (o un archivo) escrito a alta tasa y una
+# API falsa local que responde como /api/sensores/batch, y mide el throughput
+# de punta a punta y las lecturas perdidas. Con --caida se simula una caída de
+# la API para ejercitar el spool en disco.
+#
+# Uso (Linux/macOS):
+#     python benchmarks/bench_lector_serial.py --lecturas 50000 --tasa 20000
+#     python benchmarks/bench_lector_serial.py --caida 3
+#     python benchmarks/bench_lector_serial.py --fuente archivo
+
+class ApiFalsa(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ManejadorApi)
+        self.recibidas = 0
+        self.ids = set()
+        self.caida_hasta = 0.0
+        self.lock = threading.Lock()
+
+class ManejadorApi(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        cuerpo = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if time.monotonic() < self.server.caida_hasta:
+            self._responder(503, {'error': 'API caída'})
+            return
+
+        datos = json.loads(cuerpo)
+        lecturas = datos if isinstance(datos, list) else [datos]
+        with self.server.lock:
+            self.server.recibidas += len(lecturas)
+            self.server.ids.update(l.get('n') for l in lecturas)
+
+        if self.path.endswith('/batch'):
+            self._responder(201, {'aceptados': len(lecturas), 'rechazados': 0, 'resultados': []})
+        else:
+            self._responder(201, {'message': 'ok'})
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+class PuertoArchivo:
+    # Imita serial.Serial.readline() sobre un archivo que otro hilo va escribiendo
+    def __init__(self, ruta):
+        self.f = open(ruta, 'rb')
+
+    def readline(self):
+        linea = self.f.readline()
+        if not linea:
+            time.sleep(0.001)
+        return linea
+
+    def close(self):
+        self.f.close()
+
+def linea_sintetica(n):
+    return json.dumps({
+        'dominio': 'dominio_bench', 'id_dispositivo': f'disp_{n % 8}', 'n': n,
+        'temperatura': 21.5, 'ph': 7.1, 'oxigeno': 88.0, 'turbidez': 12.3, 'conductividad': 1500.0
+    }).encode() + b'\n'
+
+def escribir_lineas(escribir, total, tasa):
+    # Escribe en bloques para sostener tasas altas sin una llamada por línea
+    bloque = max(1, tasa // 100)
+    inicio = time.monotonic()
+    for base in range(0, total, bloque):
+        escribir(b''.join(linea_sintetica(n) for n in range(base, min(base + bloque, total))))
+        objetivo = inicio + (base + bloque) / tasa
+        espera = objetivo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+    return time.monotonic() - inicio
+
+def abrir_fuente(tipo, directorio):
+    if tipo == 'pty':
+        import serial
+        maestro, esclavo = os.openpty()
+        puerto = serial.Serial(os.ttyname(esclavo), timeout=0.1)
+        puerto.reset_input_buffer()
+
+        def escribir(datos):
+            vista = memoryview(datos)
+            while vista:
+                vista = vista[os.write(maestro, vista):]
+
+        def cerrar():
+            puerto.close()
+            os.close(maestro)
+            os.close(esclavo)
+        return puerto, escribir, cerrar
+
+    ruta = os.path.join(directorio, 'serial.ndjson')
+    salida = open(ruta, 'wb', buffering=0)
+    puerto = PuertoArchivo(ruta)
+
+    def cerrar():
+        puerto.close()
+        salida.close()
+    return puerto, salida.write, cerrar
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lecturas', type=int, default=20000)
+    parser.add_argument('--tasa', type=int, default=10000, help='líneas por segundo escritas al puerto')
+    parser.add_argument('--lote', type=int, default=500)
+    parser.add_argument('--caida', type=float, default=0.0, help='segundos de caída de la API al inicio')
+    parser.add_argument('--fuente', choices=['pty', 'archivo'], default='pty')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    api = ApiFalsa()
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    api.caida_hasta = time.monotonic() + args.caida
+
+    with tempfile.TemporaryDirectory() as directorio:
+        puerto, escribir, cerrar = abrir_fuente(args.fuente, directorio)
+        reenviador = Reenviador(
+            puerto,
+            api_url=f'http://127.0.0.1:{api.server_port}',
+            ruta_spool=os.path.join(directorio, 'spool.ndjson'),
+            tamano_lote=args.lote,
+            intervalo_envio=0.2
+        )
+        reenviador.iniciar()
+
+        inicio = time.monotonic()
+        duracion_escritura = escribir_lineas(escribir, args.lecturas, args.tasa)
+
+        limite = time.monotonic() + args.timeout
+        while api.recibidas < args.lecturas and time.monotonic() < limite:
+            time.sleep(0.05)
+        duracion_total = time.monotonic() - inicio
+
+        reenviador.cerrar()
+        cerrar()
+        api.shutdown()
+
+    unicas = len(api.ids)
+    perdidas = args.lecturas - unicas
+    print(f"Fuente: {args.fuente} | lecturas: {args.lecturas} | tasa objetivo: {args.tasa}/s | lote: {args.lote}")
+    print(f"Escritura al puerto: {duracion_escritura:.2f} s ({args.lecturas / duracion_escritura:,.0f} líneas/s)")
+    print(f"Entrega de punta a punta: {duracion_total:.2f} s ({unicas / duracion_total:,.0f} lecturas/s)")
+    print(f"Recibidas por la API: {api.recibidas} (únicas {unicas}, duplicadas {api.recibidas - unicas})")
+    print(f"Perdidas: {perdidas} ({100 * perdidas / args.lecturas:.3f} %)")
+    print(f"Estadísticas del reenviador: {reenviador.estadisticas}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.colecciones import OPCIONES_TIMESERIES, asegurar_indices
+
+# Benchmark: colección normal vs colección time-series para las lecturas de sensores.
+#
+# Inserta las mismas lecturas sintéticas en una colección normal (con los índices de
+# app.colecciones) y en una time-series (timeField=tiempo, metaField=id_dispositivo),
+# y compara tamaño en disco y latencia de consultas por rango de tiempo.
+#
+# Requiere un mongod >= 5.0 local (la base de datos "bench_timeseries" se elimina al final):
+#     python benchmarks/bench_timeseries.py --uri mongodb://localhost:27017 --lecturas 3000000
+
+INICIO = datetime(2025, 1, 1)
+
+def lecturas_sinteticas(total, dispositivos, intervalo_s):
+    # Cada dispositivo reporta cada intervalo_s segundos, como el firmware del biorreactor
+    for n in range(total):
+        paso, disp = divmod(n, dispositivos)
+        yield {
+            'tiempo': INICIO + timedelta(seconds=paso * intervalo_s),
+            'id_dispositivo': f'reactor_{disp:02d}',
+            'temperatura': round(20 + random.random() * 5, 2),
+            'ph': round(6.5 + random.random(), 2),
+            'oxigeno': round(80 + random.random() * 15, 2),
+            'turbidez': round(random.random() * 40, 2),
+            'conductividad': round(1200 + random.random() * 600, 2),
+        }
+
+def cargar(collection, total, dispositivos, intervalo_s, lote=10000):
+    inicio = time.perf_counter()
+    buffer = []
+    for doc in lecturas_sinteticas(total, dispositivos, intervalo_s):
+        buffer.append(doc)
+        if len(buffer) == lote:
+            collection.insert_many(buffer, ordered=False)
+            buffer = []
+    if buffer:
+        collection.insert_many(buffer, ordered=False)
+    return time.perf_counter() - inicio
+
+def tamano(db, nombre):
+    stats = db.command('collStats', nombre)
+    return stats.get('storageSize', 0), stats.get('totalIndexSize', 0)
+
+def medir_rangos(collection, dispositivos, fin, ventana, repeticiones):
+    latencias = []
+    for _ in range(repeticiones):
+        disp = f'reactor_{random.randrange(dispositivos):02d}'
+        desde = INICIO + (fin - INICIO - ventana) * random.random()
+        inicio = time.perf_counter()
+        list(collection.find(
+            {'id_dispositivo': disp, 'tiempo': {'$gte': desde, '$lt': desde + ventana}},
+            {'_id': 0}
+        ).sort('tiempo', -1))
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    latencias.sort()
+    return statistics.median(latencias), latencias[int(len(latencias) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--lecturas', type=int, default=2_000_000)
+    parser.add_argument('--dispositivos', type=int, default=10)
+    parser.add_argument('--intervalo', type=int, default=60, help='segundos entre lecturas de un dispositivo')
+    parser.add_argument('--repeticiones', type=int, default=50)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    client.drop_database('bench_timeseries')
+    db = client['bench_timeseries']
+
+    normal = db['normal']
+    asegurar_indices(normal)
+    db.create_collection('serie', timeseries=OPCIONES_TIMESERIES)
+    serie = db['serie']
+    asegurar_indices(serie)
+
+    print(f"Insertando {args.lecturas:,} lecturas ({args.dispositivos} dispositivos)...")
+    t_normal = cargar(normal, args.lecturas, args.dispositivos, args.intervalo)
+    t_serie = cargar(serie, args.lecturas, args.dispositivos, args.intervalo)
+    fin = INICIO + timedelta(seconds=(args.lecturas // args.dispositivos) * args.intervalo)
+
+    print(f"\n{'':<14}{'normal':>16}{'time-series':>16}")
+    print(f"{'inserción (s)':<14}{t_normal:>16.1f}{t_serie:>16.1f}")
+    datos_n, idx_n = tamano(db, 'normal')
+    datos_s, idx_s = tamano(db, 'serie')
+    print(f"{'datos (MB)':<14}{datos_n / 2**20:>16.1f}{datos_s / 2**20:>16.1f}")
+    print(f"{'índices (MB)':<14}{idx_n / 2**20:>16.1f}{idx_s / 2**20:>16.1f}")
+
+    for nombre, ventana in [('1 hora', timedelta(hours=1)), ('1 día', timedelta(days=1)), ('7 días', timedelta(days=7))]:
+        p50_n, p95_n = medir_rangos(normal, args.dispositivos, fin, ventana, args.repeticiones)
+        p50_s, p95_s = medir_rangos(serie, args.dispositivos, fin, ventana, args.repeticiones)
+        print(f"{'rango ' + nombre:<14}{f'{p50_n:.1f}/{p95_n:.1f} ms':>16}{f'{p50_s:.1f}/{p95_s:.1f} ms':>16}  (p50/p95)")
+
+    client.drop_database('bench_timeseries')
+    client.close()
+
+if __name__ == '__main__':
+    main()
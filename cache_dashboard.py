@@ -0,0 +1,256 @@
+import functools
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+from cachetools import TLRUCache
+from database import obtener_dataframe
+
+# Ventana de lecturas recientes que se mantiene en memoria por dominio, cada cuánto se piden
+# las lecturas nuevas y tope de filas de la primera carga
+RETENCION_DIAS = float(os.environ.get("CACHE_RETENCION_DIAS", 8))
+REFRESCO_S = float(os.environ.get("CACHE_REFRESCO_S", 60))
+LIMITE_FILAS_CACHE = int(os.environ.get("CACHE_LIMITE_FILAS", 200000))
+# Las lecturas en lote (spool del lector serial) pueden llegar con algunos minutos de atraso:
+# cada actualización vuelve a pedir este tramo anterior a la marca y lo reemplaza
+SOLAPE_MINUTOS = float(os.environ.get("CACHE_SOLAPE_MINUTOS", 10))
+# Un spool que se vacía después de un corte más largo reenvía lecturas con su tiempo original,
+# anteriores al solape: cada tanto la ventana se vuelve a cargar completa para incluirlas
+RECARGA_COMPLETA_S = float(os.environ.get("CACHE_RECARGA_COMPLETA_S", 1800))
+
+def _utc(marca):
+    # Timestamp con zona horaria -> datetime UTC sin zona (como se guarda en MongoDB)
+    return marca.tz_convert("UTC").tz_localize(None).to_pydatetime()
+
+def _chile(fecha_utc):
+    return pd.Timestamp(fecha_utc).tz_localize("UTC").tz_convert("America/Santiago")
+
+class _EstadoDominio:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.df = None
+        self.marca = None       # Mayor tiempo cargado (UTC sin zona)
+        self.cobertura = None   # Desde cuándo el DataFrame tiene todas las lecturas (UTC sin zona)
+        self.refrescado = 0.0
+        self.cargado = 0.0      # Última carga completa (reloj monotónico)
+
+# Lecturas recientes de cada dominio, compartidas por todas las sesiones del dashboard: la
+# primera carga trae la ventana de retención y las siguientes solo lo posterior a la marca
+class CacheIncremental:
+    def __init__(self, retencion_dias=RETENCION_DIAS, refresco_s=REFRESCO_S, limite_filas=LIMITE_FILAS_CACHE,
+                 solape_minutos=SOLAPE_MINUTOS, recarga_completa_s=RECARGA_COMPLETA_S, cargar=obtener_dataframe):
+        self.retencion = timedelta(days=retencion_dias)
+        self.refresco_s = refresco_s
+        self.limite_filas = limite_filas
+        self.solape = timedelta(minutes=solape_minutos)
+        self.recarga_completa_s = recarga_completa_s
+        self.cargar = cargar
+        self.lock = threading.Lock()
+        self.estados = {}
+        self.contadores = {"cargas_completas": 0, "cargas_incrementales": 0, "filas_descargadas": 0}
+
+    def _estado(self, dominio):
+        with self.lock:
+            if dominio not in self.estados:
+                self.estados[dominio] = _EstadoDominio()
+            return self.estados[dominio]
+
+    def _sumar(self, clave, cantidad=1):
+        with self.lock:
+            self.contadores[clave] += cantidad
+
+    def _carga_completa(self, estado, dominio):
+        inicio_ventana = datetime.utcnow() - self.retencion
+        df = self.cargar(dominio, self.limite_filas, desde=inicio_ventana)
+        estado.df = df
+        estado.cobertura = inicio_ventana
+        if len(df) >= self.limite_filas:
+            # Ventana truncada: solo están completas las lecturas desde la más antigua cargada
+            estado.cobertura = _utc(df["tiempo"].min())
+        estado.marca = _utc(df["tiempo"].max()) if not df.empty else None
+        estado.cargado = time.monotonic()
+        self._sumar("cargas_completas")
+        self._sumar("filas_descargadas", len(df))
+
+    def _carga_incremental(self, estado, dominio):
+        desde = estado.marca - self.solape
+        nuevas = self.cargar(dominio, 0, desde=desde)  # limit 0: sin tope
+        anteriores = estado.df[estado.df["tiempo"] < _chile(desde)]
+        df = pd.concat([anteriores, nuevas], ignore_index=True) if not nuevas.empty else anteriores
+
+        # Se descartan las lecturas que salieron de la ventana de retención
+        inicio_ventana = datetime.utcnow() - self.retencion
+        df = df[df["tiempo"] >= _chile(inicio_ventana)].reset_index(drop=True)
+
+        estado.df = df
+        estado.cobertura = max(estado.cobertura, inicio_ventana)
+        if not nuevas.empty:
+            estado.marca = max(estado.marca, _utc(nuevas["tiempo"].max()))
+        self._sumar("cargas_incrementales")
+        self._sumar("filas_descargadas", len(nuevas))
+
+    def actualizar(self, dominio):
+        estado = self._estado(dominio)
+        with estado.lock:
+            vencida = time.monotonic() - estado.cargado >= self.recarga_completa_s
+            if estado.df is None or estado.marca is None or vencida:
+                self._carga_completa(estado, dominio)
+            else:
+                self._carga_incremental(estado, dominio)
+            estado.refrescado = time.monotonic()
+            return estado.df
+
+    def actualizar_hasta(self, dominio, tiempo):
+        # Actualiza solo si el caché aún no tiene lecturas hasta `tiempo` (UTC sin zona): con
+        # varias sesiones en vivo, la primera trae las lecturas nuevas y las demás las reutilizan
+        estado = self._estado(dominio)
+        with estado.lock:
+            al_dia = estado.df is not None and estado.marca is not None and estado.marca >= tiempo
+        if al_dia:
+            return estado.df
+        return self.actualizar(dominio)
+
+    def obtener(self, dominio):
+        estado = self._estado(dominio)
+        if estado.df is None or time.monotonic() - estado.refrescado >= self.refresco_s:
+            return self.actualizar(dominio)
+        return estado.df
+
+    def consultar(self, dominio, desde, hasta=None, dispositivos=None, limit=None):
+        # Lecturas del rango [desde, hasta) (UTC sin zona) desde memoria; None si el rango
+        # empieza antes de lo que cubre el caché y hay que consultarlo a MongoDB
+        df = self.obtener(dominio)
+        estado = self._estado(dominio)
+        if desde is None or estado.cobertura is None or desde < estado.cobertura:
+            return None
+
+        filtro = df["tiempo"] >= _chile(desde)
+        if hasta is not None:
+            filtro &= df["tiempo"] < _chile(hasta)
+        if dispositivos:
+            filtro &= df["id_dispositivo"].isin(dispositivos)
+        resultado = df[filtro]
+        if limit:
+            resultado = resultado.tail(limit)
+        return resultado.reset_index(drop=True)
+
+    def invalidar(self, dominio=None):
+        with self.lock:
+            if dominio is None:
+                self.estados.clear()
+            else:
+                self.estados.pop(dominio, None)
+
+    def resumen(self):
+        with self.lock:
+            resumen = dict(self.contadores)
+            estados = dict(self.estados)
+        resumen["dominios"] = {
+            dominio: {
+                "filas": 0 if estado.df is None else len(estado.df),
+                "marca": estado.marca.isoformat() if estado.marca else None
+            }
+            for dominio, estado in estados.items()
+        }
+        return resumen
+
+# --- CACHÉ DE LECTURA ---
+# Tope de memoria del caché de lectura compartido (MB) y TTL por etiqueta (segundos)
+CACHE_LECTURA_MB = float(os.environ.get("CACHE_LECTURA_MB", 64))
+TTL_POR_ETIQUETA = {
+    "comida": 60,
+    "dispositivos": 300,
+    "manual": 120,
+    "imagenes": 60,
+    "ultimo_estado": 5,
+    "reporte": 60,
+    "conteo": 300,
+}
+TTL_POR_DEFECTO = 60
+
+def _tamano(valor):
+    # Estimación del tamaño en bytes para el tope de memoria del LRU
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, (bytes, bytearray)):
+        return len(valor)
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamano(v) for v in valor)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(_tamano(v) for v in valor.values())
+    return sys.getsizeof(valor)
+
+# Caché de lectura del proceso, compartido por todas las sesiones del dashboard: cada clave
+# vence según el TTL de su etiqueta y, si se supera el tope de memoria, se descartan las
+# menos usadas. Los resultados se comparten entre sesiones, así que no deben modificarse
+class CacheLectura:
+    def __init__(self, maximo_mb=CACHE_LECTURA_MB, ttl_por_etiqueta=TTL_POR_ETIQUETA):
+        self.ttl_por_etiqueta = dict(ttl_por_etiqueta)
+        self.lock = threading.Lock()
+        self.cache = TLRUCache(
+            maxsize=int(maximo_mb * 1024 * 1024),
+            ttu=lambda clave, valor, ahora: ahora + self.ttl_por_etiqueta.get(clave[0], TTL_POR_DEFECTO),
+            timer=time.monotonic,
+            getsizeof=_tamano
+        )
+        self.contadores = {}
+
+    def _contar(self, etiqueta, evento):
+        contadores = self.contadores.setdefault(etiqueta, {"aciertos": 0, "fallos": 0, "invalidaciones": 0})
+        contadores[evento] += 1
+
+    def obtener(self, etiqueta, clave, cargar):
+        clave = (etiqueta,) + clave
+        with self.lock:
+            try:
+                valor = self.cache[clave]
+                self._contar(etiqueta, "aciertos")
+                return valor
+            except KeyError:
+                self._contar(etiqueta, "fallos")
+
+        # La consulta se hace fuera del lock para no bloquear a las demás sesiones
+        valor = cargar()
+        with self.lock:
+            try:
+                self.cache[clave] = valor
+            except ValueError:
+                pass  # Más grande que el tope completo: se devuelve sin guardarlo
+        return valor
+
+    def cacheado(self, etiqueta):
+        # Decorador de lectura: la clave son la etiqueta y los argumentos de la función
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                clave = args + tuple(sorted(kwargs.items()))
+                return self.obtener(etiqueta, clave, lambda: funcion(*args, **kwargs))
+            return envoltura
+        return decorador
+
+    def invalidar(self, etiqueta=None):
+        with self.lock:
+            claves = [clave for clave in list(self.cache.keys()) if etiqueta is None or clave[0] == etiqueta]
+            for clave in claves:
+                self.cache.pop(clave, None)
+            for nombre in ([etiqueta] if etiqueta else list(self.contadores)):
+                self._contar(nombre, "invalidaciones")
+
+    def resumen(self):
+        with self.lock:
+            self.cache.expire()
+            aciertos = sum(c["aciertos"] for c in self.contadores.values())
+            fallos = sum(c["fallos"] for c in self.contadores.values())
+            return {
+                "entradas": len(self.cache),
+                "memoria_mb": round(self.cache.currsize / (1024 * 1024), 2),
+                "maximo_mb": round(self.cache.maxsize / (1024 * 1024), 2),
+                "aciertos": aciertos,
+                "fallos": fallos,
+                "tasa_aciertos": round(aciertos / (aciertos + fallos), 3) if aciertos + fallos else None,
+                "etiquetas": {etiqueta: dict(c) for etiqueta, c in self.contadores.items()},
+            }
+
+cache_lectura = CacheLectura()
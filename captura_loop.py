@@ -1,24 +1,143 @@
+import argparse
+import os
+import threading
 import time
-from datetime import datetime
-from capturar_imagenes import capturar_y_guardar
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from almacen_imagenes import guardar_imagen
+from capturar_imagenes import crear_fuente, hora_chile, obtener_db
 
+# Servicio de captura para varias cámaras/reactores. Cada cámara tiene su hilo, mantiene su
+# fuente abierta y captura en horarios fijos (reloj monotónico); la codificación y el guardado
+# van a un pool de hilos compartido, así un guardado lento no corre el horario de captura.
+# Configuración en YAML (CAPTURA_CONFIG, por defecto captura.yaml):
+#
+#   camaras:
+#     - nombre: reactor_1
+#       fuente: 0                  # índice de cámara, URL, imagen/carpeta o "sintetica"
+#       id_dispositivo: ucn_01
+#       dominio: dominio_ucn
+#       intervalo_minutos: 60
+#
+# Sin archivo de configuración se captura solo la cámara 0 cada INTERVALO_MINUTOS
 INTERVALO_MINUTOS = 60
+RUTA_CONFIG = os.environ.get("CAPTURA_CONFIG", "captura.yaml")
+HILOS_GUARDADO = int(os.environ.get("CAPTURA_HILOS", 4))
+# Imágenes por cámara esperando guardado; si se llena (base de datos caída) se omiten capturas
+MAX_PENDIENTES = int(os.environ.get("CAPTURA_MAX_PENDIENTES", 8))
+
+def cargar_config(ruta=RUTA_CONFIG):
+    if not os.path.exists(ruta):
+        print(f"ℹ️ No existe {ruta}, se usa la cámara 0 cada {INTERVALO_MINUTOS} minutos")
+        return [{"nombre": "camara_0", "fuente": 0}]
+
+    with open(ruta, encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    camaras = config.get("camaras") or []
+    if not camaras:
+        raise ValueError(f"❌ {ruta} no define ninguna cámara en 'camaras'")
+
+    nombres = set()
+    for i, camara in enumerate(camaras):
+        camara.setdefault("nombre", f"camara_{i}")
+        if camara["nombre"] in nombres:
+            raise ValueError(f"❌ Nombre de cámara repetido en {ruta}: {camara['nombre']}")
+        nombres.add(camara["nombre"])
+        if float(camara.get("intervalo_minutos", INTERVALO_MINUTOS)) <= 0:
+            raise ValueError(f"❌ intervalo_minutos de {camara['nombre']} debe ser mayor que 0")
+    return camaras
+
+class Camara(threading.Thread):
+    def __init__(self, config, pool, detener, una_vez=False):
+        super().__init__(name=f"captura-{config['nombre']}", daemon=True)
+        self.nombre = config["nombre"]
+        self.intervalo = float(config.get("intervalo_minutos", INTERVALO_MINUTOS)) * 60
+        self.fuente = crear_fuente(config.get("fuente", 0))
+        # Etiquetas del documento de la imagen (y de sus metadatos en GridFS)
+        self.metadatos = {"camara": self.nombre}
+        for campo in ("id_dispositivo", "dominio"):
+            if config.get(campo):
+                self.metadatos[campo] = config[campo]
+        self.pool = pool
+        self.detener = detener
+        self.una_vez = una_vez
+        self.pendientes = threading.BoundedSemaphore(MAX_PENDIENTES)
+        self.guardadas = 0
+        self.omitidas = 0
+        self.errores = 0
+
+    def run(self):
+        proxima = time.monotonic()
+        try:
+            while not self.detener.is_set():
+                self.capturar()
+                if self.una_vez:
+                    break
+                # El horario avanza desde el anterior, no desde que terminó la captura; los turnos
+                # que ya pasaron (captura bloqueada, equipo suspendido) se saltan
+                proxima += self.intervalo
+                ahora = time.monotonic()
+                if proxima < ahora:
+                    saltos = int((ahora - proxima) // self.intervalo) + 1
+                    self.omitidas += saltos
+                    proxima += saltos * self.intervalo
+                self.detener.wait(proxima - ahora)
+        finally:
+            self.fuente.cerrar()
+
+    def capturar(self):
+        if not self.pendientes.acquire(blocking=False):
+            print(f"⚠️ [{self.nombre}] {MAX_PENDIENTES} imágenes aún sin guardar, se omite esta captura")
+            self.omitidas += 1
+            return
+        try:
+            frame = self.fuente.leer()
+            tiempo = hora_chile()
+        except Exception as e:
+            self.pendientes.release()
+            self.errores += 1
+            print(f"[ERROR] [{self.nombre}] Falló la captura: {e}")
+            return
+        self.pool.submit(self.guardar, frame, tiempo)
+
+    def guardar(self, frame, tiempo):
+        try:
+            guardar_imagen(obtener_db(), frame, tiempo, self.metadatos)
+            self.guardadas += 1
+            print(f"[{tiempo.strftime('%Y-%m-%d %H:%M:%S')}] [{self.nombre}] Imagen guardada (hora Chile)")
+        except Exception as e:
+            self.errores += 1
+            print(f"[ERROR] [{self.nombre}] Falló el guardado: {e}")
+        finally:
+            self.pendientes.release()
 
 def main():
-    print("Iniciando loop de captura de imágenes.")
-    try:
-        while True:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Capturando imagen...")
-            try:
-                capturar_y_guardar()
-            except Exception as e:
-                print(f"[ERROR] Falló la captura: {e}")
+    parser = argparse.ArgumentParser(description="Captura imágenes de una o varias cámaras y las guarda en la base de datos.")
+    parser.add_argument("--config", default=RUTA_CONFIG, help="Archivo YAML con las cámaras")
+    parser.add_argument("--una-vez", action="store_true", help="Capturar una imagen por cámara y terminar")
+    args = parser.parse_args()
 
-            print(f"Esperando {INTERVALO_MINUTOS} minutos...\n")
-            time.sleep(INTERVALO_MINUTOS * 60)
+    camaras = cargar_config(args.config)
+    detener = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=HILOS_GUARDADO, thread_name_prefix="guardado")
+    hilos = [Camara(config, pool, detener, args.una_vez) for config in camaras]
 
+    print(f"Iniciando captura de imágenes: {', '.join(h.nombre for h in hilos)}")
+    for hilo in hilos:
+        hilo.start()
+    try:
+        while any(hilo.is_alive() for hilo in hilos):
+            time.sleep(1)
     except KeyboardInterrupt:
         print("Captura detenida por el usuario.")
+        detener.set()
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        # Las imágenes ya capturadas se terminan de guardar antes de salir
+        pool.shutdown(wait=True)
+        for hilo in hilos:
+            print(f"{hilo.nombre}: {hilo.guardadas} guardadas, {hilo.omitidas} omitidas, {hilo.errores} errores")
 
 if __name__ == "__main__":
     main()
@@ -1,56 +1,131 @@
+import os
 import cv2
-import base64
+import numpy as np
 from datetime import datetime
-from pymongo import MongoClient
-import os
 import pytz
+from database import obtener_db as obtener_base_datos
+from almacen_imagenes import guardar_imagen
+
+# Frames que se descartan antes de cada captura: una cámara abierta entre capturas acumula
+# frames viejos en su buffer
+FRAMES_DESCARTADOS = 2
 
-# Función para conexión con MongoDB
+# Colección de imágenes sobre la conexión compartida del proceso
 def obtener_db():
-    mongo_uri = os.environ.get("MONGO_URI")
-    if not mongo_uri:
-        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
-    client = MongoClient(mongo_uri)
-    db = client["biorreactor_app"]
-    return db["imagenes_camara"]
-
-def capturar_y_guardar():
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    
-    if not cap.isOpened():
-        print("No se pudo acceder a la cámara.")
-        return
+    return obtener_base_datos()["imagenes_camara"]
 
-    try:
-        ret, frame = cap.read()
+# --- FUENTES DE IMAGEN ---
+class FuenteCamara:
+    # Cámara (índice o URL de OpenCV) que se mantiene abierta entre capturas y se reabre si falla
+    def __init__(self, dispositivo=0):
+        self.dispositivo = dispositivo
+        self.cap = None
+
+    def abrir(self):
+        # DirectShow solo existe en Windows; en el resto OpenCV elige el backend
+        backend = cv2.CAP_DSHOW if os.name == "nt" else cv2.CAP_ANY
+        self.cap = cv2.VideoCapture(self.dispositivo, backend)
+        if not self.cap.isOpened():
+            self.cerrar()
+            raise IOError(f"No se pudo acceder a la cámara {self.dispositivo}")
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def leer(self):
+        if self.cap is None:
+            self.abrir()
+        for _ in range(FRAMES_DESCARTADOS):
+            self.cap.grab()
+        ret, frame = self.cap.read()
         if not ret:
-            print("Error al capturar imagen.")
-            return
+            # Cámara desconectada: se reabre en la siguiente captura
+            self.cerrar()
+            raise IOError(f"Error al capturar imagen de la cámara {self.dispositivo}")
+        return frame
 
-        # Codificar imagen como base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        imagen_base64 = base64.b64encode(buffer).decode('utf-8')
+    def cerrar(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
 
-        # Tiempo actual en hora de Chile
-        chile_tz = pytz.timezone('America/Santiago')
-        tiempo_chile = datetime.now(pytz.utc).astimezone(chile_tz)
+class FuenteArchivo:
+    # Imagen fija o carpeta de imágenes que se recorre en ciclo (pruebas sin cámara)
+    EXTENSIONES = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.posicion = 0
+
+    def leer(self):
+        if os.path.isdir(self.ruta):
+            archivos = sorted(f for f in os.listdir(self.ruta) if f.lower().endswith(self.EXTENSIONES))
+            if not archivos:
+                raise IOError(f"No hay imágenes en {self.ruta}")
+            ruta = os.path.join(self.ruta, archivos[self.posicion % len(archivos)])
+            self.posicion += 1
+        else:
+            ruta = self.ruta
+        frame = cv2.imread(ruta)
+        if frame is None:
+            raise IOError(f"No se pudo leer la imagen {ruta}")
+        return frame
+
+    def cerrar(self):
+        pass
 
-        doc = {
-            "tiempo": tiempo_chile,
-            "imagen": imagen_base64
-        }
+class FuenteSintetica:
+    # Frame generado (degradado con la hora de captura), sin hardware ni archivos
+    def __init__(self, ancho=640, alto=480):
+        self.ancho = ancho
+        self.alto = alto
+        self.contador = 0
 
-        # Insertar en MongoDB
+    def leer(self):
+        self.contador += 1
+        fila = np.linspace(0, 255, self.ancho, dtype=np.uint8)
+        frame = np.zeros((self.alto, self.ancho, 3), dtype=np.uint8)
+        frame[:, :, 0] = fila
+        frame[:, :, 1] = (fila.astype(np.int32) + self.contador * 16) % 256
+        frame[:, :, 2] = np.linspace(0, 255, self.alto, dtype=np.uint8)[:, None]
+        texto = f"{datetime.now():%Y-%m-%d %H:%M:%S} #{self.contador}"
+        cv2.putText(frame, texto, (10, self.alto - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        return frame
+
+    def cerrar(self):
+        pass
+
+def crear_fuente(fuente=0):
+    # Entero (o texto numérico): índice de cámara; "sintetica": frames generados; ruta existente:
+    # imagen o carpeta; cualquier otro texto se pasa a OpenCV (p. ej. una URL rtsp://)
+    if isinstance(fuente, int) or str(fuente).isdigit():
+        return FuenteCamara(int(fuente))
+    if fuente == "sintetica":
+        return FuenteSintetica()
+    if os.path.exists(fuente):
+        return FuenteArchivo(fuente)
+    return FuenteCamara(fuente)
+
+def hora_chile():
+    return datetime.now(pytz.utc).astimezone(pytz.timezone('America/Santiago'))
+
+def capturar_y_guardar(fuente=0, metadatos=None):
+    fuente = crear_fuente(fuente)
+    try:
+        frame = fuente.leer()
+
+        # Tiempo actual en hora de Chile
+        tiempo_chile = hora_chile()
+
+        # Imagen completa al almacén (GridFS o disco) y miniatura dentro del documento
         collection = obtener_db()
-        collection.insert_one(doc)
+        guardar_imagen(collection, frame, tiempo_chile, metadatos)
 
         print(f"Imagen guardada correctamente a las {tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')} (hora Chile)")
 
     except Exception as e:
         print(f"Error durante la captura o guardado: {e}")
-    
+
     finally:
-        cap.release()
+        fuente.cerrar()
 
 if __name__ == "__main__":
-    capturar_y_guardar()
\ No newline at end of file
+    capturar_y_guardar()
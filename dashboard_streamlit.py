@@ -1,10 +1,16 @@
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
-import pandas as pd
 import pytz
-from pymongo import MongoClient
-from datetime import datetime
-from database import obtener_datos, obtener_registro_comida
+from datetime import datetime, timedelta
+from database import (
+    obtener_dataframe,
+    obtener_db,
+    obtener_rango_fechas,
+    obtener_dispositivos,
+    obtener_dominios,
+    invalidar_dominios,
+    rango_dias_chile
+)
 from funciones_dashboard import (
     mostrar_metricas,
     mostrar_reporte,
@@ -14,11 +20,11 @@ from funciones_dashboard import (
     mostrar_registro_manual,
     mostrar_historial_manual,
     mostrar_registro_manual_vs_sensor,
-    mostrar_filtro_global
+    mostrar_filtro_global,
+    mostrar_diagnostico
 )
-
-# --- CREDENCIALES PARA BASE DE DATOS ---
-MONGO_URI = st.secrets["MONGO_URI"]
+from cache_dashboard import CacheIncremental, cache_lectura
+from en_vivo import seguir
 
 # --- UTILIDADES ---
 def obtener_hora_chile(dt_utc=None):
@@ -27,13 +33,50 @@ def obtener_hora_chile(dt_utc=None):
         return datetime.now(chile_tz)
     return dt_utc.replace(tzinfo=pytz.utc).astimezone(chile_tz)
 
+# Rango de fechas cargado por defecto y tope de filas por consulta
+DIAS_POR_DEFECTO = 7
+LIMITE_FILAS = 50000
+# Cada cuánto se redibujan las secciones en modo en vivo (solo la sección, no todo el script)
+INTERVALO_EN_VIVO_S = 5
+
 @st.cache_data(ttl=600)
-def cargar_datos_cacheados(dominio='dominio_ucn', limit=5000):
-    return obtener_datos(dominio, limit)
+def cargar_datos_cacheados(dominio='dominio_ucn', fecha_inicio=None, fecha_fin=None, dispositivos=None, limit=LIMITE_FILAS):
+    desde, hasta = rango_dias_chile(fecha_inicio, fecha_fin)
+    return obtener_dataframe(dominio, limit, desde=desde, hasta=hasta, dispositivos=dispositivos)
+
+# Lecturas recientes de cada dominio en memoria, compartidas entre sesiones: cada rerun
+# (autorefresh) solo pide a MongoDB las lecturas nuevas; el botón Actualizar recarga todo
+@st.cache_resource
+def obtener_cache_incremental():
+    return CacheIncremental()
+
+def cargar_datos(dominio, fecha_inicio, fecha_fin, dispositivos, limit=LIMITE_FILAS):
+    desde, hasta = rango_dias_chile(fecha_inicio, fecha_fin)
+    df = obtener_cache_incremental().consultar(dominio, desde, hasta, dispositivos, limit)
+    if df is None:
+        # Rango anterior a la ventana del caché incremental: consulta histórica
+        df = cargar_datos_cacheados(dominio, fecha_inicio, fecha_fin, dispositivos, limit)
+    return df
+
+@st.cache_data(ttl=600)
+def cargar_rango_fechas(dominio='dominio_ucn'):
+    primero, ultimo = obtener_rango_fechas(dominio)
+    if primero is None:
+        return None, None
+    return primero.date(), ultimo.date()
+
+@st.cache_data(ttl=600)
+def cargar_dispositivos(dominio='dominio_ucn'):
+    return obtener_dispositivos(dominio)
 
 # --- CONFIGURACIÓN GENERAL ---
 st.set_page_config(page_title="Dashboard Biorreactor", layout="wide")
-st_autorefresh(interval=900000, key="dashboardrefresh")
+
+# En modo en vivo las secciones se actualizan solas con las lecturas nuevas; si no, se
+# mantiene la recarga completa cada 15 minutos
+en_vivo = st.sidebar.toggle("🔴 En vivo", key="en_vivo", help="Actualiza métricas, gráficos y alimentación apenas llegan datos nuevos")
+if not en_vivo:
+    st_autorefresh(interval=900000, key="dashboardrefresh")
 
 # --- REGISTRO DE HORA DE ÚLTIMA ACTUALIZACIÓN ---
 if "ultima_actualizacion" not in st.session_state:
@@ -57,8 +100,8 @@ seccion = st.sidebar.radio("Selecciona una sección:", [
 ])
 
 # --- CONEXIÓN A LA BASE DE DATOS --- 
-client = MongoClient(MONGO_URI)
-db = client["biorreactor_app"]
+# Cliente compartido por todas las sesiones y reruns (ver database.obtener_cliente)
+db = obtener_db()
 
 # --- SECCIÓN: FILTROS DE DOMINIO Y FECHAS ---
 if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈 Gráficos", "✍️ Registro Manual", "📄 Historial Manual", "🆚 Comparación de Registros", "🖼️ Imágenes"]:
@@ -67,7 +110,7 @@ if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈
             col1, col2 = st.columns(2)
 
             with col1:
-                dominios_disponibles = sorted([col for col in db.list_collection_names() if col.startswith("dominio_")])
+                dominios_disponibles = obtener_dominios()
                 indice_por_defecto = dominios_disponibles.index("dominio_ucn") if "dominio_ucn" in dominios_disponibles else 0
                 
                 # Recuperar dominio guardado en session_state o mostrar por defecto
@@ -80,26 +123,21 @@ if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈
                 )
 
             with col2:
-                data = cargar_datos_cacheados(dominio_seleccionado)
-                if not data:
+                # Los límites del selector salen de la primera y última lectura, sin cargar datos
+                fecha_min, fecha_max = cargar_rango_fechas(dominio_seleccionado)
+                if fecha_min is None:
                     st.warning("⚠️ No hay datos disponibles.")
                     st.stop()
 
-                df = pd.DataFrame(data)
-                df = df[df['tiempo'].notna()]
-                df['tiempo'] = pd.to_datetime(df['tiempo'])
-                df = df.sort_values(by='tiempo')
-
-                fecha_min = df['tiempo'].min().date()
-                fecha_max = df['tiempo'].max().date()
-            
-                # Obtener valores guardados o usar por defecto
-                fecha_inicio_default = st.session_state.get("fecha_inicio", fecha_min)
+                # Obtener valores guardados o usar por defecto (últimos días con datos)
+                fecha_inicio_default = st.session_state.get("fecha_inicio", max(fecha_min, fecha_max - timedelta(days=DIAS_POR_DEFECTO)))
                 fecha_fin_default = st.session_state.get("fecha_fin", fecha_max)
+                fecha_inicio_default = min(max(fecha_inicio_default, fecha_min), fecha_max)
+                fecha_fin_default = min(max(fecha_fin_default, fecha_inicio_default), fecha_max)
 
                 fecha_inicio, fecha_fin = st.date_input(
                     "📅 Selecciona un rango de fechas:",
-                    value=(fecha_min, fecha_max),
+                    value=(fecha_inicio_default, fecha_fin_default),
                     min_value=fecha_min,
                     max_value=fecha_max
                 )
@@ -121,29 +159,36 @@ if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈
 
     # Si el usuario no ha enviado el formulario, tomar valores de session_state o usar por defecto
     dominio_seleccionado = st.session_state.get("dominio_seleccionado", dominios_disponibles[indice_por_defecto])
-    fecha_inicio = st.session_state.get("fecha_inicio", fecha_min)
-    fecha_fin = st.session_state.get("fecha_fin", fecha_max)
-
-    # Filtrar datos por fechas
-    df = df[(df['tiempo'].dt.date >= fecha_inicio) & (df['tiempo'].dt.date <= fecha_fin)]
-    if df.empty:
-        st.warning("⚠️ No hay datos dentro del rango de fechas seleccionado.")
-        st.stop()
+    fecha_inicio = st.session_state.get("fecha_inicio", fecha_inicio_default)
+    fecha_fin = st.session_state.get("fecha_fin", fecha_fin_default)
 
     # Mostrar filtro global y obtener los ids filtrados globalmente para usar en las secciones
-    ids_filtrados = mostrar_filtro_global(df, dominio_seleccionado)
-
-    # Luego filtrar el df para usar solo dispositivos seleccionados:
-    df = df[df["id_dispositivo"].isin(ids_filtrados)]
+    ids_filtrados = mostrar_filtro_global(cargar_dispositivos(dominio_seleccionado), dominio_seleccionado)
+    if not ids_filtrados:
+        st.warning("⚠️ No hay datos para los dispositivos seleccionados.")
+        st.stop()
 
+# Solo Gráficos necesita el historial en memoria; Métricas lee ultimo_estado y Reporte pagina en MongoDB
+if seccion == "📈 Gráficos":
+    # Las lecturas recientes salen del caché incremental; rangos más antiguos se filtran en MongoDB
+    # DataFrame ya tipado (tiempo con zona horaria de Chile, variables float64) y ordenado por tiempo
+    df = cargar_datos(dominio_seleccionado, fecha_inicio, fecha_fin, tuple(sorted(ids_filtrados)))
     if df.empty:
-        st.warning("⚠️ No hay datos para los dispositivos seleccionados.")
+        st.warning("⚠️ No hay datos dentro del rango de fechas seleccionado.")
         st.stop()
+    if len(df) >= LIMITE_FILAS:
+        st.warning(f"⚠️ El rango seleccionado supera {LIMITE_FILAS} registros: se muestran los más recientes.")
+
+    df = df[df['tiempo'].notna()]
 
 # --- BOTONES DE ACCIÓN ---
-# Botón para limpiar caché y actualizar datos
+# Botón para limpiar caché y actualizar datos: vuelve a cargar completa la ventana del dominio,
+# incluidas las lecturas reenviadas con atraso que el refresco incremental no alcanza a ver
 if st.sidebar.button("🔄 Actualizar datos"):
     st.cache_data.clear()
+    invalidar_dominios()
+    cache_lectura.invalidar()
+    obtener_cache_incremental().invalidar(st.session_state.get("dominio_seleccionado", "dominio_ucn"))
     st.session_state.ultima_actualizacion = obtener_hora_chile()
     st.rerun()
 
@@ -156,7 +201,7 @@ if st.sidebar.button("🧹 Resetear filtros"):
         "selectbox_graficos",
         "ids_filtrados",
         "multiselect_tabla",
-        "pagina_actual",
+        "reporte_filtros",
         f"ids_filtrados_{dominio_actual}",
         f"checkbox_todos_{dominio_actual}",
         f"checkbox_todos_widget_{dominio_actual}",
@@ -166,21 +211,55 @@ if st.sidebar.button("🧹 Resetear filtros"):
         st.session_state.pop(key, None)
     st.rerun()
 
+# --- MODO EN VIVO ---
+def hubo_cambios(seguidor):
+    # Compara la versión del seguidor de la colección (change stream o sondeo) con la última vista en esta sesión
+    version = seguidor.consultar()
+    clave = f"version_en_vivo_{seguidor.nombre}"
+    cambio = st.session_state.get(clave) != version
+    st.session_state[clave] = version
+    return cambio
+
+@st.fragment(run_every=INTERVALO_EN_VIVO_S)
+def mostrar_seccion_en_vivo(seccion, dominio, fecha_inicio, fecha_fin, dispositivos):
+    # Solo se vuelve a dibujar esta sección; a MongoDB se le piden únicamente las lecturas nuevas
+    if seccion == "🍽️ Alimentación":
+        if hubo_cambios(seguir("registro_comida")):
+            cache_lectura.invalidar("comida")
+        mostrar_registro_comida(dominio, ids_filtrados=list(dispositivos))
+        return
+
+    seguidor = seguir(dominio)
+    cambio = hubo_cambios(seguidor)
+    st.caption(f"🔴 En vivo · {obtener_hora_chile().strftime('%H:%M:%S')}")
+    if seccion == "📊 Métricas":
+        if cambio:
+            cache_lectura.invalidar("ultimo_estado")
+        mostrar_metricas(dominio, dispositivos)
+        return
+
+    if cambio:
+        obtener_cache_incremental().actualizar_hasta(dominio, seguidor.ultimo)
+    df_vivo = cargar_datos(dominio, fecha_inicio, fecha_fin, dispositivos)
+    mostrar_graficos(df_vivo[df_vivo['tiempo'].notna()], *rango_dias_chile(fecha_inicio, fecha_fin))
+
 # --- RENDERIZADO DE SECCIONES ---
-if seccion == "📊 Métricas":
-    mostrar_metricas(df)
+if en_vivo and seccion in ["📊 Métricas", "📈 Gráficos", "🍽️ Alimentación"]:
+    mostrar_seccion_en_vivo(seccion, dominio_seleccionado, fecha_inicio, fecha_fin, tuple(sorted(ids_filtrados)))
+
+elif seccion == "📊 Métricas":
+    mostrar_metricas(dominio_seleccionado, ids_filtrados)
 
 elif seccion == "📋 Reporte":
-    mostrar_reporte(df)
+    mostrar_reporte(dominio_seleccionado, fecha_inicio, fecha_fin, ids_filtrados)
 
 elif seccion == "🍽️ Alimentación":
     dominio_seleccionado = st.session_state.get("dominio_seleccionado", "dominio_ucn")
-    registros = obtener_registro_comida(limit=5000)
     ids_filtrados = st.session_state.get(f"ids_filtrados_{dominio_seleccionado}", [])
-    mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=ids_filtrados)
+    mostrar_registro_comida(dominio_seleccionado, ids_filtrados=ids_filtrados)
 
 elif seccion == "📈 Gráficos":
-    mostrar_graficos(df)
+    mostrar_graficos(df, *rango_dias_chile(fecha_inicio, fecha_fin))
 
 elif seccion == "🖼️ Imágenes":
     mostrar_imagenes(db)
@@ -197,3 +276,6 @@ elif seccion == "🆚 Comparación de Registros":
 # --- BOTÓN GRAFANA ---
 st.sidebar.markdown("---")
 st.sidebar.link_button("🔗 Ir al Dashboard de Grafana", "https://jeanmolina.grafana.net/public-dashboards/dd177b1f03f94db6ac6242f5586c796d")
+
+# --- DIAGNÓSTICO ---
+mostrar_diagnostico()
@@ -1,6 +1,47 @@
 from pymongo import MongoClient
 import os
+import threading
+import numpy as np
+import pandas as pd
 import pytz
+from datetime import datetime, time, timedelta
+from itertools import islice
+from app import analitica
+from app.archivo import (
+    agregados_con_archivo, con_archivo, contar_archivo, frontera, hasta_archivo, leer_archivo, particiones
+)
+from app.agregaciones import construir_filtro, pipeline_agregados, rango_lttb, series_lttb, VARIABLES
+from app.esquema import VARIABLES_ESQUEMA, proyeccion_variables, valor_variable
+from app.colecciones import registro_dominios
+from app.comida import COLECCION_COMIDA, consulta_comida, pipeline_ultima_comida
+from app.conexiones import MonitorPool, opciones_pool
+from app.paginacion import filtro_keyset, orden_keyset
+from app.rollups import GRANULARIDADES, agregados_rollup, estado_rollup, leer_rollup
+from app.ultimo_estado import leer_ultimo_estado, reconstruir_ultimo_estado, sin_estado
+
+# --- CONEXIÓN COMPARTIDA ---
+# Un único MongoClient por proceso: cada cliente nuevo cuesta un handshake TLS y el
+# descubrimiento del servidor, mientras que el cliente compartido reutiliza su pool
+_cliente = None
+_lock_cliente = threading.Lock()
+monitor_pool = MonitorPool()
+
+def obtener_cliente():
+    global _cliente
+    if _cliente is None:
+        with _lock_cliente:
+            if _cliente is None:
+                mongo_uri = os.environ.get("MONGO_URI")
+                if not mongo_uri:
+                    raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+                _cliente = MongoClient(mongo_uri, event_listeners=[monitor_pool], **opciones_pool())
+    return _cliente
+
+def obtener_db():
+    return obtener_cliente()["biorreactor_app"]
+
+def estadisticas_conexiones():
+    return monitor_pool.resumen()
 
 # Conversión centralizada a horario chileno
 def convertir_a_chile(fecha_utc):
@@ -11,38 +52,151 @@ def convertir_a_chile(fecha_utc):
         fecha_utc = fecha_utc.replace(tzinfo=pytz.utc)
     return fecha_utc.astimezone(chile_tz)
 
-def obtener_datos(dominio='dominio_ucn', limit=5000):
-    mongo_uri = os.environ.get("MONGO_URI")
-    if not mongo_uri:
-        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
-    
-    client = MongoClient(mongo_uri)
-    db = client["biorreactor_app"]
+# Las fechas se guardan en UTC sin zona horaria
+def a_utc(fecha):
+    if fecha is None or fecha.tzinfo is None:
+        return fecha
+    return fecha.astimezone(pytz.utc).replace(tzinfo=None)
+
+# Rango [desde, hasta) en UTC que cubre días completos en hora de Chile
+def rango_dias_chile(fecha_inicio=None, fecha_fin=None):
+    chile_tz = pytz.timezone("America/Santiago")
+    desde = hasta = None
+    if fecha_inicio:
+        desde = a_utc(chile_tz.localize(datetime.combine(fecha_inicio, time.min)))
+    if fecha_fin:
+        hasta = a_utc(chile_tz.localize(datetime.combine(fecha_fin + timedelta(days=1), time.min)))
+    return desde, hasta
+
+# Campos que usan el dashboard y la API (evita traer campos extra de cada documento)
+PROYECCION_DATOS = {'_id': 0, 'tiempo': 1, 'id_dispositivo': 1, **proyeccion_variables(VARIABLES)}
+
+def obtener_dominios():
+    # Lista cacheada de colecciones dominio_* (ver app.colecciones.RegistroDominios)
+    return registro_dominios.listar(obtener_db())
+
+def invalidar_dominios():
+    registro_dominios.invalidar()
+
+def obtener_rango_fechas(dominio='dominio_ucn'):
+    # Primera y última lectura usando el índice de tiempo (dos documentos, no la colección)
+    collection = obtener_db()[dominio]
+    primero = collection.find_one({}, {'_id': 0, 'tiempo': 1}, sort=[("tiempo", 1)])
+    ultimo = collection.find_one({}, {'_id': 0, 'tiempo': 1}, sort=[("tiempo", -1)])
+    if not primero or not ultimo:
+        return None, None
+    return convertir_a_chile(primero.get("tiempo")), convertir_a_chile(ultimo.get("tiempo"))
+
+def obtener_dispositivos(dominio='dominio_ucn'):
+    dispositivos = obtener_db()[dominio].distinct("id_dispositivo")
+    return sorted(d for d in dispositivos if d)
+
+def obtener_datos(dominio='dominio_ucn', limit=5000, desde=None, hasta=None, dispositivos=None):
+    db = obtener_db()
     collection = db[dominio]
-    cursor = collection.find().sort("tiempo", -1).limit(limit)
+    filtro = construir_filtro(dispositivos, a_utc(desde), a_utc(hasta))
+    cursor = collection.find(filtro, PROYECCION_DATOS).sort("tiempo", -1).limit(limit)
     datos = []
     for doc in cursor:
         tiempo_chile = convertir_a_chile(doc.get("tiempo"))
         datos.append({
             'tiempo': tiempo_chile.strftime('%Y-%m-%d %H:%M:%S'),
             'id_dispositivo': doc.get('id_dispositivo'),
-            'temperatura': doc.get('temperatura'),
-            'ph': doc.get('ph'),
-            'oxigeno': doc.get('oxigeno'),
-            'turbidez': doc.get('turbidez'),
-            'conductividad': doc.get('conductividad')
+            'temperatura': valor_variable(doc, 'temperatura'),
+            'ph': valor_variable(doc, 'ph'),
+            'oxigeno': valor_variable(doc, 'oxigeno'),
+            'turbidez': valor_variable(doc, 'turbidez'),
+            'conductividad': valor_variable(doc, 'conductividad')
         })
 
-    client.close()
     return list(reversed(datos))
 
+# Documentos por viaje al armar DataFrames grandes
+TAMANO_LOTE_DATAFRAME = 10000
+
+def _columna_numerica(valores):
+    # Camino rápido: números y None pasan directo a float64 (None -> NaN); si hay textos
+    # no numéricos se convierten uno a uno y quedan como NaN
+    try:
+        return np.array(valores, dtype="float64")
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(valores, dtype=object), errors="coerce").to_numpy(dtype="float64")
+
+def dataframe_lecturas(cursor, variables=VARIABLES):
+    # Arma el DataFrame por columnas: tiempo como datetime64 con zona horaria de Chile
+    # (una sola conversión vectorizada) y cada variable como float64
+    docs = list(cursor)
+    tiempo = pd.to_datetime(pd.Series([doc.get("tiempo") for doc in docs], dtype=object), utc=True, errors="coerce")
+    df = pd.DataFrame({
+        "tiempo": tiempo.dt.tz_convert("America/Santiago"),
+        "id_dispositivo": [doc.get("id_dispositivo") for doc in docs]
+    })
+    for var in variables:
+        corto = VARIABLES_ESQUEMA[var].corto
+        if corto == var:
+            valores = [doc.get(var) for doc in docs]
+        else:
+            valores = [doc.get(var, doc.get(corto)) for doc in docs]
+        df[var] = _columna_numerica(valores)
+    return df
+
+def dataframe_archivo(dominio, desde=None, hasta=None, dispositivos=None, limit=0):
+    # Las `limit` lecturas archivadas más recientes del rango (0: todas), con los mismos tipos
+    # que dataframe_lecturas; None si no hay archivo para ese rango
+    tabla = leer_archivo(dominio, dispositivos, desde, hasta, columnas=["tiempo", "id_dispositivo"] + VARIABLES)
+    if tabla is None or tabla.num_rows == 0:
+        return None
+    tabla = tabla.sort_by("tiempo")
+    if limit:
+        tabla = tabla.slice(max(tabla.num_rows - limit, 0))
+    df = tabla.to_pandas()
+    df["tiempo"] = df["tiempo"].dt.tz_convert("America/Santiago").astype("datetime64[ns, America/Santiago]")
+    return df
+
+def obtener_dataframe(dominio='dominio_ucn', limit=5000, desde=None, hasta=None, dispositivos=None):
+    # Igual que obtener_datos (las lecturas más recientes, en orden ascendente), pero tipado.
+    # Si MongoDB no alcanza a completar el límite (limit=0: sin límite), se agregan las lecturas
+    # anteriores del archivo Parquet (ver archivador.py); rangos recientes no abren ningún archivo
+    collection = obtener_db()[dominio]
+    desde, hasta = a_utc(desde), a_utc(hasta)
+    filtro = construir_filtro(dispositivos, desde, hasta)
+    cursor = collection.find(filtro, PROYECCION_DATOS).sort("tiempo", -1).limit(limit).batch_size(TAMANO_LOTE_DATAFRAME)
+    df = dataframe_lecturas(cursor).iloc[::-1].reset_index(drop=True)
+    if (limit and len(df) >= limit) or not particiones(dominio, dispositivos, desde, hasta):
+        return df
+
+    hasta_arch = hasta_archivo(hasta, frontera(collection, filtro))
+    archivadas = dataframe_archivo(dominio, desde, hasta_arch, dispositivos, limit)
+    if archivadas is None:
+        return df
+    # Los registros manuales siguen en MongoDB aunque sean anteriores a la frontera, así que
+    # las dos partes se intercalan antes de recortar al límite
+    df = pd.concat([archivadas, df], ignore_index=True).sort_values("tiempo", kind="stable")
+    return df.iloc[-limit:].reset_index(drop=True) if limit else df.reset_index(drop=True)
+
+def obtener_pagina_lecturas(dominio='dominio_ucn', desde=None, hasta=None, dispositivos=None, limit=250, cursor=None):
+    # Una página de lecturas (más recientes primero) por keyset sobre (tiempo, _id) y el cursor
+    # de la siguiente, o None si es la última
+    collection = obtener_db()[dominio]
+    desde, hasta = a_utc(desde), a_utc(hasta)
+    filtro = filtro_keyset(construir_filtro(dispositivos, desde, hasta), cursor, -1)
+    proyeccion = {**PROYECCION_DATOS, '_id': 1}
+    lecturas = collection.find(filtro, proyeccion).sort(orden_keyset(-1)).limit(limit)
+    docs = list(islice(con_archivo(collection, dominio, lecturas, dispositivos, desde, hasta, cursor, -1), limit))
+    siguiente = (docs[-1]["tiempo"], docs[-1]["_id"]) if len(docs) == limit else None
+    return dataframe_lecturas(docs), siguiente
+
+def contar_lecturas(dominio='dominio_ucn', desde=None, hasta=None, dispositivos=None):
+    collection = obtener_db()[dominio]
+    desde, hasta = a_utc(desde), a_utc(hasta)
+    filtro = construir_filtro(dispositivos, desde, hasta)
+    total = collection.count_documents(filtro)
+    if particiones(dominio, dispositivos, desde, hasta):
+        total += contar_archivo(dominio, dispositivos, desde, hasta_archivo(hasta, frontera(collection, filtro)))
+    return total
+
 def obtener_registro_comida(limit=5000):
-    mongo_uri = os.environ.get("MONGO_URI")
-    if not mongo_uri:
-        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
-    
-    client = MongoClient(mongo_uri)
-    db = client["biorreactor_app"]
+    db = obtener_db()
     collection = db["registro_comida"]
     cursor = collection.find().sort("tiempo", -1).limit(limit)
     
@@ -55,5 +209,122 @@ def obtener_registro_comida(limit=5000):
             'id_dispositivo': id_dispositivo
         })
 
-    client.close()
     return list(reversed(registros))
+
+def obtener_ultima_comida(dispositivos=None):
+    # {id_dispositivo: última alimentación en hora de Chile}, calculado en MongoDB
+    cursor = obtener_db()[COLECCION_COMIDA].aggregate(pipeline_ultima_comida(dispositivos))
+    return {doc["_id"]: convertir_a_chile(doc.get("tiempo")) for doc in cursor}
+
+def obtener_historial_comida(dispositivos=None, limit=50, cursor=None):
+    # Una página del historial (más recientes primero) y el cursor de la siguiente, o None
+    filtro, orden = consulta_comida(dispositivos, cursor=cursor)
+    docs = list(obtener_db()[COLECCION_COMIDA].find(filtro).sort(orden).limit(limit))
+    registros = []
+    for doc in docs:
+        tiempo = convertir_a_chile(doc.get("tiempo"))
+        registros.append({
+            'tiempo': tiempo.strftime('%Y-%m-%d %H:%M:%S') if tiempo else "Sin tiempo",
+            'id_dispositivo': doc.get("id_dispositivo", "Desconocido")
+        })
+    siguiente = (docs[-1]["tiempo"], docs[-1]["_id"]) if len(docs) == limit else None
+    return registros, siguiente
+
+def obtener_agregados(dominio='dominio_ucn', intervalo='1h', desde=None, hasta=None, dispositivos=None, max_puntos=None, variables=VARIABLES):
+    db = obtener_db()
+    collection = db[dominio]
+    filtro = construir_filtro(dispositivos, a_utc(desde), a_utc(hasta))
+
+    filas = []
+    if max_puntos:
+        # Modo LTTB: una fila por punto conservado (tiempo, id_dispositivo, variable, valor); sin
+        # desde, los últimos 30 días como en /api/agregados
+        desde_lttb, hasta_lttb = rango_lttb(a_utc(desde), a_utc(hasta))
+        proyeccion = {'tiempo': 1, 'id_dispositivo': 1, **proyeccion_variables(variables)}
+        filtro = construir_filtro(dispositivos, desde_lttb, hasta_lttb)
+        cursor = collection.find(filtro, proyeccion).sort(orden_keyset(1)).batch_size(5000)
+        cursor = con_archivo(collection, dominio, cursor, dispositivos, desde_lttb, hasta_lttb)
+        for disp, series_disp in series_lttb(cursor, max_puntos, variables).items():
+            for var, puntos in series_disp.items():
+                for tiempo, valor in puntos:
+                    filas.append({
+                        'tiempo': convertir_a_chile(tiempo).strftime('%Y-%m-%d %H:%M:%S'),
+                        'id_dispositivo': disp,
+                        'variable': var,
+                        'valor': valor
+                    })
+    else:
+        # Un bucket por dispositivo e intervalo, con columnas <variable>_min/_media/_max/_n.
+        # Por hora y por día se leen de los rollups cuando ya existen para el dominio (los buckets
+        # posteriores a la última pasada del worker, de las lecturas)
+        granularidad = {v: k for k, v in GRANULARIDADES.items()}.get(intervalo)
+        estado = estado_rollup(db, dominio, granularidad) if granularidad else None
+        if estado:
+            cursor = agregados_rollup(db, dominio, granularidad, estado, dispositivos, a_utc(desde), a_utc(hasta), variables)
+        else:
+            cursor = collection.aggregate(pipeline_agregados(filtro, intervalo, variables), allowDiskUse=True)
+            cursor = agregados_con_archivo(
+                collection, dominio, cursor, intervalo, dispositivos, a_utc(desde), a_utc(hasta), variables, agregar=analitica.agregados_archivo
+            )
+        filas = [_fila_agregada(doc, variables) for doc in cursor]
+
+    return filas
+
+def _fila_agregada(doc, variables=VARIABLES):
+    fila = {
+        'tiempo': convertir_a_chile(doc['tiempo']).strftime('%Y-%m-%d %H:%M:%S'),
+        'id_dispositivo': doc['id_dispositivo'],
+        'n': doc['n']
+    }
+    if 'manual' in doc:
+        fila['manual'] = doc['manual']
+    for var in variables:
+        for medida, valor in doc.get(var, {}).items():
+            fila[f'{var}_{medida}'] = valor
+    return fila
+
+def rollups_listos(dominio='dominio_ucn', granularidad='dia'):
+    # False mientras worker_rollups.py no procesa el dominio por primera vez
+    return estado_rollup(obtener_db(), dominio, granularidad) is not None
+
+def obtener_rollup(dominio='dominio_ucn', granularidad='dia', dispositivos=None, desde=None, hasta=None, manual=None):
+    # Filas de los rollups por hora/día; registros manuales incluyen <variable>_primero. Los
+    # calcula worker_rollups.py, nunca la consulta del dashboard
+    db = obtener_db()
+    cursor = leer_rollup(db, dominio, granularidad, dispositivos, a_utc(desde), a_utc(hasta), manual)
+    return [_fila_agregada(doc) for doc in cursor]
+
+def obtener_ultimo_estado(dominio='dominio_ucn', dispositivos=None):
+    # Última lectura de sensor por dispositivo (colección ultimo_estado), con tiempo en hora de Chile
+    db = obtener_db()
+    estados = leer_ultimo_estado(db, dominio, dispositivos)
+    if not estados and sin_estado(db, dominio):
+        # Dominio con lecturas anteriores a ultimo_estado
+        reconstruir_ultimo_estado(db, dominio)
+        estados = leer_ultimo_estado(db, dominio, dispositivos)
+    for estado in estados:
+        estado["tiempo"] = convertir_a_chile(estado.get("tiempo"))
+    return estados
+
+# --- MOTOR ANALÍTICO (DuckDB, opcional) ---
+# Deriva y manual vs sensor parten de los rollups diarios: MongoDB ya resume cada día (también
+# los que se archivaron, que no se borran sin rollups al día) y DuckDB solo cruza esos buckets
+def _filas_analitica(df, columna_tiempo='tiempo'):
+    # Mismo formato que _fila_agregada: tiempo como texto en hora de Chile y None en vez de NaN
+    df[columna_tiempo] = df[columna_tiempo].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def _buckets_diarios(dominio, desde, hasta, dispositivos, variables, manual=None):
+    if not analitica.disponible():
+        raise RuntimeError("❌ Esta consulta requiere el motor analítico (pip install duckdb)")
+    return list(leer_rollup(obtener_db(), dominio, 'dia', dispositivos, a_utc(desde), a_utc(hasta), manual, variables=variables))
+
+def obtener_deriva(dominio='dominio_ucn', desde=None, hasta=None, dispositivos=None, ventana_dias=7, variables=VARIABLES):
+    # Promedio diario por dispositivo, media móvil y deriva respecto al primer día (requiere duckdb)
+    docs = _buckets_diarios(dominio, desde, hasta, dispositivos, variables, manual=False)
+    return _filas_analitica(analitica.deriva(docs, ventana_dias, variables), 'dia')
+
+def obtener_manual_vs_sensor(dominio='dominio_ucn', desde=None, hasta=None, dispositivos=None, variables=VARIABLES):
+    # Registro manual contra promedio diario de sensores por dispositivo y día (requiere duckdb)
+    docs = _buckets_diarios(dominio, desde, hasta, dispositivos, variables)
+    return _filas_analitica(analitica.manual_vs_sensor(docs, variables), 'dia')
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from datetime import datetime
+from pymongo.errors import PyMongoError
+from database import obtener_db
+
+# Cada cuánto se consulta tiempo > marca cuando no hay change streams (mongod sin replica set
+# o colecciones time-series), y tras cuánto tiempo sin sesiones que lo consulten se detiene un seguidor
+SONDEO_S = float(os.environ.get("EN_VIVO_SONDEO_S", 5))
+INACTIVIDAD_S = float(os.environ.get("EN_VIVO_INACTIVIDAD_S", 600))
+# Espera máxima de cada lectura del change stream (permite revisar la inactividad)
+ESPERA_STREAM_MS = 1000
+
+# Sigue las inserciones de una colección y solo anota que hubo cambios: version sube con cada
+# lote de inserciones y ultimo es el mayor tiempo visto. Las sesiones del dashboard comparan la
+# versión y, si cambió, piden solo las lecturas nuevas (cache_dashboard.CacheIncremental)
+class SeguidorColeccion(threading.Thread):
+    def __init__(self, nombre, sondeo_s=SONDEO_S, inactividad_s=INACTIVIDAD_S):
+        super().__init__(name=f"en-vivo-{nombre}", daemon=True)
+        self.nombre = nombre
+        self.sondeo_s = sondeo_s
+        self.inactividad_s = inactividad_s
+        self.lock = threading.Lock()
+        self.version = 0
+        self.ultimo = datetime.utcnow()
+        self.modo = "iniciando"
+        self.usado = time.monotonic()
+        self.detenido = threading.Event()
+
+    def consultar(self):
+        # Versión actual (cada consulta mantiene vivo al seguidor)
+        with self.lock:
+            self.usado = time.monotonic()
+            return self.version
+
+    def _registrar(self, tiempos):
+        with self.lock:
+            self.version += 1
+            tiempos = [t for t in tiempos if isinstance(t, datetime)]
+            if tiempos:
+                self.ultimo = max(self.ultimo, max(tiempos))
+
+    def _inactivo(self):
+        with self.lock:
+            return time.monotonic() - self.usado > self.inactividad_s
+
+    def _seguir_stream(self, collection):
+        token = None
+        while not self.detenido.is_set() and not self._inactivo():
+            with collection.watch(
+                [{"$match": {"operationType": "insert"}}],
+                resume_after=token,
+                max_await_time_ms=ESPERA_STREAM_MS
+            ) as stream:
+                self.modo = "change_stream"
+                while stream.alive and not self.detenido.is_set() and not self._inactivo():
+                    # Se juntan todas las inserciones disponibles en un solo aviso
+                    tiempos = []
+                    cambio = stream.try_next()
+                    while cambio is not None:
+                        tiempos.append(cambio["fullDocument"].get("tiempo"))
+                        cambio = stream.try_next() if len(tiempos) < 1000 else None
+                    if tiempos:
+                        self._registrar(tiempos)
+                    token = stream.resume_token
+
+    def _sondear(self, collection):
+        self.modo = "sondeo"
+        while not self.detenido.wait(self.sondeo_s) and not self._inactivo():
+            try:
+                doc = collection.find_one({"tiempo": {"$gt": self.ultimo}}, {"tiempo": 1}, sort=[("tiempo", -1)])
+            except PyMongoError as e:
+                print(f"⚠️ Error al consultar {self.nombre} en modo en vivo: {e}")
+                continue
+            if doc:
+                self._registrar([doc["tiempo"]])
+
+    def run(self):
+        collection = obtener_db()[self.nombre]
+        try:
+            self._seguir_stream(collection)
+        except PyMongoError as e:
+            # Sin replica set (o colección time-series) no hay change streams
+            print(f"ℹ️ Change streams no disponibles para {self.nombre}, se usa sondeo por tiempo: {e}")
+            self._sondear(collection)
+        finally:
+            self.modo = "detenido"
+            _quitar(self)
+
+    def detener(self):
+        self.detenido.set()
+
+_seguidores = {}
+_lock_seguidores = threading.Lock()
+
+def _quitar(seguidor):
+    with _lock_seguidores:
+        if _seguidores.get(seguidor.nombre) is seguidor:
+            del _seguidores[seguidor.nombre]
+
+def seguir(nombre):
+    # Un seguidor por colección y proceso, compartido por todas las sesiones
+    with _lock_seguidores:
+        seguidor = _seguidores.get(nombre)
+        if seguidor is None or not seguidor.is_alive():
+            seguidor = SeguidorColeccion(nombre)
+            _seguidores[nombre] = seguidor
+            seguidor.start()
+        return seguidor
+
+def resumen_seguidores():
+    with _lock_seguidores:
+        seguidores = list(_seguidores.values())
+    return {s.nombre: {"modo": s.modo, "version": s.version, "ultimo": s.ultimo.isoformat()} for s in seguidores}
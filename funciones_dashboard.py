@@ -2,15 +2,27 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import requests
-from pymongo import MongoClient
 from datetime import datetime
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-import base64
 from io import BytesIO
-
-# --- CREDENCIALES PARA BASE DE DATOS ---
-MONGO_URI = st.secrets["MONGO_URI"]
+from urllib.parse import urlencode
+from bson import ObjectId
+from app import analitica
+from app.agregaciones import reducir_lttb
+from app.esquema import expandir
+from database import (
+    obtener_db, obtener_rollup, obtener_manual_vs_sensor, rollups_listos, obtener_dispositivos, obtener_historial_comida, obtener_ultima_comida,
+    obtener_ultimo_estado, obtener_pagina_lecturas, contar_lecturas, rango_dias_chile,
+    estadisticas_conexiones
+)
+from almacen_imagenes import leer_imagen
+from cache_dashboard import cache_lectura
+from en_vivo import resumen_seguidores
+
+# Puntos máximos por traza en los gráficos (se reducen con LTTB)
+MAX_PUNTOS_GRAFICO = 1000
 
 # --- UTILIDADES ---
 def parsear_decimal(valor_str, nombre_campo):
@@ -23,9 +35,68 @@ def parsear_decimal(valor_str, nombre_campo):
         st.error(f"❌ El valor ingresado en '{nombre_campo}' no es válido.")
         st.stop()
 
+def reducir_serie(df, var, max_puntos=MAX_PUNTOS_GRAFICO):
+    # Plotly no necesita miles de puntos por traza: se conservan los que mantienen la forma
+    serie = df[["tiempo", var]].copy()
+    serie[var] = pd.to_numeric(serie[var], errors="coerce")
+    serie = serie.dropna()
+    if len(serie) <= max_puntos:
+        return serie
+    indices = reducir_lttb(serie["tiempo"].astype("int64").tolist(), serie[var].tolist(), max_puntos)
+    return serie.iloc[indices]
+
+# --- EXPORTACIÓN ---
+# Las descargas enlazan a /api/exportar, que transmite el historial completo desde MongoDB:
+# el archivo solo se genera cuando alguien lo pide, sin el tope de filas cargadas en el dashboard
+URL_API = "https://biorreactor-app-api.onrender.com"
+
+def url_exportar(dominio, formato="csv", dispositivos=None, desde=None, hasta=None, manual=None):
+    # desde/hasta en UTC sin zona (como rango_dias_chile)
+    params = {"dominio": dominio, "formato": formato}
+    if dispositivos:
+        params["id_dispositivo"] = ",".join(dispositivos)
+    if desde:
+        params["desde"] = desde.isoformat()
+    if hasta:
+        params["hasta"] = hasta.isoformat()
+    if manual is not None:
+        params["manual"] = "1" if manual else "0"
+    return f"{URL_API}/api/exportar?{urlencode(params)}"
+
+def botones_exportar(etiqueta, **filtros):
+    col1, col2 = st.columns(2)
+    col1.link_button(f"{etiqueta} (CSV)", url_exportar(formato="csv", **filtros), use_container_width=True)
+    col2.link_button(f"{etiqueta} (Parquet)", url_exportar(formato="parquet", **filtros), use_container_width=True)
+
+# --- LECTURAS COMPARTIDAS ---
+# Consultas que todas las sesiones repiten en cada rerun; pasan por el caché de lectura del
+# proceso (cache_dashboard.cache_lectura), que se invalida al registrar alimentación o datos manuales
+@cache_lectura.cacheado("comida")
+def cargar_ultima_comida(dispositivos):
+    return obtener_ultima_comida(dispositivos)
+
+@cache_lectura.cacheado("comida")
+def cargar_historial_comida(dispositivos, limit, cursor=None):
+    return obtener_historial_comida(dispositivos, limit, cursor)
+
+@cache_lectura.cacheado("dispositivos")
+def cargar_dispositivos_dominio(dominio):
+    return obtener_dispositivos(dominio)
+
+@cache_lectura.cacheado("manual")
+def cargar_registros_manuales(dominio, dispositivo=None, limit=500):
+    filtro = {"manual": True}
+    if dispositivo:
+        filtro["id_dispositivo"] = dispositivo
+    return [expandir(doc) for doc in obtener_db()[dominio].find(filtro).sort("tiempo", -1).limit(limit)]
+
+@cache_lectura.cacheado("ultimo_estado")
+def cargar_ultimo_estado(dominio, dispositivos=None):
+    return obtener_ultimo_estado(dominio, dispositivos)
+
 # --- FILTRO GLOBAL DE DISPOSITIVOS ---
-def mostrar_filtro_global(df, dominio_actual):
-    dispositivos = sorted(df["id_dispositivo"].dropna().unique())
+def mostrar_filtro_global(dispositivos, dominio_actual):
+    dispositivos = sorted(dispositivos)
     clave_ids = f"ids_filtrados_{dominio_actual}"
     clave_checkbox = f"checkbox_todos_{dominio_actual}"
 
@@ -70,129 +141,135 @@ def mostrar_filtro_global(df, dominio_actual):
     return st.session_state[clave_ids]
 
 # --- MÉTRICAS ---
-def mostrar_metricas(df):
+def _valor_metrica(valor, unidad=""):
+    if valor is None:
+        return "—"
+    return f"{valor:.2f}{unidad}"
+
+def mostrar_metricas(dominio_actual, ids_filtrados):
     st.markdown("### 📊 Últimos Valores por Dispositivo")
 
-    if "id_dispositivo" not in df.columns:
-        st.warning("⚠️ No se encontraron IDs de dispositivos en los datos.")
+    # Una consulta a ultimo_estado (un documento por dispositivo), sin cargar el historial
+    estados = cargar_ultimo_estado(dominio_actual, tuple(sorted(ids_filtrados)))
+    if not estados:
+        st.warning("⚠️ No hay lecturas de sensores para los dispositivos seleccionados.")
         return
 
-    dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_ucn")
-    clave_estado_ids = f"ids_filtrados_{dominio_actual}"
-    # Obtener lista original ordenada alfabéticamente
-    dispositivos_ordenados = sorted(df["id_dispositivo"].dropna().unique())
+    for estado in estados:
+        tiempo_str = estado["tiempo"].strftime('%Y-%m-%d %H:%M:%S') if estado.get("tiempo") else "Sin tiempo"
 
-    # Obtener ids filtrados o por defecto toda la lista ordenada
-    ids_filtrados = st.session_state.get(clave_estado_ids, dispositivos_ordenados)
+        st.markdown(f"**🔎 Dispositivo:** `{estado['id_dispositivo']}`  \n🕒 Última medición: `{tiempo_str}`")
 
-    # Ordenar ids_filtrados manteniendo el orden alfabético original
-    ids_filtrados_ordenados = [d for d in dispositivos_ordenados if d in ids_filtrados]
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("🌡️ Temperatura", _valor_metrica(estado.get('temperatura'), " °C"))
+        col2.metric("🌊 pH", _valor_metrica(estado.get('ph')))
+        col3.metric("🧪 Turbidez", _valor_metrica(estado.get('turbidez'), " %"))
+        col4.metric("🫁 Oxígeno", _valor_metrica(estado.get('oxigeno'), " %"))
+        col5.metric("⚡ Conductividad", _valor_metrica(estado.get('conductividad'), " ppm"))
 
-    df_filtrado = df[df["id_dispositivo"].isin(ids_filtrados_ordenados)]
-    chile_tz = pytz.timezone("America/Santiago")
+        st.markdown("---")
 
-    for disp in ids_filtrados_ordenados:
-        df_disp = df_filtrado[df_filtrado["id_dispositivo"] == disp].sort_values(by="tiempo", ascending=False)
-        if df_disp.empty:
-            continue
+# --- REPORTE DE SENSORES ---
+# El reporte se pagina en MongoDB (keyset sobre tiempo, _id): cada página es una consulta de
+# FILAS_POR_PAGINA lecturas y la siguiente se pide en segundo plano mientras se muestra la actual
+FILAS_POR_PAGINA = 250
+_precarga = ThreadPoolExecutor(max_workers=2, thread_name_prefix="precarga-reporte")
 
-        ultima_fecha = df_disp["tiempo"].iloc[0]
-        if ultima_fecha.tzinfo is None:
-            ultima_fecha = chile_tz.localize(ultima_fecha)
-        else:
-            ultima_fecha = ultima_fecha.astimezone(chile_tz)
-        tiempo_str = ultima_fecha.strftime('%Y-%m-%d %H:%M:%S')
+@cache_lectura.cacheado("reporte")
+def cargar_pagina_reporte(dominio, desde, hasta, dispositivos, cursor=None):
+    return obtener_pagina_lecturas(dominio, desde, hasta, dispositivos, FILAS_POR_PAGINA, cursor)
 
-        st.markdown(f"**🔎 Dispositivo:** `{disp}`  \n🕒 Última medición: `{tiempo_str}`")
+@cache_lectura.cacheado("conteo")
+def contar_reporte(dominio, desde, hasta, dispositivos):
+    return contar_lecturas(dominio, desde, hasta, dispositivos)
 
-        col1, col2, col3, col4, col5 = st.columns(5)
-        col1.metric("🌡️ Temperatura", f"{df_disp['temperatura'].iloc[0]:.2f} °C")
-        col2.metric("🌊 pH", f"{df_disp['ph'].iloc[0]:.2f}")
-        col3.metric("🧪 Turbidez", f"{df_disp['turbidez'].iloc[0]:.2f} %")
-        col4.metric("🫁 Oxígeno", f"{df_disp['oxigeno'].iloc[0]:.2f} %")
-        col5.metric("⚡ Conductividad", f"{df_disp['conductividad'].iloc[0]:.2f} ppm")
+def mostrar_reporte(dominio_actual, fecha_inicio, fecha_fin, ids_filtrados):
+    st.subheader("📋 Reporte de Sensores")
 
-        st.markdown("---")
+    desde, hasta = rango_dias_chile(fecha_inicio, fecha_fin)
+    dispositivos = tuple(sorted(ids_filtrados))
+    filtros = (dominio_actual, desde, hasta, dispositivos)
 
-# --- REPORTE DE SENSORES ---
-def mostrar_reporte(df):
-    st.subheader("📋 Reporte de Sensores")
+    # Pila de cursores de las páginas visitadas; se reinicia al cambiar los filtros
+    if st.session_state.get("reporte_filtros") != filtros:
+        st.session_state.reporte_filtros = filtros
+        st.session_state.reporte_cursores = [None]
+    cursores = st.session_state.reporte_cursores
 
-    if "id_dispositivo" in df.columns:
-        dispositivos = sorted(df["id_dispositivo"].dropna().unique())
-
-        # Obtener dominio actual desde session_state
-        dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_ucn")
-        clave_estado_ids = f"ids_filtrados_{dominio_actual}"
-
-        ids_filtrados = st.session_state.get(clave_estado_ids, dispositivos)
-        df_filtrado = df[df["id_dispositivo"].isin(ids_filtrados)]
-    else:
-        df_filtrado = df
-
-    # Botón de descarga para todos los datos filtrados (sin paginar)
-    if not df_filtrado.empty:
-        csv_data = df_filtrado.to_csv(index=False).encode('utf-8')
-        ids_str = "_".join(st.session_state.get(clave_estado_ids, []))
-        nombre_archivo = f"datos_{ids_str}.csv"
-        st.download_button(
-            label="📥 Descargar datos filtrados de los dispositivos",
-            data=csv_data,
-            file_name=nombre_archivo,
-            mime="text/csv"
-        )
+    total_filas = contar_reporte(*filtros)
+    paginas_totales = max((total_filas - 1) // FILAS_POR_PAGINA + 1, 1)
 
-    # Paginación
-    filas_por_pagina = 250
-    total_filas = len(df_filtrado)
-    paginas_totales = max((total_filas - 1) // filas_por_pagina + 1, 1)
+    # Descarga de todos los datos filtrados (sin paginar)
+    if total_filas:
+        botones_exportar(
+            "📥 Descargar datos filtrados de los dispositivos",
+            dominio=dominio_actual, dispositivos=dispositivos, desde=desde, hasta=hasta
+        )
 
-    if "pagina_actual" not in st.session_state:
-        st.session_state.pagina_actual = 0
+    df_pagina, siguiente = cargar_pagina_reporte(*filtros, cursores[-1])
 
     col1, col2, col3 = st.columns([1, 2, 1])
 
     with col1:
-        if st.button("⬅️ Anterior") and st.session_state.pagina_actual > 0:
-            st.session_state.pagina_actual -= 1
+        if st.button("⬅️ Anterior") and len(cursores) > 1:
+            cursores.pop()
+            df_pagina, siguiente = cargar_pagina_reporte(*filtros, cursores[-1])
     with col3:
-        if st.button("Siguiente ➡️") and st.session_state.pagina_actual < paginas_totales - 1:
-            st.session_state.pagina_actual += 1
+        if st.button("Siguiente ➡️") and siguiente is not None:
+            cursores.append(siguiente)
+            df_pagina, siguiente = cargar_pagina_reporte(*filtros, cursores[-1])
     with col2:
-        st.markdown(f"<div style='text-align: center; font-weight: bold;'>Página {st.session_state.pagina_actual + 1} de {paginas_totales}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div style='text-align: center; font-weight: bold;'>Página {len(cursores)} de {paginas_totales}</div>", unsafe_allow_html=True)
+
+    # Precarga de la página siguiente (queda en el caché de lectura)
+    if siguiente is not None:
+        _precarga.submit(cargar_pagina_reporte, *filtros, siguiente)
 
-    inicio = st.session_state.pagina_actual * filas_por_pagina
-    fin = inicio + filas_por_pagina
-    df_pagina = df_filtrado[::-1].iloc[inicio:fin]
+    inicio = (len(cursores) - 1) * FILAS_POR_PAGINA
     st.dataframe(df_pagina, use_container_width=True)
-    st.caption(f"Mostrando registros {inicio + 1} a {min(fin, total_filas)} de {total_filas}")
+    st.caption(f"Mostrando registros {min(inicio + 1, total_filas)} a {inicio + len(df_pagina)} de {total_filas}")
 
 # --- REGISTRO DE ALIMENTACIÓN ---
-def mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=None):
+# Eventos por página en el historial de alimentación
+EVENTOS_POR_PAGINA = 50
+
+def mostrar_historial_comida(dominio_seleccionado, ids_filtrados):
+    # Historial por páginas (keyset en MongoDB): se guarda en session_state la pila de cursores
+    # de las páginas visitadas, y se reinicia al cambiar los dispositivos filtrados
+    dispositivos = tuple(sorted(ids_filtrados))
+    clave = f"paginas_comida_{dominio_seleccionado}"
+    if st.session_state.get(f"{clave}_ids") != dispositivos:
+        st.session_state[clave] = [None]
+        st.session_state[f"{clave}_ids"] = dispositivos
+    paginas = st.session_state[clave]
+
+    registros, siguiente = cargar_historial_comida(dispositivos, EVENTOS_POR_PAGINA, paginas[-1])
+    if not registros:
+        st.info("ℹ️ No hay registros de alimentación aún.")
+        return
+
+    st.dataframe(pd.DataFrame(registros)[["tiempo", "id_dispositivo"]], use_container_width=True)
+    col1, col2, col3 = st.columns([1, 2, 1])
+    if col1.button("⬅️ Más recientes", disabled=len(paginas) == 1, key=f"{clave}_anterior"):
+        paginas.pop()
+        st.rerun()
+    col2.caption(f"Página {len(paginas)}")
+    if col3.button("Más antiguos ➡️", disabled=siguiente is None, key=f"{clave}_siguiente"):
+        paginas.append(siguiente)
+        st.rerun()
+
+def mostrar_registro_comida(dominio_seleccionado, ids_filtrados=None):
     st.subheader("🍽️ Registro de Alimentación")
 
     if ids_filtrados is None:
         ids_filtrados = []
 
     # Mostrar historial colapsado
-    if registros:
-        with st.expander("📄 Historial de alimentación por dispositivo"):
-            df_comida = pd.DataFrame(registros)
-            df_comida = df_comida[df_comida["id_dispositivo"].isin(ids_filtrados)]
-            df_comida["tiempo"] = pd.to_datetime(df_comida["tiempo"])
-            df_ordenado = df_comida.sort_values("tiempo", ascending=False)
-            df_ordenado["tiempo"] = df_ordenado["tiempo"].dt.strftime("%Y-%m-%d %H:%M:%S")
-            st.dataframe(df_ordenado[["tiempo", "id_dispositivo"]], use_container_width=True)
-    else:
-        st.info("ℹ️ No hay registros de alimentación aún.")
-        return
+    with st.expander("📄 Historial de alimentación por dispositivo"):
+        mostrar_historial_comida(dominio_seleccionado, ids_filtrados)
 
     try:
-        client = MongoClient(MONGO_URI)
-        db = client["biorreactor_app"]
-        collection = db[dominio_seleccionado]
-        dispositivos_db = collection.distinct("id_dispositivo")
-        dispositivos_ordenados = sorted([d for d in dispositivos_db if d and d in ids_filtrados])
+        dispositivos_ordenados = [d for d in cargar_dispositivos_dominio(dominio_seleccionado) if d in ids_filtrados]
     except Exception as e:
         st.error(f"❌ Error al obtener dispositivos del dominio '{dominio_seleccionado}': {e}")
         return
@@ -203,12 +280,12 @@ def mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=None)
 
     st.markdown("### 📋 Estado actual de alimentación por dispositivo")
     ahora_chile = datetime.now(pytz.timezone("America/Santiago"))
+    # Última alimentación de cada dispositivo en una sola agregación (sin importar su antigüedad)
+    ultimas = cargar_ultima_comida(tuple(dispositivos_ordenados))
 
     for dispositivo in dispositivos_ordenados:
-        registros_dispositivo = [r for r in registros if r["id_dispositivo"] == dispositivo]
-        if registros_dispositivo:
-            ultimo = max(registros_dispositivo, key=lambda x: x["tiempo"])
-            ultima_fecha = pd.to_datetime(ultimo["tiempo"])
+        ultima_fecha = ultimas.get(dispositivo)
+        if ultima_fecha is not None:
             dias_sin_alimentar = (ahora_chile.date() - ultima_fecha.date()).days
             ultima_str = ultima_fecha.strftime("%Y-%m-%d %H:%M:%S")
         else:
@@ -241,14 +318,16 @@ def mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=None)
                         "https://biorreactor-app-api.onrender.com/api/registro_comida",
                         json={"evento": "comida", "id_dispositivo": dispositivo}
                     )
-                    if response.status_code == 201:
+                    # 202: la API lo dejó en su cola de ingesta y se escribirá en el próximo lote
+                    if response.status_code in (201, 202):
+                        cache_lectura.invalidar("comida")
                         st.success(f"✅ Alimentación registrada para {dispositivo}.")
                         st.rerun()
                     else:
                         st.error(f"❌ Error al registrar para {dispositivo}")
 
 # --- GRAFICOS ---
-def mostrar_graficos(df):
+def mostrar_graficos(df, desde=None, hasta=None):
     st.subheader("📈 Visualización de Sensores por Dispositivo")
 
     dispositivos = sorted(df["id_dispositivo"].dropna().unique())
@@ -276,11 +355,10 @@ def mostrar_graficos(df):
     df_id = df[df["id_dispositivo"] == st.session_state.dispositivo_seleccionado]
 
     # Botón para descargar datos de dispositivo filtrado
-    st.download_button(
-        label="📥 Descargar datos filtrados del dispositivo",
-        data=df_id.to_csv(index=False).encode('utf-8'),
-        file_name=f"datos_{id_seleccionado}.csv",
-        mime='text/csv'
+    dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_ucn")
+    botones_exportar(
+        "📥 Descargar datos filtrados del dispositivo",
+        dominio=dominio_actual, dispositivos=[id_seleccionado], desde=desde, hasta=hasta
     )
 
     variables = {
@@ -298,9 +376,10 @@ def mostrar_graficos(df):
     for i, (var, (nombre, unidad, color)) in enumerate(variables.items()):
         with tabs[i]:
             if var in df_id.columns:
+                serie = reducir_serie(df_id, var)
                 fig = go.Figure()
                 fig.add_trace(go.Scatter(
-                    x=df_id["tiempo"], y=df_id[var],
+                    x=serie["tiempo"], y=serie[var],
                     mode="lines+markers",
                     name=nombre,
                     line=dict(color=color, width=2),
@@ -321,9 +400,9 @@ def mostrar_graficos(df):
         if seleccionados and var_multi:
             fig = go.Figure()
             for disp in seleccionados:
-                df_disp = df[df["id_dispositivo"] == disp]
+                serie = reducir_serie(df[df["id_dispositivo"] == disp], var_multi)
                 fig.add_trace(go.Scatter(
-                    x=df_disp["tiempo"], y=df_disp[var_multi],
+                    x=serie["tiempo"], y=serie[var_multi],
                     mode="lines+markers", name=disp
                 ))
             fig.update_layout(
@@ -334,18 +413,16 @@ def mostrar_graficos(df):
             st.plotly_chart(fig, use_container_width=True)
 
 # --- IMÁGENES ---
-def mostrar_imagenes(db):
-    st.subheader("🖼️ Visualización de Imágenes Capturadas")
-
-    collection = db["imagenes_camara"]
+# Solo la miniatura viaja en la consulta; la imagen completa se descarga al pedirla
+PROYECCION_MINIATURAS = {"tiempo": 1, "miniatura": 1, "imagen_ref": 1, "id_dispositivo": 1}
 
-    # Parámetros de filtrado 
-    col1, col2 = st.columns(2)
-    with col1:
-        fecha_filtrada = st.date_input("📅 Filtrar por fecha (opcional):", value=None)
-    with col2:
-        cantidad = st.number_input("🔢 ¿Cuántas imágenes mostrar?", min_value=1, max_value=50, value=5, step=1)
+@st.cache_data(max_entries=20, show_spinner=False)
+def cargar_imagen_completa(id_imagen):
+    doc = obtener_db()["imagenes_camara"].find_one({"_id": ObjectId(id_imagen)}, {"miniatura": 0})
+    return leer_imagen(doc) if doc else None
 
+@cache_lectura.cacheado("imagenes")
+def cargar_miniaturas(fecha_filtrada, cantidad):
     query = {}
     if fecha_filtrada:
         inicio_dia = datetime.combine(fecha_filtrada, datetime.min.time()).replace(tzinfo=pytz.timezone("America/Santiago"))
@@ -354,23 +431,50 @@ def mostrar_imagenes(db):
             "$gte": inicio_dia.astimezone(pytz.utc),
             "$lte": fin_dia.astimezone(pytz.utc)
         }
+    return list(obtener_db()["imagenes_camara"].find(query, PROYECCION_MINIATURAS).sort("tiempo", -1).limit(cantidad))
 
-    documentos = list(collection.find(query).sort("tiempo", -1).limit(cantidad))
+def mostrar_imagenes(db):
+    st.subheader("🖼️ Visualización de Imágenes Capturadas")
+
+    # Parámetros de filtrado 
+    col1, col2 = st.columns(2)
+    with col1:
+        fecha_filtrada = st.date_input("📅 Filtrar por fecha (opcional):", value=None)
+    with col2:
+        cantidad = st.number_input("🔢 ¿Cuántas imágenes mostrar?", min_value=1, max_value=50, value=5, step=1)
+
+    documentos = cargar_miniaturas(fecha_filtrada, int(cantidad))
 
     if not documentos:
         st.info("⚠️ No hay imágenes para mostrar con los filtros seleccionados.")
         return
 
-    # Mostrar imágenes en columnas
+    # Mostrar miniaturas en columnas
+    chile_tz = pytz.timezone("America/Santiago")
     cols = st.columns(len(documentos))
     for idx, doc in enumerate(documentos):
-        if 'imagen' in doc and 'tiempo' in doc:
-            imagen_bytes = base64.b64decode(doc['imagen'])
-            imagen = Image.open(BytesIO(imagen_bytes))
-            chile_tz = pytz.timezone("America/Santiago")
-            tiempo_chile = doc["tiempo"].replace(tzinfo=pytz.utc).astimezone(chile_tz)
-            tiempo_str = tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')
-            cols[idx].image(imagen, caption=f"Capturada el {tiempo_str}", use_container_width=True)
+        if 'tiempo' not in doc:
+            continue
+        tiempo_chile = doc["tiempo"].replace(tzinfo=pytz.utc).astimezone(chile_tz)
+        tiempo_str = tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')
+        if doc.get("id_dispositivo"):
+            tiempo_str += f" · {doc['id_dispositivo']}"
+        with cols[idx]:
+            if doc.get("miniatura"):
+                st.image(Image.open(BytesIO(doc["miniatura"])), caption=f"Capturada el {tiempo_str}", use_container_width=True)
+            else:
+                st.caption(f"🕒 {tiempo_str} (imagen antigua sin miniatura)")
+            if st.button("🔍 Ver completa", key=f"imagen_{doc['_id']}"):
+                st.session_state["imagen_completa"] = str(doc["_id"])
+
+    # Imagen en resolución completa, solo a pedido
+    id_completa = st.session_state.get("imagen_completa")
+    if id_completa and any(str(doc["_id"]) == id_completa for doc in documentos):
+        imagen_bytes = cargar_imagen_completa(id_completa)
+        if imagen_bytes:
+            st.image(Image.open(BytesIO(imagen_bytes)), caption="Resolución completa", use_container_width=True)
+        else:
+            st.warning("⚠️ No se encontró la imagen completa.")
 
 # --- REGISTRO MANUAL ---
 def mostrar_registro_manual():
@@ -432,6 +536,7 @@ def mostrar_registro_manual():
             response = requests.post("https://biorreactor-app-api.onrender.com/api/registro_manual", json=data)
 
             if response.status_code == 201:
+                cache_lectura.invalidar("manual")
                 st.success(f"✅ Registro enviado correctamente para `{dispositivo}`.")
                 st.session_state["registro_manual_exitoso"] = True
                 st.session_state["ultimo_dispositivo_registrado"] = dispositivo
@@ -452,14 +557,7 @@ def mostrar_registro_manual():
         return
 
     try:
-        client = MongoClient(MONGO_URI)
-        db = client["biorreactor_app"]
-        collection = db[dominio_actual]
-
-        registros_manuales = list(collection.find({
-            "id_dispositivo": ultimo,
-            "manual": True
-        }).sort("tiempo", -1).limit(50))
+        registros_manuales = cargar_registros_manuales(dominio_actual, ultimo, limit=50)
 
         if registros_manuales:
             df_hist = pd.DataFrame(registros_manuales)
@@ -482,12 +580,8 @@ def mostrar_historial_manual():
     dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_ucn")
 
     try:
-        client = MongoClient(MONGO_URI)
-        db = client["biorreactor_app"]
-        collection = db[dominio_actual]
-
         # Obtener registros manuales
-        registros_manuales = list(collection.find({"manual": True}).sort("tiempo", -1).limit(500))
+        registros_manuales = cargar_registros_manuales(dominio_actual)
 
         if not registros_manuales:
             st.info("ℹ️ No hay registros manuales disponibles.")
@@ -564,19 +658,68 @@ def mostrar_historial_manual():
             columnas = [col for col in columnas if col in df_manual.columns]
             st.dataframe(df_manual[columnas], use_container_width=True)
 
-        # Botón para descarga en CSV
-        csv_manual = df_manual[columnas].to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="⬇️ Descargar CSV de registros manuales",
-            data=csv_manual,
-            file_name=f"registros_manuales_{dominio_actual}.csv",
-            mime="text/csv"
-        )
+        # Botones de descarga de todos los registros manuales del dominio
+        botones_exportar("⬇️ Descargar registros manuales", dominio=dominio_actual, manual=True)
 
     except Exception as e:
         st.error(f"❌ Error al cargar registros manuales: {e}")
 
 # --- COMPARACIÓN DE REGISTROS ---
+@st.cache_data(ttl=600, show_spinner=False)
+def cargar_rollup_diario(dominio, dispositivo):
+    return obtener_rollup(dominio, 'dia', dispositivos=[dispositivo])
+
+@st.cache_data(ttl=600, show_spinner=False)
+def cargar_manual_vs_sensor(dominio, dispositivo):
+    return obtener_manual_vs_sensor(dominio, dispositivos=[dispositivo])
+
+def comparacion_diaria(dominio, dispositivo, vars_medibles):
+    # Una fila por día con <variable>_manual (primer registro manual), <variable>_sensor
+    # (promedio de sensores) y <variable>_diff; None si el dispositivo no tiene registros
+    if analitica.disponible():
+        # Cruce de los rollups diarios en DuckDB (solo los días con ambos tipos de registro)
+        filas = cargar_manual_vs_sensor(dominio, dispositivo)
+        if not filas:
+            return None if not cargar_rollup_diario(dominio, dispositivo) else pd.DataFrame()
+        df_comp = pd.DataFrame(filas).rename(columns=lambda col: col.replace("_diferencia", "_diff"))
+        df_comp["fecha"] = pd.to_datetime(df_comp["dia"]).dt.date
+        return df_comp.drop(columns=["dia", "id_dispositivo"]).round(2)
+
+    # Sin duckdb: el mismo cruce en pandas sobre los rollups diarios
+    filas = cargar_rollup_diario(dominio, dispositivo)
+    if not filas:
+        return None
+
+    df = pd.DataFrame(filas)
+    df["fecha"] = pd.to_datetime(df["tiempo"]).dt.date
+
+    # Separar registros manuales y automáticos
+    df_manual = df[df["manual"] == True].copy()
+    df_auto = df[(df["manual"] != True)].copy()
+
+    if df_manual.empty or df_auto.empty:
+        return pd.DataFrame()
+
+    # Promedio diario de los automáticos
+    df_auto_grouped = df_auto[["fecha"] + [f"{var}_media" for var in vars_medibles]]
+    df_auto_grouped = df_auto_grouped.rename(columns=lambda col: col.replace("_media", "")).round(2)
+
+    # Primer registro manual de cada día
+    columnas_primero = [f"{var}_primero" for var in vars_medibles if f"{var}_primero" in df_manual.columns]
+    df_manual_grouped = df_manual[["fecha"] + columnas_primero]
+    df_manual_grouped = df_manual_grouped.rename(columns=lambda col: col.replace("_primero", "")).round(2)
+
+    # Combinar ambos por fecha
+    df_comp = pd.merge(df_manual_grouped, df_auto_grouped, on="fecha", suffixes=("_manual","_sensor"))
+
+    # Calcular diferencia por variable
+    for var in vars_medibles:
+        col_manual = f"{var}_manual"
+        col_sensor = f"{var}_sensor"
+        if col_manual in df_comp.columns and col_sensor in df_comp.columns:
+            df_comp[f"{var}_diff"] = (df_comp[col_manual] - df_comp[col_sensor]).round(2)
+    return df_comp
+
 def mostrar_registro_manual_vs_sensor():
     st.subheader("📋 Comparación por Día: Registro Manual vs Sensor")
 
@@ -589,47 +732,21 @@ def mostrar_registro_manual_vs_sensor():
 
     dispositivo = st.selectbox("📟 Selecciona un dispositivo:", ids)
 
+    # Variables a comparar
+    vars_medibles = ["temperatura", "ph", "turbidez", "oxigeno", "conductividad"]
+
     try:
-        client = MongoClient(MONGO_URI)
-        db = client["biorreactor_app"]
-        collection = db[dominio_actual]
+        if not rollups_listos(dominio_actual, 'dia'):
+            st.info("⏳ Los resúmenes diarios de este dominio aún están pendientes (worker_rollups.py). Vuelve a intentarlo en unos minutos.")
+            return
 
-        # Cargar registros
-        registros = list(collection.find({"id_dispositivo": dispositivo}))
-        if not registros:
+        df_comp = comparacion_diaria(dominio_actual, dispositivo, vars_medibles)
+        if df_comp is None:
             st.info("ℹ️ No hay registros para este dispositivo.")
             return
-        
-        df = pd.DataFrame(registros)
-        df["tiempo"] = pd.to_datetime(df["tiempo"])
-        df["fecha"] = df["tiempo"].dt.date
-
-        # Variables a comparar
-        vars_medibles = ["temperatura", "ph", "turbidez", "oxigeno", "conductividad"]
-
-        # Separar registros manuales y automáticos
-        df_manual = df[df["manual"] == True].copy()
-        df_auto = df[(df["manual"] != True)].copy()
-
-        if df_manual.empty or df_auto.empty:
+        if df_comp.empty:
             st.info("ℹ️ Se necesitan registros manuales y automáticos para comparar.")
             return
-        
-        # Agrupar automáticos por día (mediana o promedio)
-        df_auto_grouped = df_auto.groupby("fecha")[vars_medibles].mean().round(2).reset_index() #.median() - Mediana
-
-        # Agrupar manuales por día (uno por día)
-        df_manual_grouped = df_manual.groupby("fecha")[vars_medibles].first().round(2).reset_index()
-
-        # Combinar ambos por fecha
-        df_comp = pd.merge(df_manual_grouped, df_auto_grouped, on="fecha", suffixes=("_manual","_sensor"))
-
-        # Calcular diferencia por variable
-        for var in vars_medibles:
-            col_manual = f"{var}_manual"
-            col_sensor = f"{var}_sensor"
-            if col_manual in df_comp.columns and col_sensor in df_comp.columns:
-                df_comp[f"{var}_diff"] = (df_comp[col_manual] - df_comp[col_sensor]).round(2)
 
         # Mostrar tabla comparativa
         columnas_mostrar = ["fecha"]
@@ -706,3 +823,29 @@ def mostrar_registro_manual_vs_sensor():
 
     except Exception as e:
         st.error(f"❌ Error al obtener los registros: {e}")
+
+# --- DIAGNÓSTICO ---
+def mostrar_diagnostico():
+    with st.sidebar.expander("🛠️ Diagnóstico", expanded=False):
+        st.markdown("**Conexiones MongoDB (proceso)**")
+        resumen = estadisticas_conexiones()
+        col1, col2 = st.columns(2)
+        col1.metric("Abiertas", resumen["conexiones_abiertas"])
+        col2.metric("En uso", resumen["conexiones_en_uso"])
+        col1.metric("Espera prom.", f"{resumen['espera_promedio_ms']:.1f} ms")
+        col2.metric("Espera máx.", f"{resumen['espera_max_ms']:.1f} ms")
+        st.json(resumen, expanded=False)
+
+        st.markdown("**Caché de lecturas (proceso)**")
+        resumen_cache = cache_lectura.resumen()
+        col1, col2 = st.columns(2)
+        col1.metric("Aciertos", resumen_cache["aciertos"])
+        col2.metric("Fallos", resumen_cache["fallos"])
+        col1.metric("Entradas", resumen_cache["entradas"])
+        col2.metric("Memoria", f"{resumen_cache['memoria_mb']} / {resumen_cache['maximo_mb']} MB")
+        st.json(resumen_cache, expanded=False)
+
+        seguidores = resumen_seguidores()
+        if seguidores:
+            st.markdown("**Modo en vivo (colecciones seguidas)**")
+            st.json(seguidores, expanded=False)
@@ -1,42 +1,317 @@
 import serial
 import time
 import json
+import os
+import queue
+import shutil
+import threading
 import requests
+from datetime import datetime, timezone
+from itertools import islice
 
 # Configurar puerto serial y velocidad y url api de flask app
-SERIAL_PORT = 'COM7'
-BAUD_RATE = 9600
-API_URL_SENSORES = 'http://localhost:5000/api/sensores'
-API_URL_REGISTRO_COMIDA = 'http://localhost:5000/api/registro_comida'
+SERIAL_PORT = os.environ.get('SERIAL_PORT', 'COM7')
+BAUD_RATE = int(os.environ.get('BAUD_RATE', 9600))
+API_URL = os.environ.get('API_URL', 'http://localhost:5000')
 
-ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
-print("Esperando datos JSON del sensor...")
+# Parámetros del buffer y del envío
+TAMANO_COLA = 10000         # Lecturas máximas en memoria antes de desbordar al spool
+TAMANO_LOTE = 500           # Lecturas por petición a /api/sensores/batch
+INTERVALO_ENVIO = 1.0       # Segundos máximos que una lectura espera en memoria
+TIMEOUT_HTTP = 10           # Segundos por petición
+ESPERA_REINTENTO = 2        # Segundos entre reintentos cuando la API no responde
+RUTA_SPOOL = os.environ.get('RUTA_SPOOL', 'spool_lecturas.ndjson')
 
-while True:
-    try:
-        line = ser.readline().decode('utf-8').strip()
-        print(f"Recibido: {line}")
+# --- SPOOL EN DISCO ---
+class Spool:
+    # Archivo NDJSON de solo escritura al final con las lecturas aún no confirmadas por la API
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+
+    def agregar(self, entradas):
+        # Cada entrada es {'url': ..., 'dato': ...}; un único fsync por llamada
+        if not entradas:
+            return
+        with self.lock:
+            with open(self.ruta, 'a', encoding='utf-8') as f:
+                # Un corte de energía puede dejar la última línea a medias: sin este salto la
+                # entrada nueva quedaría pegada a ella y se descartarían las dos al leer
+                if not self._termina_en_linea():
+                    f.write('\n')
+                for entrada in entradas:
+                    f.write(json.dumps(entrada) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _termina_en_linea(self):
+        if not self.hay_pendientes():
+            return True
+        with open(self.ruta, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def hay_pendientes(self):
+        return os.path.exists(self.ruta) and os.path.getsize(self.ruta) > 0
+
+    def leer(self, desde=0, maximo=None):
+        # Hasta maximo entradas desde el byte desde; devuelve (entradas, byte siguiente)
+        with self.lock:
+            if not os.path.exists(self.ruta):
+                return [], desde
+            with open(self.ruta, 'rb') as f:
+                f.seek(desde)
+                entradas = []
+                for linea in islice(f, maximo):
+                    try:
+                        entradas.append(json.loads(linea.decode('utf-8')))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        pass  # Línea truncada por un corte de energía
+                return entradas, f.tell()
+
+    def reemplazar(self, fin, restantes):
+        # Quita del archivo lo leído hasta el byte fin, dejando primero las entradas que no se
+        # pudieron entregar y después las que llegaron durante el reenvío
+        with self.lock:
+            temporal = self.ruta + '.tmp'
+            with open(self.ruta, 'rb') as origen, open(temporal, 'wb') as f:
+                for entrada in restantes:
+                    f.write((json.dumps(entrada) + '\n').encode('utf-8'))
+                origen.seek(fin)
+                shutil.copyfileobj(origen, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta)
+
+# --- REENVIADOR SERIAL -> API ---
+class Reenviador:
+    def __init__(self, puerto, api_url=API_URL, ruta_spool=RUTA_SPOOL,
+                 tamano_cola=TAMANO_COLA, tamano_lote=TAMANO_LOTE, intervalo_envio=INTERVALO_ENVIO):
+        self.puerto = puerto
+        self.url_lote = f'{api_url}/api/sensores/batch'
+        self.url_comida = f'{api_url}/api/registro_comida'
+        self.cola = queue.Queue(maxsize=tamano_cola)
+        self.spool = Spool(ruta_spool)
+        self.tamano_lote = tamano_lote
+        self.intervalo_envio = intervalo_envio
+        self.detener = threading.Event()
+
+        # Sesión HTTP persistente (keep-alive) compartida por todos los envíos
+        self.sesion = requests.Session()
+
+        self.estadisticas = {
+            'leidas': 0,
+            'invalidas': 0,
+            'enviadas': 0,
+            'rechazadas': 0,
+            'desbordadas': 0,
+            'reenviadas_spool': 0
+        }
+
+        self.hilo_lector = threading.Thread(target=self._leer, name='lector-serial', daemon=True)
+        self.hilo_envio = threading.Thread(target=self._enviar, name='envio-api', daemon=True)
+
+    def iniciar(self):
+        self.hilo_lector.start()
+        self.hilo_envio.start()
+
+    def cerrar(self, timeout=10):
+        self.detener.set()
+        self.hilo_lector.join(timeout)
+        self.hilo_envio.join(timeout)
+        # Lo que quede en memoria se guarda para el próximo arranque
+        restantes = []
+        while True:
+            try:
+                restantes.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        self.spool.agregar(restantes)
+        self.sesion.close()
+
+    def _lineas(self):
+        # pyserial.readline() lee byte a byte; se lee lo disponible en bloque y se corta por líneas
+        if not hasattr(self.puerto, 'in_waiting'):
+            while not self.detener.is_set():
+                yield self.puerto.readline()
+            return
+
+        pendiente = b''
+        while not self.detener.is_set():
+            bloque = self.puerto.read(max(1, self.puerto.in_waiting))
+            if not bloque:
+                continue
+            *lineas, pendiente = (pendiente + bloque).split(b'\n')
+            yield from lineas
+
+    # El hilo lector nunca espera a la red: solo parsea y encola
+    def _leer(self):
+        lineas = self._lineas()
+        while not self.detener.is_set():
+            try:
+                line = next(lineas, b'')
+                if not line:
+                    continue
+                line = line.decode('utf-8').strip()
+                if not line:
+                    continue
+
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise json.JSONDecodeError('Se esperaba un objeto', line, 0)
+                self.estadisticas['leidas'] += 1
 
-        # Convertir la linea a JSON
-        data = json.loads(line)
+                # Decidir a qué endpoint mandar
+                if "evento" in data:
+                    url = self.url_comida
+                else:
+                    url = self.url_lote
+                    # El tiempo se registra al leer, ya que el envío puede demorarse
+                    data.setdefault('tiempo', datetime.now(timezone.utc).isoformat())
 
-        # Decidir a qué endpoint mandar
-        if "evento" in data:
-            url = API_URL_REGISTRO_COMIDA
-        else:
-            url = API_URL_SENSORES
+                try:
+                    self.cola.put_nowait({'url': url, 'dato': data})
+                except queue.Full:
+                    self.estadisticas['desbordadas'] += 1
+                    self.spool.agregar([{'url': url, 'dato': data}])
 
-        # Enviar a la API
-        response = requests.post(url, json=data)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self.estadisticas['invalidas'] += 1
+                print("Línea recibida no es JSON válido")
 
-        if response.status_code == 201:
-            print("Datos enviados correctamente")
-        else:
-            print("Error al enviar:", response.text)
+            except Exception as e:
+                print(f"Error de lectura serial: {e}")
+                time.sleep(ESPERA_REINTENTO)
+                lineas = self._lineas()
 
-    except json.JSONDecodeError:
-        print("Línea recibida no es JSON válido")
+    def _tomar_lote(self):
+        # Junta lecturas hasta completar el lote o cumplir el intervalo de envío
+        lote = []
+        limite = time.monotonic() + self.intervalo_envio
+        while len(lote) < self.tamano_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _enviar(self):
+        while not (self.detener.is_set() and self.cola.empty()):
+            lote = self._tomar_lote()
+
+            # Primero se vacía el spool para respetar el orden de llegada
+            if self.spool.hay_pendientes() and not self._reenviar_spool():
+                self.spool.agregar(lote)
+                if self.detener.wait(ESPERA_REINTENTO):
+                    return
+                continue
+
+            if not lote:
+                continue
+
+            pendientes = self._enviar_entradas(lote)
+            if pendientes:
+                self.spool.agregar(pendientes)
+                self.detener.wait(ESPERA_REINTENTO)
+
+    def _reenviar_spool(self):
+        # Por bloques de tamano_lote: tras horas sin red el spool puede ser grande y no se carga
+        # entero en memoria. El archivo se compacta una vez, al terminar o al fallar un envío
+        posicion = 0
+        reenviadas = 0
+        pendientes = []
+        while True:
+            entradas, siguiente = self.spool.leer(posicion, self.tamano_lote)
+            if siguiente == posicion:
+                break
+            pendientes = self._enviar_entradas(entradas)
+            reenviadas += len(entradas) - len(pendientes)
+            posicion = siguiente
+            if pendientes:
+                break
+        self.estadisticas['reenviadas_spool'] += reenviadas
+        if reenviadas or not pendientes:
+            # Sin nada entregado (API caída) el archivo queda como estaba
+            self.spool.reemplazar(posicion, pendientes)
+        if not pendientes:
+            print(f"Spool reenviado: {reenviadas} lecturas")
+        return not pendientes
+
+    def _enviar_entradas(self, entradas):
+        # Devuelve las entradas que no se pudieron entregar (API caída o error de red)
+        lecturas = [e['dato'] for e in entradas if e['url'] == self.url_lote]
+        eventos = [e for e in entradas if e['url'] != self.url_lote]
+
+        for i in range(0, len(lecturas), self.tamano_lote):
+            lote = lecturas[i:i + self.tamano_lote]
+            if not self._post_lote(lote):
+                restantes = [{'url': self.url_lote, 'dato': d} for d in lecturas[i:]]
+                return restantes + eventos
+
+        for j, entrada in enumerate(eventos):
+            if not self._post(entrada['url'], entrada['dato']):
+                return eventos[j:]
+        return []
+
+    def _post_lote(self, lote):
+        try:
+            response = self.sesion.post(self.url_lote, json=lote, timeout=TIMEOUT_HTTP)
+        except requests.RequestException as e:
+            print(f"Error al enviar lote: {e}")
+            return False
+
+        # 201/207/400 significan que la API procesó el lote: los rechazos no se reintentan
+        if response.status_code in (201, 207, 400):
+            try:
+                resumen = response.json()
+                self.estadisticas['enviadas'] += resumen.get('aceptados', 0)
+                self.estadisticas['rechazadas'] += resumen.get('rechazados', 0)
+            except ValueError:
+                self.estadisticas['enviadas'] += len(lote)
+            if response.status_code != 201:
+                print("Lecturas rechazadas por la API:", response.text[:500])
+            return True
+
+        print("Error al enviar:", response.status_code, response.text[:200])
+        return False
+
+    def _post(self, url, data):
+        try:
+            response = self.sesion.post(url, json=data, timeout=TIMEOUT_HTTP)
+        except requests.RequestException as e:
+            print(f"Error al enviar evento: {e}")
+            return False
+
+        # 202: la API la dejó en su cola de ingesta (INGESTA_MODO=cola); reenviarla la duplicaría
+        if response.status_code in (201, 202):
+            self.estadisticas['enviadas'] += 1
+            return True
+        if 400 <= response.status_code < 500:
+            self.estadisticas['rechazadas'] += 1
+            print("Evento rechazado por la API:", response.text)
+            return True
+        print("Error al enviar:", response.status_code, response.text[:200])
+        return False
+
+def main():
+    # Timeout de lectura corto para que el hilo lector pueda detenerse limpiamente
+    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+    reenviador = Reenviador(ser)
+    reenviador.iniciar()
+    print("Esperando datos JSON del sensor...")
+
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Estadísticas: {reenviador.estadisticas} | en cola: {reenviador.cola.qsize()}")
+    except KeyboardInterrupt:
+        print("Deteniendo lector serial...")
+    finally:
+        reenviador.cerrar()
+        ser.close()
 
-    except Exception as e:
-        print(f"Error: {e}")
-        time.sleep(2)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
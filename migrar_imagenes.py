@@ -0,0 +1,59 @@
+import argparse
+import base64
+import binascii
+from database import obtener_db
+from almacen_imagenes import campos_imagen, decodificar_jpeg, obtener_almacen
+
+TAMANO_LOTE = 20
+
+# Pasa las imágenes guardadas en base64 dentro de imagenes_camara al almacén configurado,
+# agregando su miniatura. Los bytes JPEG originales se guardan tal cual (sin recomprimir).
+def migrar(collection, almacen, tamano_lote, limite=None):
+    migradas = fallidas = 0
+    filtro = {"imagen": {"$exists": True}}
+    ultimo_id = None
+
+    while limite is None or migradas + fallidas < limite:
+        if ultimo_id is not None:
+            filtro["_id"] = {"$gt": ultimo_id}
+        lote = list(collection.find(filtro, {"tiempo": 1, "imagen": 1}).sort("_id", 1).limit(tamano_lote))
+        if not lote:
+            break
+
+        for doc in lote:
+            ultimo_id = doc["_id"]
+            try:
+                datos = base64.b64decode(doc["imagen"])
+                frame = decodificar_jpeg(datos)
+                campos = campos_imagen(datos, frame, doc["tiempo"], almacen, {"migrada_de": str(doc["_id"])})
+            except (binascii.Error, ValueError, KeyError) as e:
+                print(f"⚠️ No se pudo migrar {doc['_id']}: {e}")
+                fallidas += 1
+                continue
+
+            # La imagen base64 se elimina del documento solo después de guardar la copia
+            collection.update_one({"_id": doc["_id"]}, {"$set": campos, "$unset": {"imagen": ""}})
+            migradas += 1
+
+        print(f"   {migradas} migradas, {fallidas} fallidas")
+
+    return migradas, fallidas
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra imágenes base64 de imagenes_camara a GridFS o disco con miniaturas.")
+    parser.add_argument("--almacen", choices=["gridfs", "local"], help="Almacén destino (por defecto ALMACEN_IMAGENES)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Documentos por lote")
+    parser.add_argument("--limite", type=int, help="Migrar como máximo esta cantidad de imágenes")
+    args = parser.parse_args()
+
+    db = obtener_db()
+    almacen = obtener_almacen(args.almacen, db)
+    collection = db["imagenes_camara"]
+
+    pendientes = collection.count_documents({"imagen": {"$exists": True}})
+    print(f"🔁 {pendientes} imágenes en base64 por migrar al almacén '{almacen.nombre}'")
+    migradas, fallidas = migrar(collection, almacen, args.lote, args.limite)
+    print(f"✅ {migradas} imágenes migradas, {fallidas} fallidas")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import os
+from datetime import datetime
+from pymongo import MongoClient
+from app.colecciones import (
+    PREFIJO_DOMINIO,
+    asegurar_indices,
+    crear_coleccion_timeseries,
+    es_timeseries
+)
+
+# Las colecciones originales se renombran con este prefijo (no empieza con "dominio_",
+# así el dashboard no las lista como dominios)
+PREFIJO_LEGACY = "legacy_"
+TAMANO_LOTE = 5000
+
+def reemplazar_por_timeseries(db, nombre):
+    # Renombra la colección original y crea en su lugar la time-series con el mismo nombre,
+    # de modo que la API siga escribiendo en "nombre" durante la copia
+    legacy = PREFIJO_LEGACY + nombre
+    if legacy not in db.list_collection_names():
+        db[nombre].rename(legacy)
+
+    while not crear_coleccion_timeseries(db, nombre):
+        if es_timeseries(db, nombre):
+            break
+        # Una inserción alcanzó a recrear la colección como normal (o quedó de un intento
+        # anterior): sus documentos se mueven a legacy y se reintenta
+        documentos = list(db[nombre].find())
+        if documentos:
+            db[legacy].insert_many(documentos, ordered=False)
+        db[nombre].drop()
+
+    asegurar_indices(db[nombre])
+    return legacy
+
+def copiar_en_lotes(db, origen, destino, tamano_lote):
+    # El avance se guarda en la colección "migraciones" para poder reanudar una copia interrumpida
+    progreso = db["migraciones"].find_one({"_id": destino}) or {}
+    filtro = {"_id": {"$gt": progreso["ultimo_id"]}} if "ultimo_id" in progreso else {}
+
+    copiados = progreso.get("copiados", 0)
+    omitidos = progreso.get("omitidos", 0)
+    lote = []
+
+    def escribir(lote, ultimo_id):
+        nonlocal copiados, omitidos
+        validos = [doc for doc in lote if isinstance(doc.get("tiempo"), datetime)]
+        omitidos += len(lote) - len(validos)
+        if validos:
+            db[destino].insert_many(validos, ordered=False)
+        copiados += len(validos)
+        db["migraciones"].update_one(
+            {"_id": destino},
+            {"$set": {"ultimo_id": ultimo_id, "copiados": copiados, "omitidos": omitidos}},
+            upsert=True
+        )
+        print(f"   {copiados} copiados, {omitidos} omitidos (sin tiempo válido)")
+
+    for doc in db[origen].find(filtro).sort("_id", 1).batch_size(tamano_lote):
+        lote.append(doc)
+        if len(lote) >= tamano_lote:
+            escribir(lote, doc["_id"])
+            lote = []
+    if lote:
+        escribir(lote, lote[-1]["_id"])
+
+    return copiados, omitidos
+
+def migrar(db, nombre, tamano_lote, eliminar_legacy):
+    legacy = PREFIJO_LEGACY + nombre
+    if es_timeseries(db, nombre) and legacy not in db.list_collection_names():
+        print(f"⏭️ {nombre} ya es time-series")
+        return
+
+    print(f"🔁 Migrando {nombre}...")
+    if not es_timeseries(db, nombre):
+        reemplazar_por_timeseries(db, nombre)
+
+    total_legacy = db[legacy].estimated_document_count()
+    copiados, omitidos = copiar_en_lotes(db, legacy, nombre, tamano_lote)
+    print(f"✅ {nombre}: {copiados} de {total_legacy} documentos copiados, {omitidos} omitidos")
+
+    if eliminar_legacy and copiados + omitidos >= total_legacy:
+        db[legacy].drop()
+        db["migraciones"].delete_one({"_id": nombre})
+        print(f"🗑️ {legacy} eliminada")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra colecciones dominio_* a colecciones time-series.")
+    parser.add_argument("dominios", nargs="*", help="Colecciones a migrar (por defecto todas las dominio_*)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Documentos por lote de copia")
+    parser.add_argument("--eliminar-legacy", action="store_true", help="Eliminar la colección original al terminar")
+    args = parser.parse_args()
+
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+
+    client = MongoClient(mongo_uri)
+    db = client["biorreactor_app"]
+
+    dominios = args.dominios or sorted(c for c in db.list_collection_names() if c.startswith(PREFIJO_DOMINIO))
+    for nombre in dominios:
+        migrar(db, nombre, args.lote, args.eliminar_legacy)
+
+    client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+from pymongo import MongoClient
+from app.colecciones import PREFIJO_DOMINIO, asegurar_indices
+
+# Consultas representativas de las rutas de lectura (API y dashboard)
+def consultas_representativas(collection):
+    ejemplo = collection.find_one({"id_dispositivo": {"$exists": True}}, {"id_dispositivo": 1})
+    id_ejemplo = ejemplo["id_dispositivo"] if ejemplo else "desconocido"
+
+    return [
+        ("/api/datos", {}, 200),
+        ("/api/datos?id_dispositivo", {"id_dispositivo": id_ejemplo}, 200),
+        ("database.obtener_datos", {}, 5000),
+        ("mostrar_historial_manual", {"manual": True}, 500),
+        ("mostrar_registro_manual", {"id_dispositivo": id_ejemplo, "manual": True}, 50),
+        ("mostrar_registro_manual_vs_sensor", {"id_dispositivo": id_ejemplo}, 0),
+    ]
+
+def resumir_plan(plan):
+    # Recorre el plan ganador y devuelve (índices usados, hay COLLSCAN, hay SORT en memoria)
+    indices, collscan, sort_memoria = [], False, False
+    pendientes = [plan.get("queryPlan", plan)]
+    while pendientes:
+        etapa = pendientes.pop()
+        nombre = etapa.get("stage")
+        if nombre == "IXSCAN":
+            indices.append(etapa.get("indexName"))
+        elif nombre == "COLLSCAN":
+            collscan = True
+        elif nombre == "SORT":
+            sort_memoria = True
+        if "inputStage" in etapa:
+            pendientes.append(etapa["inputStage"])
+        pendientes.extend(etapa.get("inputStages", []))
+    return indices, collscan, sort_memoria
+
+def reportar(collection):
+    print(f"\n📦 {collection.name} ({collection.estimated_document_count()} documentos)")
+    print(f"   Índices: {', '.join(sorted(collection.index_information()))}")
+
+    for ruta, filtro, limite in consultas_representativas(collection):
+        cursor = collection.find(filtro).sort("tiempo", -1)
+        if limite:
+            cursor = cursor.limit(limite)
+        explicacion = cursor.explain()
+
+        indices, collscan, sort_memoria = resumir_plan(explicacion["queryPlanner"]["winningPlan"])
+        estadisticas = explicacion.get("executionStats", {})
+
+        if collscan:
+            uso = "❌ COLLSCAN"
+        else:
+            uso = "✅ " + ", ".join(indices)
+        if sort_memoria:
+            uso += " + SORT en memoria"
+
+        print(f"   {ruta:<36} {uso:<45} "
+              f"docs examinados: {estadisticas.get('totalDocsExamined', '?'):>8}  "
+              f"devueltos: {estadisticas.get('nReturned', '?'):>6}  "
+              f"{estadisticas.get('executionTimeMillis', '?')} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporta qué índice usa cada consulta de lectura (explain).")
+    parser.add_argument("dominios", nargs="*", help="Colecciones a revisar (por defecto todas las dominio_*)")
+    parser.add_argument("--asegurar", action="store_true", help="Crear los índices faltantes antes de reportar")
+    args = parser.parse_args()
+
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+
+    client = MongoClient(mongo_uri)
+    db = client["biorreactor_app"]
+
+    dominios = args.dominios or sorted(c for c in db.list_collection_names() if c.startswith(PREFIJO_DOMINIO))
+    for nombre in dominios:
+        if args.asegurar:
+            asegurar_indices(db[nombre])
+        reportar(db[nombre])
+
+    client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import os
+import time
+from datetime import datetime
+from database import obtener_db
+from app.colecciones import PREFIJO_DOMINIO
+from app.rollups import GRANULARIDADES, actualizar_rollups, asegurar_indices_rollup
+
+# Minutos entre pasadas del worker
+INTERVALO_MINUTOS = float(os.environ.get("ROLLUP_INTERVALO_MINUTOS", 5))
+
+def actualizar_todos(db, reconstruir=False):
+    for dominio in sorted(db.list_collection_names()):
+        if not dominio.startswith(PREFIJO_DOMINIO):
+            continue
+        try:
+            inicio = time.monotonic()
+            procesados = actualizar_rollups(db, dominio, GRANULARIDADES, reconstruir)
+            if procesados:
+                print(f"✅ {dominio}: rollups actualizados en {time.monotonic() - inicio:.1f} s")
+        except Exception as e:
+            print(f"❌ Error al actualizar rollups de {dominio}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantiene los rollups por hora y por día de cada dominio.")
+    parser.add_argument("--una-vez", action="store_true", help="Hacer una sola pasada y terminar")
+    parser.add_argument("--reconstruir", action="store_true", help="Recalcular los rollups desde la primera lectura")
+    args = parser.parse_args()
+
+    db = obtener_db()
+    asegurar_indices_rollup(db)
+    actualizar_todos(db, args.reconstruir)
+
+    while not args.una_vez:
+        time.sleep(INTERVALO_MINUTOS * 60)
+        print(f"🔁 Pasada de rollups {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        actualizar_todos(db)
+
+if __name__ == "__main__":
+    main()